@@ -0,0 +1,54 @@
+import json
+import logging
+
+from app.core.config import settings
+from app.core.metrics import HTTP_LATENCY, end_request, start_request
+
+logger = logging.getLogger("ras.request")
+
+
+class InstrumentationMiddleware:
+    """
+    Middleware ASGI: statistiche DB per richiesta -> header Server-Timing,
+    istogramma latenza per route e una riga di log JSON a fine risposta.
+    ASGI puro (non BaseHTTPMiddleware): niente task extra per richiesta e la durata
+    include l'invio del body, anche per le risposte in streaming.
+    Per lo streaming l'header riporta solo le query eseguite prima del primo chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats, token = start_request()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_request(token)
+            # template della route (es. /ras/month-summary): cardinalità limitata
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(stats.elapsed_ms() / 1000, route_path, scope["method"], str(status))
+            if settings.request_log_enabled:
+                logger.info(json.dumps({
+                    "method": scope["method"],
+                    "route": route_path,
+                    "path": scope["path"],
+                    "status": status,
+                    **stats.as_log(),
+                }))
@@ -1,10 +1,75 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.api.v1.health import router as health_router
-from app.api.v1.me import router as me_router
-from app.api.v1.ras import router as ras_router
+from app.api.instrumentation import InstrumentationMiddleware, logger as request_logger
+from app.api.routing import ReadRoutingMiddleware
+from app.api.v1 import health, me, ras
+from app.core.config import settings
+from app.core.db import (open_pool, close_pool, open_async_pool, close_async_pool, open_replica_pools,
+                         close_replica_pools, open_async_replica_pools, close_async_replica_pools, read_route)
+from app.core.lifecycle import process_state
+from app.repos.employees import employee_directory
+from app.repos.ras_repo import AsyncRASRepo, RASRepo
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ready solo a pool aperto (connessioni minime pronte), directory caricata e backend scaldati
+    process_state.mark_starting()
+    if settings.api_async:
+        await open_async_pool(wait=True)
+        replicas = await open_async_replica_pools(wait=True)
+        await employee_directory.aload()
+        if settings.warmup_enabled:
+            await AsyncRASRepo().warm_up(settings.db_pool_min_size)
+            for i in range(len(replicas)):
+                with read_route(replica=i):
+                    await AsyncRASRepo().warm_up(settings.db_pool_min_size)
+        employee_directory.start_async()
+    else:
+        open_pool(wait=True)
+        replicas = open_replica_pools(wait=True)
+        employee_directory.load()
+        if settings.warmup_enabled:
+            RASRepo().warm_up(settings.db_pool_min_size)
+            for i in range(len(replicas)):
+                with read_route(replica=i):
+                    RASRepo().warm_up(settings.db_pool_min_size)
+        employee_directory.start()
+    process_state.install_drain_handler(settings.server_drain_seconds)
+    process_state.mark_ready()
+    try:
+        yield
+    finally:
+        process_state.mark_draining()
+        if settings.api_async:
+            await employee_directory.stop_async()
+            await close_async_replica_pools()
+            await close_async_pool()
+        else:
+            employee_directory.stop()
+            close_replica_pools()
+            close_pool()
+
+
+app = FastAPI(title="RAS Assistant API", lifespan=lifespan)
+
+if settings.database_replica_urls:
+    app.add_middleware(ReadRoutingMiddleware)
 
-app = FastAPI(title="RAS Assistant API")
+if settings.metrics_enabled:
+    app.add_middleware(InstrumentationMiddleware)
+    # log JSON su stderr se nessuno ha configurato il logger (uvicorn configura solo i suoi)
+    if settings.request_log_enabled and not request_logger.handlers:
+        request_logger.addHandler(logging.StreamHandler())
+        request_logger.setLevel(logging.INFO)
+        request_logger.propagate = False
 
-app.include_router(health_router)
-app.include_router(me_router)
-app.include_router(ras_router)
\ No newline at end of file
+app.include_router(health.router)
+if settings.api_async:
+    app.include_router(me.router)
+    app.include_router(ras.router)
+else:
+    app.include_router(me.sync_router)
+    app.include_router(ras.sync_router)
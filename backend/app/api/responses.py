@@ -0,0 +1,93 @@
+"""
+Risposte dei riepiloghi mese / periodo senza la seconda validazione di FastAPI.
+
+I payload di RASService hanno già la forma di MonthSummaryOut / PeriodSummaryOut: ritornare una
+Response salta validate + serialize del response_model (che resta per OpenAPI) e il body è scritto
+da app.core.serialization.dumps. Con settings.validate_responses passano comunque dal modello
+(debug: verifica che il servizio rispetti lo schema).
+
+Richieste condizionali: ETag e Last-Modified derivano dalle versioni degli sheet del riepilogo
+(get_sheet_versions: sheet_id, sheet_status, updated_at, che i trigger aggiornano a ogni modifica
+delle righe, più sede e giorni del calendario), con sheet_version_key come la chiave della cache
+riepiloghi. If-None-Match uguale -> 304 dopo la sola lettura delle versioni, senza aggregazione.
+"""
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Any, AsyncIterator, Iterable, Iterator, Mapping
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.core.config import settings
+from app.core.serialization import dumps
+from app.repos.ras_repo import sheet_version_key
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _checked(payload: dict[str, Any], model: type[BaseModel]) -> dict[str, Any]:
+    if settings.validate_responses:
+        return model.model_validate(payload).model_dump(mode="json")
+    return payload
+
+
+def summary_response(payload: dict[str, Any], model: type[BaseModel],
+                     headers: Mapping[str, str] | None = None) -> FastJSONResponse:
+    return FastJSONResponse(_checked(payload, model), headers=headers)
+
+
+# parte dell'ETag: da cambiare quando cambia la forma dei payload (i client rileggono tutto)
+_ETAG_FORMAT = 1
+
+CONDITIONAL_RESPONSES = {
+    304: {"description": "Not Modified: If-None-Match uguale all'ETag corrente (body vuoto)"},
+}
+
+
+def conditional_headers(versions: Iterable[Mapping[str, Any]], *params: Any) -> dict[str, str]:
+    """
+    ETag, Last-Modified e Cache-Control di un riepilogo: params identifica la richiesta
+    (tipo, email, mese o range, hours_per_workday). Sheet tutti approved -> cacheabile a lungo,
+    altrimenti il client rivalida a ogni poll (e riceve 304 finché nulla cambia).
+    """
+    versions = list(versions)
+    key = repr((_ETAG_FORMAT, *params, [sheet_version_key(v) for v in versions]))
+    headers = {"ETag": f'"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}"'}
+    if versions:
+        # updated_at è TIMESTAMP senza fuso, scritto con TimeZone UTC
+        last = max(v["updated_at"] for v in versions)
+        headers["Last-Modified"] = format_datetime(last.replace(tzinfo=timezone.utc), usegmt=True)
+    if versions and all(v["sheet_status"] == "approved" for v in versions):
+        headers["Cache-Control"] = f"private, max-age={settings.http_cache_approved_max_age}"
+    else:
+        headers["Cache-Control"] = "private, no-cache"
+    return headers
+
+
+def not_modified(request: Request, headers: Mapping[str, str]) -> Response | None:
+    """
+    304 se If-None-Match contiene l'ETag corrente (confronto debole, come da RFC 9110).
+    If-Modified-Since non è usato: Last-Modified ha la risoluzione del secondo, l'ETag no.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if "*" in tags or headers["ETag"] in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+
+def ndjson_lines(items: Iterator[dict[str, Any]], model: type[BaseModel]) -> Iterator[bytes]:
+    for item in items:
+        yield dumps(_checked(item, model)) + b"\n"
+
+
+async def ndjson_lines_async(items: AsyncIterator[dict[str, Any]], model: type[BaseModel]) -> AsyncIterator[bytes]:
+    async for item in items:
+        yield dumps(_checked(item, model)) + b"\n"
@@ -0,0 +1,23 @@
+from app.core.db import read_route
+
+
+class ReadRoutingMiddleware:
+    """
+    Middleware ASGI: le letture della richiesta vanno su una replica (app/core/db.py).
+    Header X-Read-Consistency: primary -> tutta la richiesta sul primary, per chi ha appena scritto
+    e deve rileggere subito (le repliche possono essere indietro fino a replica_max_lag secondi).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        prefer_replica = True
+        for name, value in scope["headers"]:
+            if name == b"x-read-consistency":
+                prefer_replica = value.strip().lower() != b"primary"
+        with read_route(prefer_replica):
+            await self.app(scope, receive, send)
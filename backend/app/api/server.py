@@ -0,0 +1,56 @@
+"""
+Server di produzione: uvicorn con un processo worker per CPU disponibile, drain e shutdown graceful.
+
+  python -m app.api.server                     # dalla cartella backend (CMD del dockerfile)
+  SERVER_WORKERS=4 SERVER_PORT=8080 python -m app.api.server
+
+Ogni worker ha il suo pool: le connessioni verso Postgres arrivano a workers x db_pool_max_size.
+Access log di uvicorn spento: c'è già il log JSON per richiesta (settings.request_log_enabled).
+"""
+import os
+from pathlib import Path
+
+import uvicorn
+
+from app.core.config import settings
+
+# quota CPU del container (cgroup v2): "max 100000" = nessun limite, "200000 100000" = 2 CPU
+_CGROUP_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+
+
+def available_cpus() -> int:
+    """
+    CPU utilizzabili dal processo: affinity (cpuset) e, se più stretta, la quota del container.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = _CGROUP_CPU_MAX.read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_count() -> int:
+    return settings.server_workers or available_cpus()
+
+
+def main() -> None:
+    uvicorn.run(
+        "app.api.main:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=worker_count(),
+        lifespan="on",
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+        access_log=False,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
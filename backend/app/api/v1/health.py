@@ -1,7 +1,55 @@
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.core.cache import summary_cache
+from app.core.config import settings
+from app.core.db import (get_async_pool, get_pool, ping_async_pool, ping_pool, pool_stats, replica_monitor,
+                         replica_pools)
+from app.core.lifecycle import process_state
+from app.core.metrics import render_metrics
+from app.repos.employees import employee_directory
 
 router = APIRouter(tags=["health"])
 
+# liveness: il processo risponde, nessun accesso al DB (un DB giù non deve far riavviare i worker)
 @router.get("/health")
+@router.get("/health/live")
 def health():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+# readiness: startup completato, non in drain, DB raggiungibile dal pool
+@router.get("/health/ready")
+async def health_ready():
+    state = process_state.stats()
+    if state["status"] == "ready":
+        if settings.api_async:
+            db_ok = await ping_async_pool(settings.readiness_timeout)
+        else:
+            db_ok = await run_in_threadpool(ping_pool, settings.readiness_timeout)
+        if not db_ok:
+            state["status"] = "db_unavailable"
+    return JSONResponse(state, status_code=200 if state["status"] == "ready" else 503)
+
+@router.get("/health/pool")
+async def health_pool():
+    pool = await get_async_pool() if settings.api_async else get_pool()
+    return pool_stats(pool)
+
+# repliche in lettura: salute, ritardo e pool (readiness resta sul primary: senza repliche si legge da lì)
+@router.get("/health/replicas")
+def health_replicas():
+    return [{**state, "pool": pool_stats(pool)} for state, pool in zip(replica_monitor.stats(), replica_pools())]
+
+@router.get("/health/cache")
+def health_cache():
+    return summary_cache.stats()
+
+@router.get("/health/directory")
+def health_directory():
+    return employee_directory.stats()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # formato testo Prometheus: istogrammi per route, metodo repository, query e attesa pool
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
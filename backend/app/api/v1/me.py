@@ -1,12 +1,20 @@
 from fastapi import APIRouter, HTTPException, Query
 from app.models.schemas import EmployeeOut
-from app.repos.employees import get_employee_by_email
+from app.repos.employees import employee_directory
 
 router = APIRouter(tags=["me"])
+sync_router = APIRouter(tags=["me"])
 
 @router.get("/me", response_model=EmployeeOut)
-def me(email: str = Query(...)):
-    row = get_employee_by_email(email)
+async def me(email: str = Query(...)):
+    row = await employee_directory.aget(email)
     if not row:
         raise HTTPException(status_code=404, detail="employee not found")
-    return row
\ No newline at end of file
+    return row
+
+@sync_router.get("/me", response_model=EmployeeOut)
+def me_sync(email: str = Query(...)):
+    row = employee_directory.get(email)
+    if not row:
+        raise HTTPException(status_code=404, detail="employee not found")
+    return row
@@ -1,20 +1,282 @@
 # app/routes/ras.py
-from fastapi import APIRouter, Query
-from app.services.ras_service import RASService
-from app.models.schemas import PeriodSummaryOut, MonthSummaryOut
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from app.api.responses import (
+    CONDITIONAL_RESPONSES, conditional_headers, ndjson_lines, ndjson_lines_async, not_modified, summary_response,
+)
+from app.services.export import EXPORT_FORMATS, AsyncExportService, ExportService, parquet_available
+from app.services.ras_service import AsyncRASService, RASService
+from app.core.config import settings
+from app.models.schemas import (
+    AnomalyListOut, CommessaSummaryOut, MonthSummaryBatchIn, MonthSummaryBatchOut, MonthSummaryOut, PeriodSummaryOut,
+)
+from app.repos.ras_repo import ANOMALY_RULES, COMMESSA_GROUPS, COMMESSA_MEASURES, COMMESSA_SORT_KEYS
 
+# router async (default) e router sync equivalente (settings.api_async=False, per confronto)
 router = APIRouter(prefix="/ras", tags=["ras"])
+sync_router = APIRouter(prefix="/ras", tags=["ras"])
 svc = RASService()
+async_svc = AsyncRASService()
+export_svc = ExportService()
+async_export_svc = AsyncExportService()
 
-@router.get("/month-summary", response_model= MonthSummaryOut)
-def month_summary(email: str, year: int, month: int, hours_per_workday: int = 8, ):
-    return svc.get_month_summary(email, year, month, hours_per_workday)
+_TEAM_SUMMARY_RESPONSES = {
+    200: {"content": {"application/x-ndjson": {}},
+          "description": "Una riga JSON per dipendente (MonthSummaryOut o PeriodSummaryOut)"},
+}
 
-@router.get("/period-summary", response_model = PeriodSummaryOut)
-def period_summary(
+_EXPORT_RESPONSES = {
+    200: {"content": {"text/csv": {}, "application/vnd.apache.parquet": {}},
+          "description": "Righe RAS (EXPORT_COLUMNS), CSV con header o Parquet"},
+}
+
+
+def _team_mode(filters: dict[str, str | None], year, month, from_ym, to_ym) -> str:
+    if all(v is None for v in filters.values()):
+        raise HTTPException(status_code=400, detail="one of team, leader_email, site, company is required")
+    if year is not None and month is not None:
+        return "month"
+    if from_ym is not None and to_ym is not None:
+        return "period"
+    raise HTTPException(status_code=400, detail="either year+month or from_ym+to_ym is required")
+
+
+def _batch_targets(body: MonthSummaryBatchIn) -> list[tuple[str, int, int]]:
+    if len(body.items) > settings.month_summary_batch_max_items:
+        raise HTTPException(status_code=400,
+                            detail=f"items: at most {settings.month_summary_batch_max_items} per request")
+    return [(i.email, i.year, i.month) for i in body.items]
+
+
+def _commessa_query(group_by: str, sort: str, order: str) -> tuple[tuple[str, ...], bool]:
+    groups = tuple(dict.fromkeys(g.strip() for g in group_by.split(",") if g.strip()))
+    if not groups or any(g not in COMMESSA_GROUPS for g in groups):
+        raise HTTPException(status_code=400, detail=f"group_by: comma list of {', '.join(COMMESSA_GROUPS)}")
+    if sort not in COMMESSA_MEASURES and COMMESSA_SORT_KEYS.get(sort) not in groups:
+        allowed = [*COMMESSA_MEASURES, *(k for k, g in COMMESSA_SORT_KEYS.items() if g in groups)]
+        raise HTTPException(status_code=400, detail=f"sort: one of {', '.join(allowed)}")
+    return groups, order == "desc"
+
+
+def _anomaly_rules(rule: str | None) -> tuple[str, ...]:
+    if rule is None:
+        return ANOMALY_RULES
+    rules = tuple(dict.fromkeys(r.strip() for r in rule.split(",") if r.strip()))
+    if not rules or any(r not in ANOMALY_RULES for r in rules):
+        raise HTTPException(status_code=400, detail=f"rule: comma list of {', '.join(ANOMALY_RULES)}")
+    return rules
+
+
+def _export_headers(fmt: str, from_ym: int, to_ym: int) -> tuple[str, dict[str, str]]:
+    if fmt == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="parquet export requires pyarrow")
+    media_type, ext = EXPORT_FORMATS[fmt]
+    return media_type, {"Content-Disposition": f'attachment; filename="ras_{from_ym}_{to_ym}.{ext}"'}
+
+
+# ---------- async ----------
+
+@router.get("/month-summary", response_model= MonthSummaryOut, responses=CONDITIONAL_RESPONSES)
+async def month_summary(request: Request, email: str, year: int, month: int, hours_per_workday: int = 8, ):
+    versions = await async_svc.get_month_versions(email, year, month)
+    headers = conditional_headers(versions, "month", email, year, month, hours_per_workday)
+    return not_modified(request, headers) or summary_response(
+        await async_svc.get_month_summary(email, year, month, hours_per_workday, versions), MonthSummaryOut, headers)
+
+@router.post("/month-summaries", response_model=MonthSummaryBatchOut)
+async def month_summaries(body: MonthSummaryBatchIn):
+    """
+    Riepiloghi mese di più (email, year, month) in una richiesta, nello stesso ordine degli items
+    (exists false per gli sheet mancanti). Calcolati insieme: una query per le versioni e una per
+    tutti i riepiloghi non in cache, invece di una richiesta HTTP per mese.
+    """
+    items = await async_svc.get_month_summaries(_batch_targets(body), body.hours_per_workday)
+    return summary_response({"items": items}, MonthSummaryBatchOut)
+
+@router.get("/period-summary", response_model = PeriodSummaryOut, responses=CONDITIONAL_RESPONSES)
+async def period_summary(
+    request: Request,
     email: str,
     from_ym: int = Query(..., description="YYYYMM, es 202510"),
     to_ym: int = Query(..., description="YYYYMM, es 202512"),
     hours_per_workday: int = 8
 ):
-    return svc.get_period_summary(email, from_ym, to_ym, hours_per_workday)
+    versions = await async_svc.get_period_versions(email, from_ym, to_ym)
+    headers = conditional_headers(versions, "period", email, from_ym, to_ym, hours_per_workday)
+    return not_modified(request, headers) or summary_response(
+        await async_svc.get_period_summary(email, from_ym, to_ym, hours_per_workday, versions), PeriodSummaryOut, headers)
+
+@router.get("/team-summary", response_class=StreamingResponse, responses=_TEAM_SUMMARY_RESPONSES)
+async def team_summary(
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+    year: int | None = None,
+    month: int | None = None,
+    from_ym: int | None = Query(None, description="YYYYMM, es 202510"),
+    to_ym: int | None = Query(None, description="YYYYMM, es 202512"),
+    hours_per_workday: int = 8,
+):
+    """
+    Riepiloghi di tutti i dipendenti filtrati, in streaming NDJSON.
+    year+month -> un MonthSummaryOut per riga; from_ym+to_ym -> un PeriodSummaryOut per riga.
+    """
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    if _team_mode(filters, year, month, from_ym, to_ym) == "month":
+        items = async_svc.iter_team_month_summaries(year, month, hours_per_workday, **filters)
+        model = MonthSummaryOut
+    else:
+        items = async_svc.iter_team_period_summaries(from_ym, to_ym, hours_per_workday, **filters)
+        model = PeriodSummaryOut
+    return StreamingResponse(ndjson_lines_async(items, model), media_type="application/x-ndjson")
+
+@router.get("/export", response_class=StreamingResponse, responses=_EXPORT_RESPONSES)
+async def export(
+    from_ym: int = Query(..., description="YYYYMM, es 202510"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+):
+    """
+    Righe RAS del periodo (con dipendente e stato sheet) in streaming, CSV o Parquet.
+    Senza filtri: tutta l'azienda.
+    """
+    media_type, headers = _export_headers(format, from_ym, to_ym)
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    items = async_export_svc.iter_export(format, from_ym, to_ym, **filters)
+    return StreamingResponse(items, media_type=media_type, headers=headers)
+
+@router.get("/commessa-summary", response_model=CommessaSummaryOut)
+async def commessa_summary(
+    commessa_cdc: str,
+    from_ym: int = Query(..., description="YYYYMM, es 202501"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    group_by: str = Query("employee", description="month, site, employee separati da virgola"),
+    sort: str = Query("giorni_commessa", description="giorni_commessa, ore_extra_tot, spese_tot, n_employees, ym, site, email"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Analisi di una commessa nel range: giorni pesati, ore extra e spese per mese / sede / dipendente.
+    Paginata (limit/offset su gruppi ordinati), con totali della commessa e total_rows.
+    """
+    groups, desc = _commessa_query(group_by, sort, order)
+    return await async_svc.get_commessa_summary(commessa_cdc, from_ym, to_ym, groups, sort, desc, limit, offset)
+
+@router.get("/anomalies", response_model=AnomalyListOut)
+async def anomalies(
+    from_ym: int = Query(..., description="YYYYMM, es 202510"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    rule: str | None = Query(None, description="empty_workdays, mixed_days, over_allocated_days, draft_near_close separati da virgola"),
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """
+    Anomalie degli sheet nel range (giorni lavorativi vuoti, giorni misti, giorni oltre il 100%,
+    draft vicini alla chiusura paghe), come salvate dall'ultimo scan: python db/scan_anomalies.py.
+    Lo scan scrive e gira come job con un DSN scrivibile, non da questa API (pool read-only).
+    """
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    return await async_svc.get_anomalies(from_ym, to_ym, _anomaly_rules(rule), limit=limit, offset=offset, **filters)
+
+
+# ---------- sync ----------
+
+@sync_router.get("/month-summary", response_model= MonthSummaryOut, responses=CONDITIONAL_RESPONSES)
+def month_summary_sync(request: Request, email: str, year: int, month: int, hours_per_workday: int = 8, ):
+    versions = svc.get_month_versions(email, year, month)
+    headers = conditional_headers(versions, "month", email, year, month, hours_per_workday)
+    return not_modified(request, headers) or summary_response(
+        svc.get_month_summary(email, year, month, hours_per_workday, versions), MonthSummaryOut, headers)
+
+@sync_router.post("/month-summaries", response_model=MonthSummaryBatchOut)
+def month_summaries_sync(body: MonthSummaryBatchIn):
+    items = svc.get_month_summaries(_batch_targets(body), body.hours_per_workday)
+    return summary_response({"items": items}, MonthSummaryBatchOut)
+
+@sync_router.get("/period-summary", response_model = PeriodSummaryOut, responses=CONDITIONAL_RESPONSES)
+def period_summary_sync(
+    request: Request,
+    email: str,
+    from_ym: int = Query(..., description="YYYYMM, es 202510"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    hours_per_workday: int = 8
+):
+    versions = svc.get_period_versions(email, from_ym, to_ym)
+    headers = conditional_headers(versions, "period", email, from_ym, to_ym, hours_per_workday)
+    return not_modified(request, headers) or summary_response(
+        svc.get_period_summary(email, from_ym, to_ym, hours_per_workday, versions), PeriodSummaryOut, headers)
+
+@sync_router.get("/team-summary", response_class=StreamingResponse, responses=_TEAM_SUMMARY_RESPONSES)
+def team_summary_sync(
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+    year: int | None = None,
+    month: int | None = None,
+    from_ym: int | None = Query(None, description="YYYYMM, es 202510"),
+    to_ym: int | None = Query(None, description="YYYYMM, es 202512"),
+    hours_per_workday: int = 8,
+):
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    if _team_mode(filters, year, month, from_ym, to_ym) == "month":
+        items = svc.iter_team_month_summaries(year, month, hours_per_workday, **filters)
+        model = MonthSummaryOut
+    else:
+        items = svc.iter_team_period_summaries(from_ym, to_ym, hours_per_workday, **filters)
+        model = PeriodSummaryOut
+    return StreamingResponse(ndjson_lines(items, model), media_type="application/x-ndjson")
+
+@sync_router.get("/export", response_class=StreamingResponse, responses=_EXPORT_RESPONSES)
+def export_sync(
+    from_ym: int = Query(..., description="YYYYMM, es 202510"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    format: str = Query("csv", pattern="^(csv|parquet)$"),
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+):
+    media_type, headers = _export_headers(format, from_ym, to_ym)
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    items = export_svc.iter_export(format, from_ym, to_ym, **filters)
+    return StreamingResponse(items, media_type=media_type, headers=headers)
+
+@sync_router.get("/commessa-summary", response_model=CommessaSummaryOut)
+def commessa_summary_sync(
+    commessa_cdc: str,
+    from_ym: int = Query(..., description="YYYYMM, es 202501"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    group_by: str = Query("employee", description="month, site, employee separati da virgola"),
+    sort: str = Query("giorni_commessa", description="giorni_commessa, ore_extra_tot, spese_tot, n_employees, ym, site, email"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    groups, desc = _commessa_query(group_by, sort, order)
+    return svc.get_commessa_summary(commessa_cdc, from_ym, to_ym, groups, sort, desc, limit, offset)
+
+@sync_router.get("/anomalies", response_model=AnomalyListOut)
+def anomalies_sync(
+    from_ym: int = Query(..., description="YYYYMM, es 202510"),
+    to_ym: int = Query(..., description="YYYYMM, es 202512"),
+    rule: str | None = Query(None, description="empty_workdays, mixed_days, over_allocated_days, draft_near_close separati da virgola"),
+    team: str | None = Query(None, description="nome team, es 'Team A'"),
+    leader_email: str | None = Query(None, description="email del team leader"),
+    site: str | None = Query(None, description="sede, es PI"),
+    company: str | None = Query(None, description="azienda, es EXTRARED"),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    filters = {"team": team, "leader_email": leader_email, "site": site, "company": company}
+    return svc.get_anomalies(from_ym, to_ym, _anomaly_rules(rule), limit=limit, offset=offset, **filters)
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Protocol
+
+from app.core.config import settings
+from app.core.serialization import dumps, loads
+
+_DEFAULT_TTL = object()
+
+
+class CacheBackend(Protocol):
+    """
+    Backend condiviso opzionale (es. Redis/memcached) collegabile a SummaryCache.
+    Valori già serializzati; ttl None = nessuna scadenza.
+    """
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes, ttl: float | None) -> None: ...
+
+
+class TTLCache:
+    """
+    LRU in-process con TTL per voce (ttl None = solo evizione LRU).
+    Thread-safe: usata sia dagli handler sync (threadpool) sia da quelli async.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float | None, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Any = _DEFAULT_TTL) -> None:
+        ttl = self.ttl if ttl is _DEFAULT_TTL else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SummaryCache:
+    """
+    Cache dei riepiloghi: LRU locale + backend condiviso opzionale.
+    Le chiavi contengono la versione degli sheet coinvolti (sheet_id, updated_at, sede e giorni
+    del calendario), quindi una modifica al RAS o al calendario cambia chiave: nessuna
+    invalidazione esplicita necessaria.
+    Sheet tutti 'approved' -> nessuna scadenza (solo evizione LRU), anche per le voci lette dal
+    backend: il flag viaggia insieme al valore.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float | None = 300.0,
+                 backend: CacheBackend | None = None, enabled: bool = True):
+        self.local = TTLCache(maxsize, ttl)
+        self.backend = backend
+        self.enabled = enabled
+        self.backend_hits = 0
+        self.backend_errors = 0
+
+    @staticmethod
+    def _backend_key(key: tuple) -> str:
+        # v2: valore {"approved", "value"}; le voci nel formato precedente non vengono lette
+        return "ras:v2:" + ":".join(str(part) for part in key)
+
+    def get(self, key: tuple) -> dict[str, Any] | None:
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is not None or self.backend is None:
+            return value
+        try:
+            raw = self.backend.get(self._backend_key(key))
+        except Exception:
+            self.backend_errors += 1
+            return None
+        if raw is None:
+            return None
+        self.backend_hits += 1
+        entry = loads(raw)
+        value = entry["value"]
+        if entry["approved"]:
+            self.local.set(key, value, ttl=None)
+        else:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key: tuple, value: dict[str, Any], approved: bool = False) -> None:
+        if not self.enabled:
+            return
+        ttl = None if approved else self.local.ttl
+        self.local.set(key, value, ttl)
+        if self.backend is not None:
+            try:
+                self.backend.set(self._backend_key(key), dumps({"approved": approved, "value": value}), ttl)
+            except Exception:
+                self.backend_errors += 1
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            **self.local.stats(),
+            "backend": type(self.backend).__name__ if self.backend is not None else None,
+            "backend_hits": self.backend_hits,
+            "backend_errors": self.backend_errors,
+        }
+
+
+summary_cache = SummaryCache(
+    maxsize=settings.cache_maxsize,
+    ttl=settings.cache_ttl,
+    enabled=settings.cache_enabled,
+)
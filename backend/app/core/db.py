@@ -1,16 +1,486 @@
-from contextlib import contextmanager
+import itertools
+import logging
+import threading
+import time
+from contextlib import AsyncExitStack, ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
 import psycopg
 from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool, PoolTimeout
 
 from app.core.config import settings
+from app.core.metrics import record_pool_wait, record_query
+
+
+logger = logging.getLogger("ras.db")
+
+_pool: ConnectionPool | None = None
+_async_pool: AsyncConnectionPool | None = None
+# repliche in lettura (settings.database_replica_urls), stesso ordine dei DSN
+_replica_pools: list[ConnectionPool] = []
+_async_replica_pools: list[AsyncConnectionPool] = []
+
+# read-only per policy: impostato una sola volta per connessione fisica
+_READ_ONLY_SQL = "SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY;"
+
+
+def _pool_kwargs(name: str = "ras") -> dict[str, Any]:
+    return {
+        "kwargs": {"row_factory": dict_row},
+        "min_size": settings.db_pool_min_size,
+        "max_size": settings.db_pool_max_size,
+        "max_idle": settings.db_pool_max_idle,
+        "timeout": settings.db_pool_timeout,
+        "name": name,
+        "open": False,
+    }
+
+
+# ---------- cursori strumentati (settings.metrics_enabled) ----------
+# Cursor client-side: execute scarica già tutto il risultato -> tempo di execute = tempo query.
+# Cursor server-side: la query viene letta a blocchi -> tempo da execute a close
+# (include il tempo del consumer tra un fetch e l'altro), righe = righe lette.
+# La query vuota del check del pool non è contata: ricade nell'attesa pool.
+
+class _TimedCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        if not query:
+            return super().execute(query, params, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            record_query(time.perf_counter() - started, max(self.rowcount, 0))
+
+
+class _TimedServerCursor(psycopg.ServerCursor):
+    _started: float | None = None
+
+    def execute(self, query, params=None, **kwargs):
+        self._started = time.perf_counter()
+        return super().execute(query, params, **kwargs)
+
+    def close(self) -> None:
+        rows = self.rownumber or 0
+        super().close()
+        if self._started is not None:
+            record_query(time.perf_counter() - self._started, rows)
+            self._started = None
+
+
+class _AsyncTimedCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        if not query:
+            return await super().execute(query, params, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            record_query(time.perf_counter() - started, max(self.rowcount, 0))
+
+
+class _AsyncTimedServerCursor(psycopg.AsyncServerCursor):
+    _started: float | None = None
+
+    async def execute(self, query, params=None, **kwargs):
+        self._started = time.perf_counter()
+        return await super().execute(query, params, **kwargs)
+
+    async def close(self) -> None:
+        rows = self.rownumber or 0
+        await super().close()
+        if self._started is not None:
+            record_query(time.perf_counter() - self._started, rows)
+            self._started = None
+
+
+def _configure(conn: psycopg.Connection) -> None:
+    conn.execute(_READ_ONLY_SQL)
+    conn.commit()
+    if settings.metrics_enabled:
+        conn.cursor_factory = _TimedCursor
+        conn.server_cursor_factory = _TimedServerCursor
+
+
+async def _configure_async(conn: psycopg.AsyncConnection) -> None:
+    await conn.execute(_READ_ONLY_SQL)
+    await conn.commit()
+    if settings.metrics_enabled:
+        conn.cursor_factory = _AsyncTimedCursor
+        conn.server_cursor_factory = _AsyncTimedServerCursor
+
+
+def open_pool(wait: bool = False) -> ConnectionPool:
+    """
+    Apre il pool (chiamato allo startup FastAPI).
+    wait=True: ritorna quando le db_pool_min_size connessioni sono aperte e configurate.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            settings.database_url,
+            configure=_configure,
+            check=ConnectionPool.check_connection,
+            **_pool_kwargs(),
+        )
+        _pool.open(wait=wait, timeout=settings.db_pool_timeout)
+    return _pool
+
+
+def close_pool() -> None:
+    """
+    Chiude il pool (chiamato allo shutdown FastAPI).
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def get_pool() -> ConnectionPool:
+    # apertura lazy per script / uso fuori da FastAPI
+    return _pool or open_pool()
+
+
+async def open_async_pool(wait: bool = False) -> AsyncConnectionPool:
+    """
+    Apre il pool async (startup FastAPI con settings.api_async).
+    """
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = AsyncConnectionPool(
+            settings.database_url,
+            configure=_configure_async,
+            check=AsyncConnectionPool.check_connection,
+            **_pool_kwargs(),
+        )
+        await _async_pool.open(wait=wait, timeout=settings.db_pool_timeout)
+    return _async_pool
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    return _async_pool or await open_async_pool()
+
+
+def pool_stats(pool: ConnectionPool | AsyncConnectionPool | None = None) -> dict[str, Any]:
+    """
+    Statistiche del pool + saturazione, per dimensionarlo.
+    """
+    pool = pool or get_pool()
+    stats = pool.get_stats()
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    stats["pool_in_use"] = in_use
+    stats["saturation"] = in_use / pool.max_size if pool.max_size else 0.0
+    waits = stats.get("requests_queued", 0)
+    stats["avg_wait_ms"] = stats.get("requests_wait_ms", 0) / waits if waits else 0.0
+    return stats
+
+
+def ping_pool(timeout: float) -> bool:
+    """
+    Readiness: il pool è aperto e una connessione risponde entro timeout secondi
+    (stessa query vuota del check del pool, fuori dalle metriche).
+    Non apre il pool (un processo in shutdown non torna ready).
+    """
+    if _pool is None:
+        return False
+    try:
+        with _pool.connection(timeout=timeout) as conn:
+            ConnectionPool.check_connection(conn)
+        return True
+    except (psycopg.Error, PoolTimeout):
+        return False
+
+
+async def ping_async_pool(timeout: float) -> bool:
+    if _async_pool is None:
+        return False
+    try:
+        async with _async_pool.connection(timeout=timeout) as conn:
+            await AsyncConnectionPool.check_connection(conn)
+        return True
+    except (psycopg.Error, PoolTimeout):
+        return False
+
+
+# ---------- repliche in lettura ----------
+# Le richieste API (ReadRoutingMiddleware) leggono da una replica scelta a turno tra quelle sane e
+# con ritardo entro replica_max_lag; senza route (script, directory, warm-up) si legge dal primary.
+# Il server è scelto alla prima connessione della richiesta e tenuto per le successive: versioni
+# e riepilogo arrivano dallo stesso snapshot (chiavi di cache ed ETag coerenti).
+
+PRIMARY = -1
+
+
+def replica_name(index: int) -> str:
+    return "primary" if index == PRIMARY else f"replica{index + 1}"
+
+
+# ritardo di replay: 0 se il primary non ha nulla di nuovo da mandare (WAL ricevuto tutto
+# applicato e walreceiver attivo), altrimenti età dell'ultima transazione applicata.
+# >= e non =: dopo un riavvio lo standby riporta come ricevuto l'inizio del segmento WAL.
+# Un server non in recovery (stesso database dietro due DSN) ha ritardo 0.
+_REPLICA_CHECK_SQL = """
+SELECT pg_is_in_recovery() AS standby,
+       CASE WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_replay_lsn() >= pg_last_wal_receive_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver) THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+       END::double precision AS lag_s;
+"""
+
+
+@dataclass
+class _ReplicaState:
+    dsn: str
+    conn: psycopg.Connection | None = None
+    healthy: bool = False
+    standby: bool | None = None
+    lag_s: float | None = None
+    checked_at: float | None = None  # monotonic dell'ultimo check riuscito
+    error: str | None = None
+
+
+class ReplicaMonitor:
+    """
+    Salute e ritardo delle repliche: un thread controlla ogni replica_check_interval secondi su una
+    connessione diretta per replica (fuori dai pool e dalle metriche delle richieste).
+    Il primo check è sincrono in start(): le repliche sono utilizzabili appena aperte.
+    Una replica esce dal giro se il check fallisce, se il ritardo supera replica_max_lag, se il
+    check non è aggiornato (monitor bloccato) o se una richiesta non ottiene connessione dal suo pool
+    (mark_failed); rientra al primo check riuscito.
+    """
+
+    def __init__(self):
+        self._replicas: list[_ReplicaState] = []
+        self._next = itertools.count()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, dsns: list[str]) -> None:
+        if self._thread is not None or not dsns:
+            return
+        self._replicas = [_ReplicaState(dsn) for dsn in dsns]
+        self._stop.clear()
+        self.check_all()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=settings.replica_check_interval + 5)
+        self._thread = None
+        for state in self._replicas:
+            if state.conn is not None:
+                state.conn.close()
+                state.conn = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(settings.replica_check_interval):
+            self.check_all()
+
+    def check_all(self) -> None:
+        for state in self._replicas:
+            self._check(state)
+
+    def _check(self, state: _ReplicaState) -> None:
+        try:
+            if state.conn is None or state.conn.closed:
+                state.conn = psycopg.connect(state.dsn, autocommit=True, row_factory=dict_row,
+                                             connect_timeout=max(1, int(settings.replica_check_interval)))
+            row = state.conn.execute(_REPLICA_CHECK_SQL).fetchone()
+        except psycopg.Error as e:
+            if state.healthy:
+                logger.warning("replica %s non raggiungibile: %s", state.dsn.rsplit("@", 1)[-1], e)
+            if state.conn is not None:
+                state.conn.close()
+                state.conn = None
+            state.healthy, state.error = False, str(e).strip()
+            return
+        if not state.healthy:
+            logger.info("replica %s disponibile", state.dsn.rsplit("@", 1)[-1])
+        state.healthy, state.error = True, None
+        state.standby, state.lag_s = row["standby"], row["lag_s"]
+        state.checked_at = time.monotonic()
+
+    def mark_failed(self, index: int, error: Exception) -> None:
+        state = self._replicas[index]
+        if state.healthy:
+            logger.warning("replica %s esclusa: %s", state.dsn.rsplit("@", 1)[-1], error)
+        state.healthy, state.error = False, str(error).strip() or type(error).__name__
+
+    def _eligible(self, state: _ReplicaState, now: float) -> bool:
+        return (state.healthy and state.lag_s is not None and state.lag_s <= settings.replica_max_lag
+                and state.checked_at is not None and now - state.checked_at <= 3 * settings.replica_check_interval)
+
+    def pick(self) -> int | None:
+        """
+        Prossima replica utilizzabile (round robin), None se nessuna: la richiesta va sul primary.
+        """
+        now = time.monotonic()
+        eligible = [i for i, state in enumerate(self._replicas) if self._eligible(state, now)]
+        if not eligible:
+            return None
+        return eligible[next(self._next) % len(eligible)]
+
+    def stats(self) -> list[dict[str, Any]]:
+        now = time.monotonic()
+        return [{
+            "name": replica_name(i),
+            "host": state.dsn.rsplit("@", 1)[-1],
+            "eligible": self._eligible(state, now),
+            "healthy": state.healthy,
+            "standby": state.standby,
+            "lag_s": state.lag_s,
+            "checked_ago_s": round(now - state.checked_at, 3) if state.checked_at is not None else None,
+            "error": state.error,
+        } for i, state in enumerate(self._replicas)]
+
+
+replica_monitor = ReplicaMonitor()
+
+
+@dataclass
+class ReadRoute:
+    prefer_replica: bool
+    target: int | None = None  # indice della replica o PRIMARY, None = non ancora scelto
+
+
+_read_route: ContextVar[ReadRoute | None] = ContextVar("ras_read_route", default=None)
 
 
 @contextmanager
-def get_conn():
-    conn = psycopg.connect(settings.database_url, row_factory=dict_row)
+def read_route(prefer_replica: bool = True, replica: int | None = None):
+    """
+    Instradamento delle letture nel contesto corrente (una richiesta API).
+    prefer_replica=False: tutto sul primary (letture subito dopo una scrittura).
+    replica: server fissato (warm-up di una replica).
+    """
+    token = _read_route.set(ReadRoute(prefer_replica, replica))
     try:
-        # read-only per policy
-        conn.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY;")
-        yield conn
+        yield
     finally:
-        conn.close()
\ No newline at end of file
+        _read_route.reset(token)
+
+
+def _route_target(replicas: int) -> int:
+    route = _read_route.get()
+    if route is None or not route.prefer_replica or not replicas:
+        return PRIMARY
+    if route.target is None:
+        picked = replica_monitor.pick()
+        route.target = PRIMARY if picked is None else picked
+    return route.target
+
+
+def _fall_back(index: int, error: Exception) -> None:
+    # la richiesta resta sul primary anche per le connessioni successive
+    replica_monitor.mark_failed(index, error)
+    route = _read_route.get()
+    if route is not None:
+        route.target = PRIMARY
+
+
+def open_replica_pools(wait: bool = False) -> list[ConnectionPool]:
+    """
+    Pool delle repliche + monitor (startup FastAPI). Non blocca su una replica giù: resta fuori
+    dal giro finché il monitor non la vede sana.
+    """
+    if not _replica_pools:
+        for i, dsn in enumerate(settings.database_replica_urls):
+            pool = ConnectionPool(dsn, configure=_configure, check=ConnectionPool.check_connection,
+                                  **_pool_kwargs(f"ras-{replica_name(i)}"))
+            pool.open(wait=False)
+            _replica_pools.append(pool)
+        replica_monitor.start(settings.database_replica_urls)
+        if wait:
+            for i, state in enumerate(replica_monitor.stats()):
+                if state["healthy"]:
+                    try:
+                        _replica_pools[i].wait(timeout=settings.db_pool_timeout)
+                    except PoolTimeout as e:
+                        replica_monitor.mark_failed(i, e)
+    return _replica_pools
+
+
+def close_replica_pools() -> None:
+    replica_monitor.stop()
+    while _replica_pools:
+        _replica_pools.pop().close()
+
+
+async def open_async_replica_pools(wait: bool = False) -> list[AsyncConnectionPool]:
+    if not _async_replica_pools:
+        for i, dsn in enumerate(settings.database_replica_urls):
+            pool = AsyncConnectionPool(dsn, configure=_configure_async, check=AsyncConnectionPool.check_connection,
+                                       **_pool_kwargs(f"ras-{replica_name(i)}"))
+            await pool.open(wait=False)
+            _async_replica_pools.append(pool)
+        # primo check sincrono nel loop: una volta sola, allo startup
+        replica_monitor.start(settings.database_replica_urls)
+        if wait:
+            for i, state in enumerate(replica_monitor.stats()):
+                if state["healthy"]:
+                    try:
+                        await _async_replica_pools[i].wait(timeout=settings.db_pool_timeout)
+                    except PoolTimeout as e:
+                        replica_monitor.mark_failed(i, e)
+    return _async_replica_pools
+
+
+async def close_async_replica_pools() -> None:
+    replica_monitor.stop()
+    while _async_replica_pools:
+        await _async_replica_pools.pop().close()
+
+
+def replica_pools() -> list[ConnectionPool] | list[AsyncConnectionPool]:
+    return _async_replica_pools or _replica_pools
+
+
+@contextmanager
+def get_conn():
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        target = _route_target(len(_replica_pools))
+        if target != PRIMARY:
+            try:
+                conn = stack.enter_context(_replica_pools[target].connection(timeout=settings.replica_pool_timeout))
+            except (PoolTimeout, psycopg.OperationalError) as e:
+                _fall_back(target, e)
+                target = PRIMARY
+        if target == PRIMARY:
+            conn = stack.enter_context(get_pool().connection())
+        record_pool_wait(time.perf_counter() - started, replica_name(target))
+        yield conn
+
+
+@asynccontextmanager
+async def get_async_conn():
+    started = time.perf_counter()
+    async with AsyncExitStack() as stack:
+        target = _route_target(len(_async_replica_pools))
+        if target != PRIMARY:
+            try:
+                conn = await stack.enter_async_context(
+                    _async_replica_pools[target].connection(timeout=settings.replica_pool_timeout))
+            except (PoolTimeout, psycopg.OperationalError) as e:
+                _fall_back(target, e)
+                target = PRIMARY
+        if target == PRIMARY:
+            pool = await get_async_pool()
+            conn = await stack.enter_async_context(pool.connection())
+        record_pool_wait(time.perf_counter() - started, replica_name(target))
+        yield conn
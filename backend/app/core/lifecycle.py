@@ -0,0 +1,73 @@
+"""
+Stato del processo per liveness / readiness e drain allo shutdown.
+
+Sequenza di un rolling deploy: SIGTERM -> /health/ready risponde 503 per server_drain_seconds
+(il load balancer smette di mandare richieste nuove) -> SIGTERM passato a uvicorn, che chiude il
+listener, finisce le richieste in corso (server_graceful_timeout) ed esegue lo shutdown del lifespan.
+"""
+import asyncio
+import signal
+import threading
+import time
+from typing import Any
+
+
+class ProcessState:
+    def __init__(self):
+        self.started_at: float | None = None
+        self.ready_at: float | None = None
+        self.draining_since: float | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None and self.draining_since is None
+
+    def mark_starting(self) -> None:
+        self.started_at = time.monotonic()
+        self.ready_at = self.draining_since = None
+
+    def mark_ready(self) -> None:
+        self.ready_at = time.monotonic()
+
+    def mark_draining(self) -> None:
+        if self.draining_since is None:
+            self.draining_since = time.monotonic()
+
+    def install_drain_handler(self, delay: float) -> None:
+        """
+        Avvolge l'handler SIGTERM installato da uvicorn: al primo segnale il processo passa in drain
+        e l'handler originale parte dopo `delay` secondi; un secondo SIGTERM lo chiama subito.
+        Va chiamato dal lifespan (dopo che uvicorn ha installato i suoi handler), nel thread principale.
+        """
+        original = signal.getsignal(signal.SIGTERM)
+        if delay <= 0 or not callable(original) or threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+
+        def handle_term(signum, frame):
+            if self.draining_since is not None:
+                original(signum, frame)
+                return
+            self.mark_draining()
+            loop.call_soon_threadsafe(loop.call_later, delay, original, signum, frame)
+
+        signal.signal(signal.SIGTERM, handle_term)
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        if self.draining_since is not None:
+            status = "draining"
+        elif self.ready_at is not None:
+            status = "ready"
+        else:
+            status = "starting"
+        return {
+            "status": status,
+            "startup_s": (self.ready_at - self.started_at
+                          if self.ready_at is not None and self.started_at is not None else None),
+            "uptime_s": now - self.ready_at if self.ready_at is not None else None,
+            "draining_s": now - self.draining_since if self.draining_since is not None else None,
+        }
+
+
+process_state = ProcessState()
@@ -0,0 +1,281 @@
+"""
+Strumentazione leggera delle richieste.
+- statistiche per richiesta (query, tempi, righe, attesa pool) in un ContextVar,
+  esposte come header Server-Timing e riga di log JSON;
+- istogrammi/contatori in-process esposti in formato testo Prometheus su /metrics.
+Nessuna dipendenza esterna: costo per query = due perf_counter + un append.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from app.core.config import settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# voci per-query nell'header Server-Timing (le altre restano nel totale "db")
+_MAX_TIMING_ENTRIES = 20
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{k}="{v}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [conteggi per bucket..., somma, totale]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in sorted(self._series.items())]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {int(series[-1])}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in items)
+        return lines
+
+
+HTTP_LATENCY = Histogram("ras_http_request_duration_seconds", "Durata richieste HTTP per route",
+                         ("route", "method", "status"))
+REPO_LATENCY = Histogram("ras_repo_method_duration_seconds", "Durata metodi repository", ("method",))
+QUERY_LATENCY = Histogram("ras_db_query_duration_seconds", "Durata query per metodo repository", ("method",))
+QUERY_ROWS = Counter("ras_db_query_rows_total", "Righe restituite per metodo repository", ("method",))
+POOL_WAIT = Histogram("ras_db_pool_wait_seconds", "Attesa per ottenere una connessione dal pool")
+DB_CONNECTIONS = Counter("ras_db_connections_total", "Connessioni prese dai pool per server (primary, replicaN)",
+                         ("source",))
+DIRECTORY_LOOKUPS = Counter("ras_directory_lookups_total", "Lookup email nella directory dipendenti", ("result",))
+
+_REGISTRY = (HTTP_LATENCY, REPO_LATENCY, QUERY_LATENCY, QUERY_ROWS, POOL_WAIT, DB_CONNECTIONS, DIRECTORY_LOOKUPS)
+
+
+def render_metrics() -> str:
+    """
+    Tutte le metriche in formato testo Prometheus (0.0.4).
+    """
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- statistiche per richiesta ----------
+
+@dataclass
+class RequestStats:
+    started: float = field(default_factory=time.perf_counter)
+    queries: list[tuple[str, float, int]] = field(default_factory=list)  # (metodo, ms, righe)
+    pool_wait_ms: float = 0.0
+    db_source: str | None = None  # server dell'ultima connessione (primary, replicaN)
+
+    @property
+    def db_ms(self) -> float:
+        return sum(ms for _, ms, _ in self.queries)
+
+    @property
+    def rows(self) -> int:
+        return sum(rows for _, _, rows in self.queries)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        parts = [
+            f'db;dur={self.db_ms:.2f};desc="{len(self.queries)} queries, {self.rows} rows"',
+            f'pool;dur={self.pool_wait_ms:.2f};desc="{self.db_source or "-"}"',
+        ]
+        for i, (method, ms, rows) in enumerate(self.queries[:_MAX_TIMING_ENTRIES], start=1):
+            parts.append(f'q{i};dur={ms:.2f};desc="{method} rows={rows}"')
+        parts.append(f"app;dur={self.elapsed_ms():.2f}")
+        return ", ".join(parts)
+
+    def as_log(self) -> dict[str, Any]:
+        return {
+            "duration_ms": round(self.elapsed_ms(), 2),
+            "db_ms": round(self.db_ms, 2),
+            "pool_wait_ms": round(self.pool_wait_ms, 2),
+            "db_source": self.db_source,
+            "query_count": len(self.queries),
+            "rows": self.rows,
+            "queries": [{"method": m, "ms": round(ms, 2), "rows": r} for m, ms, r in self.queries],
+        }
+
+
+_request_stats: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("ras_request_stats", default=None)
+_current_method: contextvars.ContextVar[str] = contextvars.ContextVar("ras_repo_method", default="-")
+
+
+def start_request() -> tuple[RequestStats, contextvars.Token]:
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _request_stats.reset(token)
+
+
+def record_query(elapsed: float, rows: int) -> None:
+    method = _current_method.get()
+    QUERY_LATENCY.observe(elapsed, method)
+    QUERY_ROWS.inc(rows, method)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries.append((method, elapsed * 1000, rows))
+
+
+def record_pool_wait(elapsed: float, source: str = "primary") -> None:
+    POOL_WAIT.observe(elapsed)
+    DB_CONNECTIONS.inc(1, source)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.pool_wait_ms += elapsed * 1000
+        stats.db_source = source
+
+
+# ---------- metodi repository ----------
+
+def instrument(fn: Callable) -> Callable:
+    """
+    Misura la durata del metodo ed etichetta con il suo nome le query eseguite al suo interno.
+    Supporta funzioni, coroutine, generatori e generatori async (streaming):
+    per i generatori la durata va dalla creazione all'esaurimento.
+    No-op con settings.metrics_enabled = False.
+    """
+    if not settings.metrics_enabled:
+        return fn
+    name = fn.__qualname__
+
+    if inspect.isasyncgenfunction(fn):
+        @functools.wraps(fn)
+        async def agen_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            agen = fn(*args, **kwargs)
+            try:
+                while True:
+                    # set/reset attorno a ogni passo: il consumer può cambiare contesto tra un passo e l'altro
+                    token = _current_method.set(name)
+                    try:
+                        item = await agen.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _current_method.reset(token)
+                    yield item
+            finally:
+                # la chiusura del cursore server-side registra la query: stessa etichetta
+                token = _current_method.set(name)
+                try:
+                    await agen.aclose()
+                finally:
+                    _current_method.reset(token)
+                REPO_LATENCY.observe(time.perf_counter() - started, name)
+        return agen_wrapper
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def gen_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            gen = fn(*args, **kwargs)
+            try:
+                while True:
+                    token = _current_method.set(name)
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        _current_method.reset(token)
+                    yield item
+            finally:
+                token = _current_method.set(name)
+                try:
+                    gen.close()
+                finally:
+                    _current_method.reset(token)
+                REPO_LATENCY.observe(time.perf_counter() - started, name)
+        return gen_wrapper
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def coro_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            token = _current_method.set(name)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _current_method.reset(token)
+                REPO_LATENCY.observe(time.perf_counter() - started, name)
+        return coro_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        token = _current_method.set(name)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_method.reset(token)
+            REPO_LATENCY.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def instrument_methods(cls: type) -> type:
+    """
+    Applica instrument a tutti i metodi pubblici definiti sulla classe.
+    """
+    for attr, value in list(vars(cls).items()):
+        if not attr.startswith("_") and inspect.isfunction(value):
+            setattr(cls, attr, instrument(value))
+    return cls
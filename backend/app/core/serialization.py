@@ -0,0 +1,33 @@
+"""
+JSON delle risposte riepilogo e della cache condivisa: orjson se installato (pip install ".[json]"),
+altrimenti pydantic_core.to_json. Stesso output in entrambi i casi: compatto (nessuno spazio),
+UTF-8, date/datetime ISO 8601, nessuna validazione (dict -> bytes).
+"""
+from typing import Any
+
+import pydantic_core
+
+try:
+    import orjson
+except ImportError:  # dipendenza opzionale
+    orjson = None
+
+
+def orjson_available() -> bool:
+    return orjson is not None
+
+
+def dumps(value: Any) -> bytes:
+    """
+    dict/list di tipi JSON + date/datetime -> bytes JSON. Il chiamante passa già la forma dello
+    schema (app/services/ras_service.py): qui non si valida né si converte nulla.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return pydantic_core.to_json(value)
+
+
+def loads(raw: bytes | str) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return pydantic_core.from_json(raw)
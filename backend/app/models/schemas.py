@@ -1,8 +1,12 @@
 from datetime import datetime, date
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Optional
 
 
+class TeamMembershipOut(BaseModel):
+    team: str
+    role: str
+
 class EmployeeOut(BaseModel):
     id: int
     full_name: str
@@ -12,6 +16,7 @@ class EmployeeOut(BaseModel):
     company: str | None = None
     active: bool
     created_at: datetime
+    teams: list[TeamMembershipOut] = []
 
 #-------------------------------------------------------------
 
@@ -28,6 +33,8 @@ class AbsencesOut(BaseModel):
 
 class ChecksOut(BaseModel):
     days_without_lines: list[int]
+    # giorni lavorativi (calendario della sede) senza righe; None se il mese non è a calendario
+    workdays_without_lines: Optional[list[int]] = None
     mixed_days: list[int]
 
 
@@ -40,12 +47,29 @@ class MonthSummaryOut(BaseModel):
     sheet_id: Optional[int] = None
     absences: Optional[AbsencesOut] = None
     work_days: Optional[int] = None
-    commesse: list[CommessaDaysOut]
+    commesse: list[CommessaDaysOut] = []
     ordinary_hours_est: Optional[int] = None
+    expected_work_days: Optional[int] = None
+    utilization: Optional[float] = None
     ore_extra_tot: Optional[float] = None
     spese_tot: Optional[float] = None
     checks: Optional[ChecksOut] = None
 
+class MonthSummaryRequest(BaseModel):
+    email: str
+    year: int
+    month: int
+
+
+class MonthSummaryBatchIn(BaseModel):
+    items: list[MonthSummaryRequest]
+    hours_per_workday: int = 8
+
+
+class MonthSummaryBatchOut(BaseModel):
+    # stesso ordine di MonthSummaryBatchIn.items
+    items: list[MonthSummaryOut]
+
 #-----------------------------------------------------------------------------------------------
 
 class PeriodMonthOut(BaseModel):
@@ -57,6 +81,9 @@ class PeriodMonthOut(BaseModel):
     work_days: int
     commesse : list[CommessaDaysOut]
     ordinary_hours_est: int
+    expected_work_days: Optional[int] = None
+    missing_work_days: Optional[int] = None
+    utilization: Optional[float] = None
 
     ore_extra_tot: float
     spese_tot: float
@@ -69,6 +96,9 @@ class PeriodTotalsOut(BaseModel):
     work_days: int
     commesse : list[CommessaDaysOut]
     ordinary_hours_est: int
+    expected_work_days: int
+    missing_work_days: int
+    utilization: Optional[float] = None
     ore_extra_tot: float
     spese_tot: float
 
@@ -80,4 +110,79 @@ class PeriodSummaryOut(BaseModel):
     months: list[PeriodMonthOut]
     totals: PeriodTotalsOut
 
+#-----------------------------------------------------------------------------------------------
+
+class CommessaGroupOut(BaseModel):
+    # chiavi presenti solo se nel group_by (month -> ym, site, employee -> email + full_name)
+    ym: Optional[int] = None
+    site: Optional[str] = None
+    email: Optional[str] = None
+    full_name: Optional[str] = None
+
+    giorni_commessa: float
+    ore_extra_tot: float
+    spese_tot: float
+    n_employees: int
+
+
+class CommessaTotalsOut(BaseModel):
+    giorni_commessa: float
+    ore_extra_tot: float
+    spese_tot: float
+    n_employees: int
 
+
+class CommessaSummaryOut(BaseModel):
+    commessa_cdc: str
+    from_ym: int
+    to_ym: int
+    group_by: list[str]
+    sort: str
+    order: str
+    limit: int
+    offset: int
+    total_rows: int
+    totals: CommessaTotalsOut
+    rows: list[CommessaGroupOut]
+
+#-----------------------------------------------------------------------------------------------
+
+class AnomalyOut(BaseModel):
+    sheet_id: int
+    rule: str
+    ym: int
+    email: str
+    full_name: str
+    site: Optional[str] = None
+    sheet_status: str
+    # giorni coinvolti (None per draft_near_close)
+    days: Optional[list[int]] = None
+    # max_rip_percent (over_allocated_days), close_date + days_to_close (draft_near_close)
+    detail: Optional[dict[str, Any]] = None
+
+
+class AnomalyScanOut(BaseModel):
+    id: int
+    from_ym: int
+    to_ym: int
+    as_of: date
+    full_scan: bool
+    status: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    sheets_scanned: Optional[int] = None
+    findings: Optional[int] = None
+
+
+class AnomalyListOut(BaseModel):
+    from_ym: int
+    to_ym: int
+    rules: list[str]
+    limit: int
+    offset: int
+    total_rows: int
+    sheets: int
+    counts: dict[str, int]
+    # ultimo scan che copre il range; None se mai eseguito
+    last_scan: Optional[AnomalyScanOut] = None
+    rows: list[AnomalyOut]
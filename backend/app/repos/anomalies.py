@@ -0,0 +1,211 @@
+"""
+Scrittura delle anomalie per il job di scan (db/migrations/0008, 0009, app/services/anomaly_scan.py).
+
+Le funzioni ricevono connessioni scrivibili dal chiamante (DSN del job): il pool dell'API è
+read-only per policy. La lettura per GET /ras/anomalies è in RASRepo.get_anomalies.
+"""
+from datetime import date
+from typing import Any
+
+import psycopg
+
+# un solo scan alla volta per database (CLI, cron, più istanze)
+SCAN_LOCK_KEY = 0x5241_5302
+
+# sheet da (ri)scansionare: mai visti, modificati dopo l'ultimo scan, del mese non ancora
+# concluso allo scan precedente o con sede / giorni lavorativi diversi da quelli usati allora
+# (chiusure in ras_holidays, cambio di sede: db/migrations/0009). Stessi lookup su PK del
+# calendario di _SCAN_SHEETS_SQL. Ordinati per mese: ogni chunk legge una o due partizioni.
+_PENDING_SHEETS_SQL = """
+SELECT rs.id
+FROM ras_sheets rs
+JOIN employees e ON e.id = rs.employee_id
+LEFT JOIN ras_work_calendar cs ON cs.site = e.site AND cs.ym = rs.year * 100 + rs.month
+LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+LEFT JOIN ras_anomaly_sheets st ON st.sheet_id = rs.id
+WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                              AND (%(to_year)s, %(to_month)s)
+  AND (%(full)s OR st.sheet_id IS NULL OR st.version <> rs.updated_at OR NOT st.complete
+       OR st.site IS DISTINCT FROM e.site
+       OR st.work_days IS DISTINCT FROM COALESCE(cs.work_days, cn.work_days))
+ORDER BY rs.year, rs.month, rs.id;
+"""
+
+# Regole sulle righe per un chunk di sheet, in un solo statement (stesso snapshot per righe e
+# updated_at registrato): le anomalie trovate sostituiscono quelle precedenti degli stessi sheet.
+# Giorni vuoti: giorni lavorativi della sede (o '*') prima di as_of senza nessuna riga.
+# Sovrallocazione: somma di rip_percent delle righe con commessa oltre 100.
+_SCAN_SHEETS_SQL = """
+WITH sh AS MATERIALIZED (
+  SELECT rs.id AS sheet_id, rs.employee_id, e.site, rs.year, rs.month,
+         rs.year * 100 + rs.month AS ym, rs.updated_at,
+         COALESCE(cs.work_days, cn.work_days) AS calendar_days
+  FROM ras_sheets rs
+  JOIN employees e ON e.id = rs.employee_id
+  LEFT JOIN ras_work_calendar cs ON cs.site = e.site AND cs.ym = rs.year * 100 + rs.month
+  LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+  WHERE rs.id = ANY(%(sheet_ids)s)
+),
+per_day AS (
+  SELECT l.sheet_id, l.day,
+         BOOL_OR(l.line_kind <> 0)                                    AS has_absence,
+         BOOL_OR(l.commessa_id IS NOT NULL)                           AS has_work,
+         SUM(l.rip_percent) FILTER (WHERE l.commessa_id IS NOT NULL) AS rip_work
+  FROM sh
+  JOIN ras_lines l ON l.sheet_id = sh.sheet_id AND l.ym = sh.ym
+  GROUP BY l.sheet_id, l.day
+),
+per_sheet AS (
+  SELECT sheet_id,
+         ARRAY_AGG(day) AS days_with_lines,
+         ARRAY_AGG(day ORDER BY day) FILTER (WHERE has_absence AND has_work) AS mixed_days,
+         ARRAY_AGG(day ORDER BY day) FILTER (WHERE rip_work > 100)          AS over_allocated_days,
+         MAX(rip_work) AS max_rip_percent
+  FROM per_day
+  GROUP BY sheet_id
+),
+found AS (
+  SELECT sh.sheet_id, sh.ym, sh.employee_id, f.rule, f.days, f.detail
+  FROM sh
+  LEFT JOIN per_sheet ps ON ps.sheet_id = sh.sheet_id
+  CROSS JOIN LATERAL (VALUES
+    ('empty_workdays',
+     ARRAY(SELECT d FROM unnest(sh.calendar_days) d
+           WHERE make_date(sh.year, sh.month, d) < %(as_of)s
+             AND d <> ALL(COALESCE(ps.days_with_lines, '{}'))
+           ORDER BY d),
+     NULL::jsonb),
+    ('mixed_days', ps.mixed_days::smallint[], NULL),
+    ('over_allocated_days', ps.over_allocated_days::smallint[],
+     jsonb_build_object('max_rip_percent', ps.max_rip_percent))
+  ) f(rule, days, detail)
+  WHERE cardinality(f.days) > 0
+),
+resolved AS (
+  DELETE FROM ras_anomalies a
+  USING sh
+  WHERE a.sheet_id = sh.sheet_id
+    AND a.rule <> 'draft_near_close'
+    AND NOT EXISTS (SELECT 1 FROM found f WHERE f.sheet_id = a.sheet_id AND f.rule = a.rule)
+  RETURNING 1
+),
+saved AS (
+  INSERT INTO ras_anomalies (sheet_id, rule, ym, employee_id, days, detail, scan_id)
+  SELECT sheet_id, rule, ym, employee_id, days, detail, %(scan_id)s FROM found
+  ON CONFLICT (sheet_id, rule) DO UPDATE
+    SET days = EXCLUDED.days, detail = EXCLUDED.detail, scan_id = EXCLUDED.scan_id
+    WHERE (ras_anomalies.days, ras_anomalies.detail) IS DISTINCT FROM (EXCLUDED.days, EXCLUDED.detail)
+  RETURNING 1
+),
+state AS (
+  INSERT INTO ras_anomaly_sheets (sheet_id, version, complete, scan_id, site, work_days)
+  SELECT sheet_id, updated_at,
+         %(as_of)s >= (make_date(year, month, 1) + interval '1 month')::date,
+         %(scan_id)s, site, calendar_days
+  FROM sh
+  ON CONFLICT (sheet_id) DO UPDATE
+    SET version = EXCLUDED.version, complete = EXCLUDED.complete,
+        scan_id = EXCLUDED.scan_id, scanned_at = now(),
+        site = EXCLUDED.site, work_days = EXCLUDED.work_days
+  RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM state)    AS sheets,
+       (SELECT COUNT(*) FROM found)    AS findings,
+       (SELECT COUNT(*) FROM saved)    AS changed,
+       (SELECT COUNT(*) FROM resolved) AS resolved;
+"""
+
+# draft a ridosso della chiusura paghe (giorno close_day del mese successivo): solo ras_sheets,
+# ricalcolata su tutto il range a ogni scan (dipende da as_of, non dalle modifiche allo sheet)
+_SCAN_DRAFTS_SQL = """
+WITH found AS (
+  SELECT rs.id AS sheet_id, rs.employee_id, rs.year * 100 + rs.month AS ym, c.close_date
+  FROM ras_sheets rs
+  CROSS JOIN LATERAL (
+    SELECT (make_date(rs.year, rs.month, 1) + interval '1 month')::date + (%(close_day)s - 1) AS close_date
+  ) c
+  WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                                AND (%(to_year)s, %(to_month)s)
+    AND rs.sheet_status = 'draft'
+    AND c.close_date - %(warning_days)s <= %(as_of)s
+),
+resolved AS (
+  DELETE FROM ras_anomalies a
+  WHERE a.rule = 'draft_near_close'
+    AND a.ym BETWEEN %(from_ym)s AND %(to_ym)s
+    AND NOT EXISTS (SELECT 1 FROM found f WHERE f.sheet_id = a.sheet_id)
+  RETURNING 1
+),
+saved AS (
+  INSERT INTO ras_anomalies (sheet_id, rule, ym, employee_id, days, detail, scan_id)
+  SELECT sheet_id, 'draft_near_close', ym, employee_id, NULL,
+         jsonb_build_object('close_date', close_date, 'days_to_close', close_date - %(as_of)s),
+         %(scan_id)s
+  FROM found
+  ON CONFLICT (sheet_id, rule) DO UPDATE
+    SET detail = EXCLUDED.detail, scan_id = EXCLUDED.scan_id
+    WHERE ras_anomalies.detail IS DISTINCT FROM EXCLUDED.detail
+  RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM found)    AS findings,
+       (SELECT COUNT(*) FROM saved)    AS changed,
+       (SELECT COUNT(*) FROM resolved) AS resolved;
+"""
+
+_START_SCAN_SQL = """
+INSERT INTO ras_anomaly_scans (from_ym, to_ym, as_of, full_scan)
+VALUES (%(from_ym)s, %(to_ym)s, %(as_of)s, %(full)s)
+RETURNING id;
+"""
+
+_FINISH_SCAN_SQL = """
+UPDATE ras_anomaly_scans s
+SET status = %(status)s,
+    finished_at = now(),
+    sheets_scanned = %(sheets_scanned)s,
+    findings = (SELECT COUNT(*) FROM ras_anomalies a WHERE a.ym BETWEEN s.from_ym AND s.to_ym)
+WHERE s.id = %(scan_id)s
+RETURNING s.*;
+"""
+
+
+def _range_params(from_ym: int, to_ym: int) -> dict[str, int]:
+    from_year, from_month = divmod(from_ym, 100)
+    to_year, to_month = divmod(to_ym, 100)
+    return {"from_ym": from_ym, "to_ym": to_ym, "from_year": from_year, "from_month": from_month,
+            "to_year": to_year, "to_month": to_month}
+
+
+def try_lock(conn: psycopg.Connection) -> bool:
+    """
+    Lock di sessione: rilasciato alla chiusura della connessione del coordinatore.
+    """
+    return conn.execute("SELECT pg_try_advisory_lock(%s) AS locked", (SCAN_LOCK_KEY,)).fetchone()["locked"]
+
+
+def start_scan(conn: psycopg.Connection, from_ym: int, to_ym: int, as_of: date, full: bool) -> int:
+    return conn.execute(_START_SCAN_SQL, {"from_ym": from_ym, "to_ym": to_ym, "as_of": as_of,
+                                          "full": full}).fetchone()["id"]
+
+
+def pending_sheets(conn: psycopg.Connection, from_ym: int, to_ym: int, full: bool) -> list[int]:
+    return [r["id"] for r in conn.execute(_PENDING_SHEETS_SQL, {**_range_params(from_ym, to_ym), "full": full})]
+
+
+def scan_sheets(conn: psycopg.Connection, scan_id: int, sheet_ids: list[int], as_of: date) -> dict[str, Any]:
+    """
+    Regole sulle righe per gli sheet indicati: sheets, findings (trovate), changed (scritte),
+    resolved (anomalie precedenti sparite).
+    """
+    return conn.execute(_SCAN_SHEETS_SQL, {"scan_id": scan_id, "sheet_ids": sheet_ids, "as_of": as_of}).fetchone()
+
+
+def scan_drafts(conn: psycopg.Connection, scan_id: int, from_ym: int, to_ym: int, as_of: date,
+                close_day: int, warning_days: int) -> dict[str, Any]:
+    return conn.execute(_SCAN_DRAFTS_SQL, {**_range_params(from_ym, to_ym), "scan_id": scan_id, "as_of": as_of,
+                                           "close_day": close_day, "warning_days": warning_days}).fetchone()
+
+
+def finish_scan(conn: psycopg.Connection, scan_id: int, status: str, sheets_scanned: int) -> dict[str, Any]:
+    return conn.execute(_FINISH_SCAN_SQL, {"scan_id": scan_id, "status": status,
+                                           "sheets_scanned": sheets_scanned}).fetchone()
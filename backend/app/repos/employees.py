@@ -1,14 +1,360 @@
-from typing import Any, Mapping, Optional
-from app.core.db import get_conn
+"""
+Anagrafica dipendenti in-process (EmployeeDirectory): email -> dipendente + team di appartenenza.
+Caricata allo startup, aggiornata in background leggendo ras_directory_log (migrazione 0006):
+/me e la risoluzione email -> employee_id dei repository non toccano il DB.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Mapping, Optional
 
+from app.core.config import settings
+from app.core.db import get_async_conn, get_conn
+from app.core.metrics import DIRECTORY_LOOKUPS, instrument
 
-def get_employee_by_email(email: str) -> Optional[Mapping[str, Any]]:
-    sql = """
-    SELECT id, full_name, email, site, level, company, active, created_at
-    FROM employees
-    WHERE email = %s
-    LIMIT 1;
+logger = logging.getLogger("ras.directory")
+
+# dipendente + team (lista {team, role}, ordinata per nome team)
+_DIRECTORY_SQL = """
+SELECT e.id, e.full_name, e.email, e.site, e.level, e.company, e.active, e.created_at,
+       COALESCE(json_agg(json_build_object('team', t.name, 'role', tm.role) ORDER BY t.name)
+                  FILTER (WHERE t.id IS NOT NULL), '[]'::json) AS teams
+FROM employees e
+LEFT JOIN team_members tm ON tm.employee_id = e.id
+LEFT JOIN teams t ON t.id = tm.team_id
+WHERE {where}
+GROUP BY e.id
+ORDER BY e.id
+{limit};
+"""
+
+_EMPLOYEE_BY_EMAIL_SQL = _DIRECTORY_SQL.format(where="e.email = %(email)s", limit="")
+_EMPLOYEES_BY_EMAIL_SQL = _DIRECTORY_SQL.format(where="e.email = ANY(%(emails)s)", limit="")
+_EMPLOYEES_BY_ID_SQL = _DIRECTORY_SQL.format(where="e.id = ANY(%(ids)s)", limit="")
+_EMPLOYEES_ALL_SQL = _DIRECTORY_SQL.format(where="TRUE", limit="LIMIT %(limit)s")
+
+# xmin dello snapshot: le transazioni con txid più basso sono concluse e visibili nello snapshot
+_SNAPSHOT_XMIN_SQL = "SELECT pg_snapshot_xmin(pg_current_snapshot())::text AS xmin;"
+
+# dipendenti toccati dal giro precedente (employee_id NULL = ricaricare tutto)
+_CHANGES_SQL = """
+SELECT COALESCE(bool_or(employee_id IS NULL), false) AS reload_all,
+       COALESCE(array_agg(DISTINCT employee_id) FILTER (WHERE employee_id IS NOT NULL),
+                ARRAY[]::bigint[]) AS ids
+FROM ras_directory_log
+WHERE txid >= %(since)s::xid8;
+"""
+
+# ras_directory_log tiene un giorno di modifiche: oltre questo intervallo senza refresh riuscito
+# le voci potrebbero essere già state cancellate -> ricarica completa
+_LOG_RETENTION = 12 * 3600.0
+
+
+class EmployeeDirectory:
+    """
+    LRU email -> dipendente con al più maxsize voci (+ indice id -> email per applicare le modifiche).
+    Un email non in memoria viene letto dal DB e aggiunto; gli email sconosciuti non sono memorizzati.
+    Refresh incrementale: ricarica solo i dipendenti registrati in ras_directory_log dall'ultimo giro,
+    nello stesso snapshot REPEATABLE READ in cui fissa il punto di partenza del giro successivo.
+    Thread-safe come TTLCache: usata sia dagli handler sync (threadpool) sia da quelli async.
     """
-    with get_conn() as conn:
-        row = conn.execute(sql, (email,)).fetchone()
-        return row
\ No newline at end of file
+
+    def __init__(self, maxsize: int, refresh_interval: float):
+        self.maxsize = maxsize
+        self.refresh_interval = refresh_interval
+        self._by_email: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self._email_by_id: dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._since: str | None = None          # xmin dello snapshot dell'ultimo caricamento/refresh
+        self._refreshed_at: float | None = None
+        self._stop: threading.Event | None = None
+        self._thread: threading.Thread | None = None
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    # ---------- lookup ----------
+
+    def get(self, email: str) -> Optional[Mapping[str, Any]]:
+        entry = self._lookup(email)
+        if entry is None:
+            entry = self._fetch_email(email)
+            if entry is not None:
+                self._put([entry])
+        return entry
+
+    async def aget(self, email: str) -> Optional[Mapping[str, Any]]:
+        entry = self._lookup(email)
+        if entry is None:
+            entry = await self._afetch_email(email)
+            if entry is not None:
+                self._put([entry])
+        return entry
+
+    def get_many(self, emails: Iterable[str]) -> dict[str, Mapping[str, Any]]:
+        """
+        email -> dipendente per più email (richieste batch): quelli non in memoria con una sola query.
+        Gli email sconosciuti non compaiono nel risultato.
+        """
+        found, missing = self._lookup_many(emails)
+        if missing:
+            rows = self._fetch_emails(missing)
+            self._put(rows)
+            found.update((r["email"], r) for r in rows)
+        return found
+
+    async def aget_many(self, emails: Iterable[str]) -> dict[str, Mapping[str, Any]]:
+        found, missing = self._lookup_many(emails)
+        if missing:
+            rows = await self._afetch_emails(missing)
+            self._put(rows)
+            found.update((r["email"], r) for r in rows)
+        return found
+
+    def employee_id(self, email: str) -> int | None:
+        entry = self.get(email)
+        return entry["id"] if entry else None
+
+    async def aemployee_id(self, email: str) -> int | None:
+        entry = await self.aget(email)
+        return entry["id"] if entry else None
+
+    # ---------- caricamento / refresh ----------
+
+    @instrument
+    def load(self) -> None:
+        """
+        Caricamento completo (startup, TRUNCATE, refresh fermo da troppo tempo).
+        """
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute(_SNAPSHOT_XMIN_SQL)
+            xmin = cur.fetchone()["xmin"]
+            cur.execute(_EMPLOYEES_ALL_SQL, {"limit": self.maxsize})
+            rows = cur.fetchall()
+        self._replace(xmin, rows)
+
+    @instrument
+    async def aload(self) -> None:
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            await cur.execute(_SNAPSHOT_XMIN_SQL)
+            xmin = (await cur.fetchone())["xmin"]
+            await cur.execute(_EMPLOYEES_ALL_SQL, {"limit": self.maxsize})
+            rows = await cur.fetchall()
+        self._replace(xmin, rows)
+
+    @instrument
+    def refresh(self) -> None:
+        """
+        Applica le modifiche registrate dall'ultimo giro (o ricarica tutto se serve).
+        """
+        if self._needs_load():
+            return self.load()
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute(_SNAPSHOT_XMIN_SQL)
+            xmin = cur.fetchone()["xmin"]
+            cur.execute(_CHANGES_SQL, {"since": self._since})
+            changes = cur.fetchone()
+            if changes["reload_all"]:
+                cur.execute(_EMPLOYEES_ALL_SQL, {"limit": self.maxsize})
+                return self._replace(xmin, cur.fetchall())
+            rows = []
+            if changes["ids"]:
+                cur.execute(_EMPLOYEES_BY_ID_SQL, {"ids": changes["ids"]})
+                rows = cur.fetchall()
+        self._apply(xmin, changes["ids"], rows)
+
+    @instrument
+    async def arefresh(self) -> None:
+        if self._needs_load():
+            return await self.aload()
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            await cur.execute(_SNAPSHOT_XMIN_SQL)
+            xmin = (await cur.fetchone())["xmin"]
+            await cur.execute(_CHANGES_SQL, {"since": self._since})
+            changes = await cur.fetchone()
+            if changes["reload_all"]:
+                await cur.execute(_EMPLOYEES_ALL_SQL, {"limit": self.maxsize})
+                return self._replace(xmin, await cur.fetchall())
+            rows = []
+            if changes["ids"]:
+                await cur.execute(_EMPLOYEES_BY_ID_SQL, {"ids": changes["ids"]})
+                rows = await cur.fetchall()
+        self._apply(xmin, changes["ids"], rows)
+
+    # ---------- refresh in background ----------
+
+    def start(self) -> None:
+        """
+        Refresh periodico in un thread daemon (percorso sync).
+        """
+        if self._thread is not None or self.refresh_interval <= 0:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,),
+                                        name="employee-directory", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = self._stop = None
+
+    def start_async(self) -> None:
+        """
+        Refresh periodico come task sull'event loop (percorso async).
+        """
+        if self._task is None and self.refresh_interval > 0:
+            self._task = asyncio.create_task(self._run_async(), name="employee-directory")
+
+    async def stop_async(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                self.refresh_errors += 1
+                logger.exception("refresh directory dipendenti fallito")
+
+    async def _run_async(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.arefresh()
+            except Exception:
+                self.refresh_errors += 1
+                logger.exception("refresh directory dipendenti fallito")
+
+    # ---------- stato in memoria ----------
+
+    def clear(self) -> None:
+        with self._lock:
+            self._by_email.clear()
+            self._email_by_id.clear()
+            self._since = self._refreshed_at = None
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._by_email),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_refresh_age_s": (time.monotonic() - self._refreshed_at
+                                   if self._refreshed_at is not None else None),
+        }
+
+    def _lookup(self, email: str) -> dict[str, Any] | None:
+        with self._lock:
+            entry = self._by_email.get(email)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._by_email.move_to_end(email)
+                self.hits += 1
+        DIRECTORY_LOOKUPS.inc(1, "miss" if entry is None else "hit")
+        return entry
+
+    def _lookup_many(self, emails: Iterable[str]) -> tuple[dict[str, dict[str, Any]], list[str]]:
+        found, missing = {}, []
+        for email in dict.fromkeys(emails):
+            entry = self._lookup(email)
+            if entry is None:
+                missing.append(email)
+            else:
+                found[email] = entry
+        return found, missing
+
+    def _needs_load(self) -> bool:
+        return (self._since is None
+                or time.monotonic() - self._refreshed_at > _LOG_RETENTION)
+
+    def _put(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        with self._lock:
+            self._put_locked(rows)
+
+    def _put_locked(self, rows: Iterable[Mapping[str, Any]]) -> None:
+        for row in rows:
+            entry = dict(row)
+            old_email = self._email_by_id.get(entry["id"])
+            if old_email is not None and old_email != entry["email"]:
+                self._by_email.pop(old_email, None)
+            self._by_email[entry["email"]] = entry
+            self._by_email.move_to_end(entry["email"])
+            self._email_by_id[entry["id"]] = entry["email"]
+        while len(self._by_email) > self.maxsize:
+            _, evicted = self._by_email.popitem(last=False)
+            self._email_by_id.pop(evicted["id"], None)
+            self.evictions += 1
+
+    def _replace(self, xmin: str, rows: list[Mapping[str, Any]]) -> None:
+        with self._lock:
+            self._by_email.clear()
+            self._email_by_id.clear()
+            self._put_locked(rows)
+            self._since, self._refreshed_at = xmin, time.monotonic()
+            self.loads += 1
+
+    def _apply(self, xmin: str, ids: list[int], rows: list[Mapping[str, Any]]) -> None:
+        with self._lock:
+            # id spariti (DELETE) o con email cambiato: via la voce vecchia, poi le righe nuove
+            for employee_id in ids:
+                email = self._email_by_id.pop(employee_id, None)
+                if email is not None:
+                    self._by_email.pop(email, None)
+            self._put_locked(rows)
+            self._since, self._refreshed_at = xmin, time.monotonic()
+            self.refreshes += 1
+
+    # ---------- fallback su DB (email non in memoria) ----------
+
+    @instrument
+    def _fetch_email(self, email: str) -> Optional[Mapping[str, Any]]:
+        with get_conn() as conn:
+            return conn.execute(_EMPLOYEE_BY_EMAIL_SQL, {"email": email}).fetchone()
+
+    @instrument
+    async def _afetch_email(self, email: str) -> Optional[Mapping[str, Any]]:
+        async with get_async_conn() as conn:
+            cur = await conn.execute(_EMPLOYEE_BY_EMAIL_SQL, {"email": email})
+            return await cur.fetchone()
+
+    @instrument
+    def _fetch_emails(self, emails: list[str]) -> list[Mapping[str, Any]]:
+        with get_conn() as conn:
+            return conn.execute(_EMPLOYEES_BY_EMAIL_SQL, {"emails": emails}).fetchall()
+
+    @instrument
+    async def _afetch_emails(self, emails: list[str]) -> list[Mapping[str, Any]]:
+        async with get_async_conn() as conn:
+            cur = await conn.execute(_EMPLOYEES_BY_EMAIL_SQL, {"emails": emails})
+            return await cur.fetchall()
+
+
+employee_directory = EmployeeDirectory(
+    maxsize=settings.directory_maxsize,
+    refresh_interval=settings.directory_refresh_interval,
+)
@@ -1,14 +1,798 @@
-from app.core.db import get_conn
+from contextlib import AsyncExitStack, ExitStack
+from functools import lru_cache
+from itertools import groupby
 
+from psycopg.rows import tuple_row
+
+from app.core.config import settings
+from app.core.db import get_async_conn, get_conn
+from app.core.metrics import instrument_methods
+from app.repos.employees import EmployeeDirectory, employee_directory
+
+# codici di ras_line_kinds (db/migrations/0005): 0 = lavoro, assenze = posizione (da 1) qui
 ABSENCE_TYPES = ("FERIE", "PERMESSO", "MALATTIA")
 
 
+# ---------- template riepiloghi ----------
+# I riepiloghi (singolo utente, team, batch) condividono la stessa query:
+# cambia solo il CTE di partenza. I frammenti sostituiti con .format() sono
+# SQL statico definito in questo modulo, i valori passano sempre come parametri.
+#
+# {sources} definisce per_day (sheet_id, day) e per_commessa (sheet_id, commessa_cdc)
+# per gli sheet in "sh": da ras_lines (raw) o dalle tabelle di rollup, stesse colonne.
+# Raw: conteggi su line_kind e raggruppamento su commessa_id (interi), il codice commessa
+# si legge da ras_commesse solo per le coppie (sheet, commessa) aggregate.
+# ras_lines è partizionata per ym (year * 100 + month dello sheet): le righe si leggono
+# sheet per sheet (LATERAL, OFFSET 0 impedisce che il planner lo riscriva in un hash join
+# con seq scan di tutte le partizioni), index scan su idx_ras_lines_sheet_day_cov nella sola
+# partizione di sh.ym (pruning a ogni giro del nested loop).
+# {lines_range}: limite sul periodo noto al planning (_PERIOD_LINES_RANGE), così il piano
+# contiene solo le partizioni del periodo; vuoto per le query mensili (un ym per sheet).
+
+_RAW_SOURCES = """
+l AS MATERIALIZED (
+  SELECT l.sheet_id, l.day, l.line_kind, l.commessa_id,
+         l.rip_percent, l.ore_extra, l.tot_spese
+  FROM sh
+  CROSS JOIN LATERAL (
+    SELECT l.sheet_id, l.day, l.line_kind, l.commessa_id,
+           l.rip_percent, l.ore_extra, l.tot_spese
+    FROM ras_lines l
+    WHERE l.sheet_id = sh.sheet_id AND l.ym = sh.ym {lines_range}
+    OFFSET 0
+  ) l
+),
+per_day AS (
+  SELECT sheet_id, day,
+         COUNT(*) AS n_lines,
+         COUNT(*) FILTER (WHERE line_kind = 1)           AS n_ferie,
+         COUNT(*) FILTER (WHERE line_kind = 2)           AS n_permesso,
+         COUNT(*) FILTER (WHERE line_kind = 3)           AS n_malattia,
+         COUNT(*) FILTER (WHERE commessa_id IS NOT NULL) AS n_work,
+         SUM(ore_extra) AS ore_extra,
+         SUM(tot_spese) AS tot_spese
+  FROM l
+  GROUP BY sheet_id, day
+),
+per_commessa AS (
+  SELECT pc.sheet_id, c.commessa_cdc, pc.rip_percent_tot
+  FROM (
+    SELECT sheet_id, commessa_id, SUM(rip_percent) AS rip_percent_tot
+    FROM l
+    WHERE commessa_id IS NOT NULL
+    GROUP BY sheet_id, commessa_id
+  ) pc
+  JOIN ras_commesse c ON c.id = pc.commessa_id
+)"""
+
+# Rollup: stesso accesso sheet per sheet (LATERAL, OFFSET 0), range scan sulle PK
+# (sheet_id, ...) invece di hash join con seq scan dei rollup quando sh è grande.
+# MATERIALIZED come l nel raw: inlined nel join con sh di agg, il LATERAL ripartirebbe
+# per ogni riga di sh (sheet x sheet lookup).
+_ROLLUP_SOURCES = """
+per_day AS MATERIALIZED (
+  SELECT r.sheet_id, r.day, r.n_lines, r.n_ferie, r.n_permesso, r.n_malattia,
+         r.n_work, r.ore_extra, r.tot_spese
+  FROM sh
+  CROSS JOIN LATERAL (
+    SELECT r.sheet_id, r.day, r.n_lines, r.n_ferie, r.n_permesso, r.n_malattia,
+           r.n_work, r.ore_extra, r.tot_spese
+    FROM ras_day_rollup r
+    WHERE r.sheet_id = sh.sheet_id
+    OFFSET 0
+  ) r
+),
+per_commessa AS MATERIALIZED (
+  SELECT r.sheet_id, r.commessa_cdc, r.rip_percent_tot
+  FROM sh
+  CROSS JOIN LATERAL (
+    SELECT r.sheet_id, r.commessa_cdc, r.rip_percent_tot
+    FROM ras_commessa_rollup r
+    WHERE r.sheet_id = sh.sheet_id
+    OFFSET 0
+  ) r
+)"""
+
+# Giorni lavorativi del mese dello sheet (calendar_days, db/migrations/0007): riga della sede o,
+# se la sede non ha giorni propri, quella nazionale '*'. Due lookup su PK per sheet.
+
+# {targets} deve produrre: ord, employee_id, email, site, year, month
+_MONTH_SUMMARY_SQL = """
+WITH t AS MATERIALIZED (
+  {targets}
+),
+s AS (
+  SELECT t.ord, rs.id AS sheet_id, rs.year, rs.month,
+         COALESCE(cs.work_days, cn.work_days) AS calendar_days
+  FROM t
+  JOIN ras_sheets rs
+    ON rs.employee_id = t.employee_id
+   AND rs.year = t.year
+   AND rs.month = t.month
+  LEFT JOIN ras_work_calendar cs ON cs.site = t.site AND cs.ym = rs.year * 100 + rs.month
+  LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+),
+sh AS (
+  SELECT DISTINCT sheet_id, year, month, year * 100 + month AS ym FROM s
+),
+{sources},
+agg AS MATERIALIZED (
+  SELECT
+    pd.sheet_id,
+    ARRAY_AGG(make_date(sh.year, sh.month, pd.day) ORDER BY pd.day)
+      FILTER (WHERE pd.n_ferie > 0)     AS ferie_giorni,
+    ARRAY_AGG(make_date(sh.year, sh.month, pd.day) ORDER BY pd.day)
+      FILTER (WHERE pd.n_permesso > 0)  AS permesso_giorni,
+    ARRAY_AGG(make_date(sh.year, sh.month, pd.day) ORDER BY pd.day)
+      FILTER (WHERE pd.n_malattia > 0)  AS malattia_giorni,
+    COUNT(*) FILTER (WHERE pd.n_work > 0) AS work_days,
+    SUM(pd.ore_extra)::double precision AS ore_extra_tot,
+    SUM(pd.tot_spese)::double precision AS spese_tot,
+    ARRAY_AGG(pd.day) AS days_with_lines,
+    ARRAY_AGG(pd.day ORDER BY pd.day)
+      FILTER (WHERE pd.n_ferie + pd.n_permesso + pd.n_malattia > 0
+                AND pd.n_work > 0)      AS mixed_days
+  FROM per_day pd
+  JOIN sh ON sh.sheet_id = pd.sheet_id
+  GROUP BY pd.sheet_id
+),
+comm AS MATERIALIZED (
+  SELECT
+    sheet_id,
+    json_agg(
+      json_build_object('commessa_cdc', commessa_cdc,
+                        'giorni_commessa', giorni_commessa)
+      ORDER BY giorni_commessa DESC, commessa_cdc) AS commesse
+  FROM (
+    SELECT sheet_id, commessa_cdc,
+           (rip_percent_tot / 100.0)::double precision AS giorni_commessa
+    FROM per_commessa
+  ) c
+  GROUP BY sheet_id
+)
+SELECT
+  t.ord, t.email, t.year, t.month,
+  s.sheet_id,
+  a.ferie_giorni, a.permesso_giorni, a.malattia_giorni,
+  COALESCE(a.work_days, 0)         AS work_days,
+  COALESCE(c.commesse, '[]'::json) AS commesse,
+  COALESCE(a.ore_extra_tot, 0)     AS ore_extra_tot,
+  COALESCE(a.spese_tot, 0)         AS spese_tot,
+  ARRAY(
+    SELECT g.day
+    FROM generate_series(
+           1,
+           EXTRACT(DAY FROM make_date(s.year, s.month, 1) + INTERVAL '1 month - 1 day')::int
+         ) AS g(day)
+    WHERE g.day <> ALL(COALESCE(a.days_with_lines, ARRAY[]::int[]))
+    ORDER BY g.day
+  ) AS days_without_lines,
+  COALESCE(a.mixed_days, ARRAY[]::int[]) AS mixed_days,
+  cardinality(s.calendar_days) AS expected_work_days,
+  CASE WHEN s.calendar_days IS NOT NULL THEN ARRAY(
+    SELECT c.day::int
+    FROM unnest(s.calendar_days) AS c(day)
+    WHERE c.day <> ALL(COALESCE(a.days_with_lines, ARRAY[]::int[]))
+    ORDER BY c.day
+  ) END AS workdays_without_lines
+FROM t
+LEFT JOIN s      ON s.ord = t.ord
+LEFT JOIN agg a  ON a.sheet_id = s.sheet_id
+LEFT JOIN comm c ON c.sheet_id = s.sheet_id
+ORDER BY t.ord;
+"""
+
+# {employees} deve produrre: id, email, site
+_PERIOD_SUMMARY_SQL = """
+WITH emp AS MATERIALIZED (
+  {employees}
+),
+s AS MATERIALIZED (
+  SELECT rs.id AS sheet_id, rs.employee_id, rs.year, rs.month, rs.sheet_status,
+         COALESCE(cs.work_days, cn.work_days) AS calendar_days
+  FROM ras_sheets rs
+  JOIN emp ON emp.id = rs.employee_id
+  LEFT JOIN ras_work_calendar cs ON cs.site = emp.site AND cs.ym = rs.year * 100 + rs.month
+  LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+  WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                                AND (%(to_year)s, %(to_month)s)
+),
+sh AS (
+  SELECT sheet_id, year * 100 + month AS ym FROM s
+),
+{sources},
+agg AS (
+  SELECT
+    s.employee_id, pd.sheet_id,
+    ARRAY_AGG(make_date(s.year, s.month, pd.day) ORDER BY s.year, s.month, pd.day)
+      FILTER (WHERE pd.n_ferie > 0)     AS ferie_giorni,
+    ARRAY_AGG(make_date(s.year, s.month, pd.day) ORDER BY s.year, s.month, pd.day)
+      FILTER (WHERE pd.n_permesso > 0)  AS permesso_giorni,
+    ARRAY_AGG(make_date(s.year, s.month, pd.day) ORDER BY s.year, s.month, pd.day)
+      FILTER (WHERE pd.n_malattia > 0)  AS malattia_giorni,
+    COUNT(*) FILTER (WHERE pd.n_work > 0) AS work_days,
+    SUM(pd.ore_extra)::double precision AS ore_extra_tot,
+    SUM(pd.tot_spese)::double precision AS spese_tot,
+    COUNT(*) FILTER (WHERE pd.day = ANY(s.calendar_days)) AS workdays_with_lines
+  FROM per_day pd
+  JOIN s ON s.sheet_id = pd.sheet_id
+  GROUP BY GROUPING SETS ((s.employee_id, pd.sheet_id), (s.employee_id))
+),
+cal AS (
+  SELECT employee_id, sheet_id, SUM(cardinality(calendar_days))::int AS expected_work_days
+  FROM s
+  GROUP BY GROUPING SETS ((employee_id, sheet_id), (employee_id))
+),
+comm AS (
+  SELECT
+    employee_id, sheet_id,
+    json_agg(
+      json_build_object('commessa_cdc', commessa_cdc,
+                        'giorni_commessa', giorni_commessa)
+      ORDER BY giorni_commessa DESC, commessa_cdc) AS commesse
+  FROM (
+    SELECT
+      s.employee_id, pc.sheet_id, pc.commessa_cdc,
+      (SUM(pc.rip_percent_tot) / 100.0)::double precision AS giorni_commessa
+    FROM per_commessa pc
+    JOIN s ON s.sheet_id = pc.sheet_id
+    GROUP BY GROUPING SETS ((s.employee_id, pc.sheet_id, pc.commessa_cdc),
+                            (s.employee_id, pc.commessa_cdc))
+  ) c
+  GROUP BY employee_id, sheet_id
+)
+SELECT
+  x.employee_id, emp.email,
+  x.sheet_id, x.year, x.month, x.sheet_status,
+  COALESCE(a.ferie_giorni, ARRAY[]::date[])    AS ferie_giorni,
+  COALESCE(a.permesso_giorni, ARRAY[]::date[]) AS permesso_giorni,
+  COALESCE(a.malattia_giorni, ARRAY[]::date[]) AS malattia_giorni,
+  COALESCE(a.work_days, 0)          AS work_days,
+  COALESCE(c.commesse, '[]'::json)  AS commesse,
+  COALESCE(a.ore_extra_tot, 0)      AS ore_extra_tot,
+  COALESCE(a.spese_tot, 0)          AS spese_tot,
+  k.expected_work_days,
+  k.expected_work_days - COALESCE(a.workdays_with_lines, 0) AS missing_work_days
+FROM (
+  SELECT employee_id, sheet_id, year, month, sheet_status FROM s
+  UNION ALL
+  SELECT id, NULL, NULL, NULL, NULL FROM emp      -- riga totali per dipendente
+) x
+JOIN emp ON emp.id = x.employee_id
+-- sheet_id NULL = riga totali (GROUPING SETS); COALESCE a 0 per restare in hash join
+LEFT JOIN agg a  ON a.employee_id = x.employee_id
+                AND COALESCE(a.sheet_id, 0) = COALESCE(x.sheet_id, 0)
+LEFT JOIN comm c ON c.employee_id = x.employee_id
+                AND COALESCE(c.sheet_id, 0) = COALESCE(x.sheet_id, 0)
+LEFT JOIN cal k  ON k.employee_id = x.employee_id
+                AND COALESCE(k.sheet_id, 0) = COALESCE(x.sheet_id, 0)
+ORDER BY emp.email, x.employee_id, x.year NULLS LAST, x.month;
+"""
+
+# filtri team / sede / azienda: nella WHERE entrano solo quelli valorizzati.
+# Un "%(team)s IS NULL OR EXISTS (...)" impedisce al planner di trasformare l'EXISTS
+# in semi-join: stima metà dei dipendenti e legge ras_sheets per intero.
+_TEAM_FILTERS = {
+    "team": """EXISTS (
+          SELECT 1
+          FROM team_members tm
+          JOIN teams t ON t.id = tm.team_id
+          WHERE tm.employee_id = e.id AND t.name = %(team)s)""",
+    "leader_email": """EXISTS (
+          SELECT 1
+          FROM team_members tm
+          JOIN teams t ON t.id = tm.team_id
+          JOIN employees le ON le.id = t.leader_id
+          WHERE tm.employee_id = e.id AND le.email = %(leader_email)s)""",
+    "site": "e.site = %(site)s",
+    "company": "e.company = %(company)s",
+}
+
+
+def _team_where(filters: tuple[str, ...]) -> str:
+    return "\n    AND ".join(_TEAM_FILTERS[f] for f in filters) or "TRUE"
+
+
+def _team_employees_sql(filters: tuple[str, ...]) -> str:
+    return f"""
+  SELECT e.id, e.email, e.site
+  FROM employees e
+  WHERE {_team_where(filters)}
+"""
+
+def _prepare(template: str, lines_range: str = "", **fragments: str) -> dict[bool, str]:
+    """
+    Query pronta per le due sorgenti, indicizzata per use_rollup.
+    """
+    return {
+        False: template.format(sources=_RAW_SOURCES.format(lines_range=lines_range), **fragments),
+        True: template.format(sources=_ROLLUP_SOURCES, **fragments),
+    }
+
+
+# query pronte (condivise da RASRepo e AsyncRASRepo)
+# employee_id risolto dalla directory in-process (app/repos/employees.py): nessun join su employees
+_USER_MONTH_SUMMARY_SQL = _prepare(_MONTH_SUMMARY_SQL, targets="""
+  SELECT 1 AS ord, %(employee_id)s::bigint AS employee_id, %(email)s::text AS email,
+         %(site)s::text AS site, %(year)s::int AS year, %(month)s::int AS month
+""")
+
+# richieste batch (POST /ras/month-summaries): un target per elemento risolto dalla directory,
+# ord = posizione tra gli elementi risolti. Elementi ripetuti: sh è DISTINCT, righe lette una volta.
+_BATCH_MONTH_SUMMARY_SQL = _prepare(_MONTH_SUMMARY_SQL, targets="""
+  SELECT t.ord, t.employee_id, t.email, t.site, t.year, t.month
+  FROM unnest(%(employee_ids)s::bigint[], %(emails)s::text[], %(sites)s::text[],
+              %(years)s::int[], %(months)s::int[])
+       WITH ORDINALITY AS t(employee_id, email, site, year, month, ord)
+""")
+
+# periodo: ym di ras_lines limitato al periodo anche al planning (vedi _RAW_SOURCES)
+_PERIOD_LINES_RANGE = "AND l.ym BETWEEN %(from_ym)s AND %(to_ym)s"
+
+_USER_PERIOD_SUMMARY_SQL = _prepare(_PERIOD_SUMMARY_SQL, lines_range=_PERIOD_LINES_RANGE, employees="""
+  SELECT %(employee_id)s::bigint AS id, %(email)s::text AS email, %(site)s::text AS site
+""")
+
+# query team per combinazione di filtri valorizzati (al più 16 varianti)
+@lru_cache(maxsize=None)
+def _team_month_summary_sql(filters: tuple[str, ...]) -> dict[bool, str]:
+    return _prepare(_MONTH_SUMMARY_SQL, targets=f"""
+  SELECT row_number() OVER (ORDER BY te.email) AS ord,
+         te.id AS employee_id, te.email, te.site,
+         %(year)s::int AS year, %(month)s::int AS month
+  FROM ({_team_employees_sql(filters)}) te
+""")
+
+
+@lru_cache(maxsize=None)
+def _team_period_summary_sql(filters: tuple[str, ...]) -> dict[bool, str]:
+    return _prepare(_PERIOD_SUMMARY_SQL, lines_range=_PERIOD_LINES_RANGE,
+                    employees=_team_employees_sql(filters))
+
+# versione degli sheet (chiave cache ed ETag): lookup su indice, nessuna lettura di ras_lines.
+# Con la sede (della directory, la stessa dei riepiloghi) e i giorni lavorativi del calendario
+# (lookup su PK di ras_work_calendar): una chiusura in ras_holidays o un cambio di sede cambia
+# la versione anche se updated_at dello sheet resta uguale.
+_SHEET_VERSIONS_SQL = """
+SELECT rs.id AS sheet_id, rs.year, rs.month, rs.sheet_status, rs.updated_at,
+       %(site)s::text AS site, COALESCE(cs.work_days, cn.work_days) AS work_days
+FROM ras_sheets rs
+LEFT JOIN ras_work_calendar cs ON cs.site = %(site)s AND cs.ym = rs.year * 100 + rs.month
+LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+WHERE rs.employee_id = %(employee_id)s
+  AND (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                              AND (%(to_year)s, %(to_month)s)
+ORDER BY rs.year, rs.month;
+"""
+
+# versioni per più (dipendente, mese): un lookup su indice per target
+_BATCH_SHEET_VERSIONS_SQL = """
+SELECT t.ord, rs.id AS sheet_id, rs.year, rs.month, rs.sheet_status, rs.updated_at,
+       t.site, COALESCE(cs.work_days, cn.work_days) AS work_days
+FROM unnest(%(employee_ids)s::bigint[], %(sites)s::text[], %(years)s::int[], %(months)s::int[])
+     WITH ORDINALITY AS t(employee_id, site, year, month, ord)
+JOIN ras_sheets rs
+  ON rs.employee_id = t.employee_id
+ AND rs.year = t.year
+ AND rs.month = t.month
+LEFT JOIN ras_work_calendar cs ON cs.site = t.site AND cs.ym = rs.year * 100 + rs.month
+LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month;
+"""
+
+# warm-up allo startup: lo sheet più recente (lookup su PK)
+_WARMUP_TARGET_SQL = """
+SELECT rs.employee_id AS id, e.email, e.site, rs.year, rs.month
+FROM ras_sheets rs
+JOIN employees e ON e.id = rs.employee_id
+ORDER BY rs.id DESC
+LIMIT 1;
+"""
+
+# periodo di un utente inesistente: solo la riga totali, vuota
+_EMPTY_PERIOD_ROWS = [{
+    "ferie_giorni": [], "permesso_giorni": [], "malattia_giorni": [],
+    "work_days": 0, "commesse": [], "ore_extra_tot": 0.0, "spese_tot": 0.0,
+    "expected_work_days": None, "missing_work_days": None,
+}]
+
+
+def _month_summary_row(row):
+    if row["sheet_id"] is None:
+        return None
+    return {
+        "sheet_id": row["sheet_id"],
+        "absences": {
+            "ferie_giorni": row["ferie_giorni"] or [],
+            "permesso_giorni": row["permesso_giorni"] or [],
+            "malattia_giorni": row["malattia_giorni"] or [],
+        },
+        "work_days": row["work_days"],
+        "commesse": row["commesse"],
+        "ore_extra_tot": row["ore_extra_tot"],
+        "spese_tot": row["spese_tot"],
+        "days_without_lines": row["days_without_lines"],
+        "mixed_days": row["mixed_days"],
+        "expected_work_days": row["expected_work_days"],
+        "workdays_without_lines": row["workdays_without_lines"],
+    }
+
+
+def _period_summary_rows(rows):
+    """
+    Righe di un dipendente (mesi in ordine + riga totali in coda) -> dict periodo.
+    """
+    *months, totals = rows
+    return {
+        "months": [
+            {
+                "year": r["year"],
+                "month": r["month"],
+                "sheet_status": r["sheet_status"],
+                "absences": {
+                    "ferie_giorni": r["ferie_giorni"],
+                    "permesso_giorni": r["permesso_giorni"],
+                    "malattia_giorni": r["malattia_giorni"],
+                },
+                "work_days": r["work_days"],
+                "commesse": r["commesse"],
+                "ore_extra_tot": r["ore_extra_tot"],
+                "spese_tot": r["spese_tot"],
+                "expected_work_days": r["expected_work_days"],
+                "missing_work_days": r["missing_work_days"],
+            }
+            for r in months
+        ],
+        "totals": {
+            "ferie_giorni": totals["ferie_giorni"],
+            "permesso_giorni": totals["permesso_giorni"],
+            "malattia_giorni": totals["malattia_giorni"],
+            "work_days": totals["work_days"],
+            "commesse": totals["commesse"],
+            "ore_extra_tot": totals["ore_extra_tot"],
+            "spese_tot": totals["spese_tot"],
+            # nessuno sheet nel range: 0 giorni attesi
+            "expected_work_days": totals["expected_work_days"] or 0,
+            "missing_work_days": totals["missing_work_days"] or 0,
+        },
+    }
+
+
+def _period_params(from_ym: int, to_ym: int):
+    from_year, from_month = divmod(from_ym, 100)
+    to_year, to_month = divmod(to_ym, 100)
+    return {
+        "from_year": from_year, "from_month": from_month,
+        "to_year": to_year, "to_month": to_month,
+        "from_ym": from_ym, "to_ym": to_ym,
+    }
+
+
+def _user_params(employee):
+    # voce della directory dipendenti: id, email e sede (calendario) senza join su employees
+    return {"employee_id": employee["id"], "email": employee["email"], "site": employee["site"]}
+
+
+def sheet_version_key(version) -> tuple:
+    """
+    Versione di uno sheet (riga di get_sheet_versions / get_month_versions_many) in forma
+    confrontabile: chiave della cache riepiloghi e base dell'ETag, così non possono divergere.
+    """
+    work_days = version["work_days"]
+    return (version["sheet_id"], version["sheet_status"], version["updated_at"].isoformat(),
+            version["site"], None if work_days is None else tuple(work_days))
+
+
+def _batch_params(targets, employees) -> tuple[list[int], dict[str, list]]:
+    """
+    Array per unnest dei target con dipendente noto + loro posizione in targets (ord - 1 -> indice).
+    """
+    known = [(i, employees[email], year, month) for i, (email, year, month) in enumerate(targets)
+             if email in employees]
+    return [i for i, _, _, _ in known], {
+        "employee_ids": [e["id"] for _, e, _, _ in known],
+        "emails": [e["email"] for _, e, _, _ in known],
+        "sites": [e["site"] for _, e, _, _ in known],
+        "years": [year for _, _, year, _ in known],
+        "months": [month for _, _, _, month in known],
+    }
+
+
+def _warmup_params(target):
+    ym = target["year"] * 100 + target["month"]
+    return (
+        {**_user_params(target), "year": target["year"], "month": target["month"]},
+        {**_user_params(target), **_period_params(ym, ym)},
+    )
+
+
+def _team_params(team, leader_email, site, company):
+    return {"team": team, "leader_email": leader_email, "site": site, "company": company}
+
+
+def _team_filters(params) -> tuple[str, ...]:
+    return tuple(f for f in _TEAM_FILTERS if params[f] is not None)
+
+
+# ---------- analisi per commessa (ras_commessa_month_rollup, migrazione 0004) ----------
+
+# raggruppamenti ammessi -> (chiave GROUP BY, colonne (espressione, alias)).
+# Dipendente raggruppato per id (email e nome dipendono dalla PK): hash su interi, niente sort su testo.
+# Sede e nome sono quelli attuali del dipendente.
+COMMESSA_GROUPS = {
+    "month": ("b.ym", (("b.ym", "ym"),)),
+    "site": ("e.site", (("e.site", "site"),)),
+    "employee": ("e.id", (("e.email", "email"), ("e.full_name", "full_name"))),
+}
+
+# ordinamenti ammessi: misure + chiavi dei raggruppamenti
+COMMESSA_MEASURES = ("giorni_commessa", "ore_extra_tot", "spese_tot", "n_employees")
+COMMESSA_SORT_KEYS = {"ym": "month", "site": "site", "email": "employee"}
+
+# b: righe del rollup della commessa, una per dipendente e mese (uno sheet per dipendente e mese).
+# Senza raggruppamento per mese, b aggrega prima per dipendente (chiave intera, hash):
+# in entrambi i casi ogni dipendente compare una volta per gruppo e n_employees è un
+# COUNT(*) invece di un COUNT(DISTINCT) (sort di tutte le righe).
+# Lettura: index-only scan sulla PK (commessa_cdc, ym, sheet_id) INCLUDE (...).
+_COMMESSA_ROWS_BY_MONTH = """
+  SELECT r.employee_id, r.ym, r.rip_percent_tot, r.ore_extra, r.tot_spese
+  FROM ras_commessa_month_rollup r
+  WHERE r.commessa_cdc = %(commessa_cdc)s
+    AND r.ym BETWEEN %(from_ym)s AND %(to_ym)s
+"""
+
+_COMMESSA_ROWS_BY_EMPLOYEE = """
+  SELECT r.employee_id,
+         SUM(r.rip_percent_tot) AS rip_percent_tot,
+         SUM(r.ore_extra)       AS ore_extra,
+         SUM(r.tot_spese)       AS tot_spese
+  FROM ras_commessa_month_rollup r
+  WHERE r.commessa_cdc = %(commessa_cdc)s
+    AND r.ym BETWEEN %(from_ym)s AND %(to_ym)s
+  GROUP BY r.employee_id
+"""
+
+_COMMESSA_SUMMARY_SQL = """
+WITH b AS MATERIALIZED (
+  {rows}
+),
+g AS MATERIALIZED (
+  SELECT {columns},
+         (SUM(b.rip_percent_tot) / 100.0)::double precision AS giorni_commessa,
+         SUM(b.ore_extra)::double precision                AS ore_extra_tot,
+         SUM(b.tot_spese)::double precision                AS spese_tot,
+         COUNT(*)                                          AS n_employees
+  FROM b
+  JOIN employees e ON e.id = b.employee_id
+  GROUP BY {keys}
+),
+page AS (
+  SELECT * FROM g
+  ORDER BY {order}
+  LIMIT %(limit)s OFFSET %(offset)s
+)
+SELECT
+  COALESCE((SUM(b.rip_percent_tot) / 100.0)::double precision, 0) AS giorni_commessa,
+  COALESCE(SUM(b.ore_extra)::double precision, 0)                AS ore_extra_tot,
+  COALESCE(SUM(b.tot_spese)::double precision, 0)                AS spese_tot,
+  (SELECT COUNT(*) FROM (SELECT DISTINCT employee_id FROM b) d) AS n_employees,
+  (SELECT COUNT(*) FROM g)                                       AS total_rows,
+  (SELECT COALESCE(json_agg(to_json(p) ORDER BY {order}), '[]'::json) FROM page p) AS rows
+FROM b;
+"""
+
+
+@lru_cache(maxsize=None)
+def _commessa_summary_sql(group_by: tuple[str, ...], sort: str, desc: bool) -> str:
+    """
+    Query per (raggruppamenti, ordinamento): solo frammenti da COMMESSA_GROUPS / COMMESSA_MEASURES.
+    Dopo la chiave di ordinamento, le chiavi dei gruppi: paginazione stabile.
+    """
+    cols = [c for g in group_by for c in COMMESSA_GROUPS[g][1]]
+    if sort not in COMMESSA_MEASURES and COMMESSA_SORT_KEYS[sort] not in group_by:
+        raise ValueError(f"sort {sort!r} requires group_by {COMMESSA_SORT_KEYS[sort]!r}")
+    direction = "DESC NULLS LAST" if desc else "ASC NULLS LAST"
+    order = ", ".join([f"{sort} {direction}"] + [alias for _, alias in cols if alias != sort])
+    return _COMMESSA_SUMMARY_SQL.format(
+        rows=_COMMESSA_ROWS_BY_MONTH if "month" in group_by else _COMMESSA_ROWS_BY_EMPLOYEE,
+        columns=", ".join(f"{expr} AS {alias}" for expr, alias in cols),
+        keys=", ".join(COMMESSA_GROUPS[g][0] for g in group_by),
+        order=order,
+    )
+
+
+# ---------- export righe (payroll) ----------
+
+# colonne dell'export, nell'ordine del SELECT (header CSV, schema Parquet)
+EXPORT_COLUMNS = (
+    "email", "full_name", "site", "company", "year", "month", "sheet_status",
+    "day", "stato", "loc", "activity_desc", "commessa_cdc", "ss", "fase",
+    "rip_percent", "ore_extra", "pranzo_flag", "cena_flag", "tot_spese", "rip_spesa", "rip_extra", "note",
+)
+
+# ym BETWEEN: COPY e cursori server-side non passano dai prepared statement,
+# il piano è fatto sui valori -> pruning delle partizioni già in pianificazione.
+# Join solo su sheet_id: con anche "l.ym = rs.year * 100 + rs.month" il planner stima poche
+# centinaia di righe e per il cursore (cursor_tuple_fraction) sceglie un nested loop da minuti.
+_EXPORT_LINES_SQL = """
+SELECT e.email, e.full_name, e.site, e.company,
+       rs.year, rs.month, rs.sheet_status,
+       l.day, l.stato, l.loc, a.activity_desc, c.commessa_cdc, l.ss, l.fase,
+       l.rip_percent, l.ore_extra, l.pranzo_flag, l.cena_flag, l.tot_spese, l.rip_spesa, l.rip_extra, l.note
+FROM employees e
+JOIN ras_sheets rs ON rs.employee_id = e.id
+JOIN ras_lines l ON l.sheet_id = rs.id
+LEFT JOIN ras_activities a ON a.id = l.activity_id
+LEFT JOIN ras_commesse c ON c.id = l.commessa_id
+WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                              AND (%(to_year)s, %(to_month)s)
+  AND l.ym BETWEEN %(from_ym)s AND %(to_ym)s
+  AND {where}
+ORDER BY e.email, rs.year, rs.month, l.day, l.id
+"""
+
+# COPY manda un messaggio per riga: blocchi da ~64KB verso il client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _export_lines_sql(filters: tuple[str, ...]) -> str:
+    return _EXPORT_LINES_SQL.format(where=_team_where(filters))
+
+
+@lru_cache(maxsize=None)
+def _export_csv_sql(filters: tuple[str, ...]) -> str:
+    return f"COPY ({_export_lines_sql(filters)}) TO STDOUT (FORMAT csv, HEADER)"
+
+
+def _export_params(from_ym, to_ym, team, leader_email, site, company):
+    return {**_period_params(from_ym, to_ym),
+            **_team_params(team, leader_email, site, company)}
+
+
+# ---------- anomalie (ras_anomalies, migrazione 0008; scan: app/services/anomaly_scan.py) ----------
+
+ANOMALY_RULES = ("empty_workdays", "mixed_days", "over_allocated_days", "draft_near_close")
+
+# a: anomalie del range (indice (ym, rule)) filtrate per regola e team; totali e conteggi per
+# regola su tutto a, righe solo per la pagina. last_scan: ultimo scan che copre il range
+# (anche running / failed), per capire quanto sono aggiornate.
+_ANOMALIES_SQL = """
+WITH a AS MATERIALIZED (
+  SELECT a.sheet_id, a.rule, a.ym, a.days, a.detail, e.email, e.full_name, e.site
+  FROM ras_anomalies a
+  JOIN employees e ON e.id = a.employee_id
+  WHERE a.ym BETWEEN %(from_ym)s AND %(to_ym)s
+    AND a.rule = ANY(%(rules)s)
+    AND {where}
+),
+page AS (
+  SELECT a.sheet_id, a.rule, a.ym, a.email, a.full_name, a.site, rs.sheet_status, a.days, a.detail
+  FROM a
+  JOIN ras_sheets rs ON rs.id = a.sheet_id
+  ORDER BY a.ym, a.email, a.rule
+  LIMIT %(limit)s OFFSET %(offset)s
+)
+SELECT
+  (SELECT COUNT(*) FROM a)                          AS total_rows,
+  (SELECT COUNT(DISTINCT sheet_id) FROM a)          AS sheets,
+  (SELECT COALESCE(json_object_agg(rule, n), '{{}}'::json)
+     FROM (SELECT rule, COUNT(*) AS n FROM a GROUP BY rule) c) AS counts,
+  (SELECT COALESCE(json_agg(to_json(p) ORDER BY p.ym, p.email, p.rule), '[]'::json) FROM page p) AS rows,
+  (SELECT to_json(s)
+     FROM ras_anomaly_scans s
+     WHERE s.from_ym <= %(to_ym)s AND s.to_ym >= %(from_ym)s
+     ORDER BY s.id DESC
+     LIMIT 1)                                       AS last_scan;
+"""
+
+
+@lru_cache(maxsize=None)
+def _anomalies_sql(filters: tuple[str, ...]) -> str:
+    return _ANOMALIES_SQL.format(where=_team_where(filters))
+
+
+def _anomalies_params(from_ym, to_ym, rules, limit, offset, team, leader_email, site, company):
+    return {"from_ym": from_ym, "to_ym": to_ym, "rules": list(rules), "limit": limit, "offset": offset,
+            **_team_params(team, leader_email, site, company)}
+
+
+# ---------- snapshot colonnare (motore riepiloghi in-process, app/services/summary_engine.py) ----------
+
+# righe dello snapshot come record binari a larghezza fissa (big-endian, senza separatori),
+# nell'ordine di SNAPSHOT_LINE_COLUMNS: il client li legge come array senza parsing per riga.
+# activity: line_kind (0 = lavoro, 1.. = posizione in ABSENCE_TYPES); commessa: commessa_id,
+# 0 = nessuna (il motore la traduce nella posizione nel dizionario commesse);
+# importi in centesimi (NUMERIC a 2 decimali -> interi esatti).
+SNAPSHOT_LINE_COLUMNS = (
+    ("sheet_id", "int8"), ("day", "int2"), ("activity", "int2"), ("commessa", "int4"),
+    ("rip_percent", "int4"), ("ore_extra", "int4"), ("tot_spese", "int8"),
+)
+
+_SNAPSHOT_LINE_EXPRS = {
+    "sheet_id": "l.sheet_id",
+    "day": "l.day",
+    "activity": "l.line_kind",
+    "commessa": "COALESCE(l.commessa_id, 0)",
+    "rip_percent": "l.rip_percent * 100",
+    "ore_extra": "l.ore_extra * 100",
+    "tot_spese": "l.tot_spese * 100",
+}
+
+_SNAPSHOT_RECORD = "\n         || ".join(
+    f"{pg_type}send(({_SNAPSHOT_LINE_EXPRS[name]})::{pg_type})" for name, pg_type in SNAPSHOT_LINE_COLUMNS)
+
+_SNAPSHOT_SHEETS_SQL = """
+SELECT rs.id AS sheet_id, rs.employee_id, rs.year, rs.month, rs.sheet_status, rs.updated_at,
+       te.site, COALESCE(cs.work_days, cn.work_days) AS calendar_days
+FROM ras_sheets rs
+JOIN ({employees}) te ON te.id = rs.employee_id
+LEFT JOIN ras_work_calendar cs ON cs.site = te.site AND cs.ym = rs.year * 100 + rs.month
+LEFT JOIN ras_work_calendar cn ON cn.site = '*' AND cn.ym = rs.year * 100 + rs.month
+WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                              AND (%(to_year)s, %(to_month)s)
+ORDER BY rs.id
+"""
+
+# dizionario commesse ordinato con la collation del DB, la stessa dell'ORDER BY dei riepiloghi SQL
+_SNAPSHOT_COMMESSE_SQL = """
+SELECT id, commessa_cdc
+FROM ras_commesse
+ORDER BY commessa_cdc
+"""
+
+# un bytea per partizione mensile: poche righe verso il client invece di un messaggio per riga
+# (COPY: ~2 µs per riga solo lato Python). Append ordinato per ym -> GroupAggregate senza sort.
+# Join su sheet_id + ym BETWEEN come l'export, eseguita senza prepare: pruning in pianificazione.
+_SNAPSHOT_LINES_SQL = """
+SELECT l.ym,
+       string_agg({record},
+         ''::bytea) AS lines
+FROM ras_sheets rs
+JOIN ({employees}) te ON te.id = rs.employee_id
+JOIN ras_lines l ON l.sheet_id = rs.id
+WHERE (rs.year, rs.month) BETWEEN (%(from_year)s, %(from_month)s)
+                              AND (%(to_year)s, %(to_month)s)
+  AND l.ym BETWEEN %(from_ym)s AND %(to_ym)s
+GROUP BY l.ym
+ORDER BY l.ym
+"""
+
+
+@lru_cache(maxsize=None)
+def _snapshot_sql(filters: tuple[str, ...]) -> tuple[str, str, str]:
+    employees = _team_employees_sql(filters)
+    return (
+        employees + "  ORDER BY e.email, e.id",
+        _SNAPSHOT_SHEETS_SQL.format(employees=employees),
+        _SNAPSHOT_LINES_SQL.format(employees=employees, record=_SNAPSHOT_RECORD),
+    )
+
+
+def _snapshot(params, employees, sheets, commesse, lines) -> dict:
+    return {
+        "from_ym": params["from_ym"], "to_ym": params["to_ym"],
+        "filters": {f: params[f] for f in _TEAM_FILTERS},
+        "employees": employees, "sheets": sheets, "commesse": commesse,
+        "lines": b"".join(r["lines"] for r in lines),
+    }
+
+
+@instrument_methods
 class RASRepo:
     """
     Repository RAS.
     Contiene SOLO query SQL e accesso ai dati.
     """
 
+    # righe per fetch dei cursori server-side (endpoint streaming)
+    stream_itersize = 200
+
+    def __init__(self, use_rollup: bool | None = None, directory: EmployeeDirectory | None = None):
+        # riepiloghi letti da ras_day_rollup / ras_commessa_rollup invece che da ras_lines
+        self.use_rollup = settings.ras_use_rollup if use_rollup is None else use_rollup
+        # email -> employee_id in memoria: le query partono da ras_sheets.employee_id
+        self.directory = directory or employee_directory
+
     # ---------- sheets ----------
 
     def get_sheets_by_user(self, email: str):
@@ -19,12 +803,14 @@ class RASRepo:
         SELECT rs.id, rs.year, rs.month,
                rs.sheet_status, rs.submitted_at, rs.approved_at
         FROM ras_sheets rs
-        JOIN employees e ON e.id = rs.employee_id
-        WHERE e.email = %(email)s
+        WHERE rs.employee_id = %(employee_id)s
         ORDER BY rs.year, rs.month;
         """
+        employee_id = self.directory.employee_id(email)
+        if employee_id is None:
+            return []
         with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(sql, {"email": email})
+            cur.execute(sql, {"employee_id": employee_id})
             return cur.fetchall()
 
     def get_sheet_id(self, email: str, year: int, month: int):
@@ -34,17 +820,322 @@ class RASRepo:
         sql = """
         SELECT rs.id
         FROM ras_sheets rs
-        JOIN employees e ON e.id = rs.employee_id
-        WHERE e.email = %(email)s
+        WHERE rs.employee_id = %(employee_id)s
           AND rs.year = %(year)s
           AND rs.month = %(month)s;
         """
+        employee_id = self.directory.employee_id(email)
+        if employee_id is None:
+            return None
         with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(sql, {"email": email, "year": year, "month": month})
+            cur.execute(sql, {"employee_id": employee_id, "year": year, "month": month})
             row = cur.fetchone()
             return row["id"] if row else None
 
+    def get_sheet_versions(self, email: str, from_ym: int, to_ym: int):
+        """
+        (sheet_id, sheet_status, updated_at, site, work_days del calendario) dei RAS nel range YYYYMM:
+        chiave per la cache riepiloghi e l'ETag (sheet_version_key).
+        """
+        employee = self.directory.get(email)
+        if employee is None:
+            return []
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_SHEET_VERSIONS_SQL, {**_user_params(employee), **_period_params(from_ym, to_ym)})
+            return cur.fetchall()
+
+    # ---------- riepilogo mese (single round-trip) ----------
+
+    def get_month_summary(self, email: str, year: int, month: int):
+        """
+        Tutto il riepilogo del mese in una sola query: assenze, giorni lavorati,
+        commesse, extra/spese e check di qualità.
+        ras_lines del RAS viene letta una sola volta (CTE materializzata).
+        Ritorna None se il dipendente non esiste.
+        """
+        employee = self.directory.get(email)
+        if employee is None:
+            return None
+        params = {**_user_params(employee), "year": year, "month": month}
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_USER_MONTH_SUMMARY_SQL[self.use_rollup], params)
+            row = cur.fetchone()
+            return _month_summary_row(row) if row else None
+
+    def get_month_summaries(self, targets: list[tuple[str, int, int]]):
+        """
+        Riepiloghi mese di più (email, anno, mese) in una sola query, nell'ordine di targets:
+        None se dipendente o sheet non esistono. Email risolti dalla directory (una query per i mancanti).
+        """
+        positions, params = _batch_params(targets, self.directory.get_many(t[0] for t in targets))
+        result = [None] * len(targets)
+        if not positions:
+            return result
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_BATCH_MONTH_SUMMARY_SQL[self.use_rollup], params)
+            for row in cur.fetchall():
+                result[positions[row["ord"] - 1]] = _month_summary_row(row)
+        return result
+
+    def get_month_versions_many(self, targets: list[tuple[str, int, int]]):
+        """
+        Versioni degli sheet di più (email, anno, mese), nell'ordine di targets: lista vuota se lo
+        sheet non esiste, altrimenti [versione] come get_sheet_versions.
+        """
+        positions, params = _batch_params(targets, self.directory.get_many(t[0] for t in targets))
+        result = [[] for _ in targets]
+        if not positions:
+            return result
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_BATCH_SHEET_VERSIONS_SQL, params)
+            for row in cur.fetchall():
+                result[positions[row.pop("ord") - 1]] = [row]
+        return result
+
+    # ---------- riepilogo periodo (set-based) ----------
+
+    def get_period_summary(self, email: str, from_ym: int, to_ym: int):
+        """
+        Aggregati per mese di tutti i RAS nel range YYYYMM + totali del periodo,
+        in una sola query raggruppata (GROUPING SETS: per sheet e totale).
+        """
+        employee = self.directory.get(email)
+        if employee is None:
+            return _period_summary_rows(_EMPTY_PERIOD_ROWS)
+        params = {**_user_params(employee), **_period_params(from_ym, to_ym)}
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_USER_PERIOD_SUMMARY_SQL[self.use_rollup], params)
+            rows = cur.fetchall()
+        return _period_summary_rows(rows or _EMPTY_PERIOD_ROWS)
+
+    # ---------- warm-up (startup) ----------
+
+    def warm_up(self, connections: int) -> int:
+        """
+        Riepilogo mese e periodo dello sheet più recente su `connections` connessioni del pool tenute
+        insieme: ogni backend carica cataloghi e piani prima della prima richiesta vera.
+        Ritorna le connessioni scaldate (0 con DB vuoto).
+        """
+        with ExitStack() as stack:
+            conns = [stack.enter_context(get_conn()) for _ in range(connections)]
+            target = conns[0].execute(_WARMUP_TARGET_SQL).fetchone() if conns else None
+            if target is None:
+                return 0
+            month, period = _warmup_params(target)
+            for conn in conns:
+                conn.execute(_USER_MONTH_SUMMARY_SQL[self.use_rollup], month)
+                conn.execute(_USER_PERIOD_SUMMARY_SQL[self.use_rollup], period)
+        return len(conns)
+
+    # ---------- riepiloghi team / sede / azienda (streaming) ----------
+
+    def iter_team_month_summaries(self, year: int, month: int, *, team: str | None = None,
+                                  leader_email: str | None = None, site: str | None = None,
+                                  company: str | None = None):
+        """
+        Riepilogo mese di tutti i dipendenti che rispettano i filtri.
+        Una query set-based letta con cursore server-side: yield (email, summary | None).
+        """
+        params = {"year": year, "month": month, **_team_params(team, leader_email, site, company)}
+        with get_conn() as conn, conn.cursor(name="team_month_summary") as cur:
+            cur.itersize = self.stream_itersize
+            cur.execute(_team_month_summary_sql(_team_filters(params))[self.use_rollup], params)
+            for row in cur:
+                yield row["email"], _month_summary_row(row)
+
+    def iter_team_period_summaries(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                                   leader_email: str | None = None, site: str | None = None,
+                                   company: str | None = None):
+        """
+        Riepilogo periodo di tutti i dipendenti che rispettano i filtri.
+        Righe ordinate per dipendente: in memoria resta un dipendente alla volta.
+        yield (email, period)
+        """
+        params = {**_period_params(from_ym, to_ym), **_team_params(team, leader_email, site, company)}
+        with get_conn() as conn, conn.cursor(name="team_period_summary") as cur:
+            cur.itersize = self.stream_itersize
+            cur.execute(_team_period_summary_sql(_team_filters(params))[self.use_rollup], params)
+            for (_, email), rows in groupby(cur, key=lambda r: (r["employee_id"], r["email"])):
+                yield email, _period_summary_rows(list(rows))
+
+    # ---------- export righe (payroll) ----------
+
+    def iter_export_csv(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                        leader_email: str | None = None, site: str | None = None,
+                        company: str | None = None):
+        """
+        Righe RAS del range (con dipendente e sheet) in CSV con header, via COPY TO STDOUT:
+        yield blocchi di bytes, memoria costante qualunque sia il numero di righe.
+        """
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        buf = bytearray()
+        with get_conn() as conn, conn.cursor() as cur:
+            with cur.copy(_export_csv_sql(_team_filters(params)), params) as copy:
+                for data in copy:
+                    buf += data
+                    if len(buf) >= EXPORT_CHUNK_SIZE:
+                        yield bytes(buf)
+                        buf.clear()
+        if buf:
+            yield bytes(buf)
+
+    def iter_export_batches(self, from_ym: int, to_ym: int, *, batch_size: int = 10_000,
+                            team: str | None = None, leader_email: str | None = None,
+                            site: str | None = None, company: str | None = None):
+        """
+        Stesse righe di iter_export_csv come tuple (ordine EXPORT_COLUMNS), a blocchi di batch_size
+        da un cursore server-side: per i formati colonnari (Parquet).
+        """
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        with get_conn() as conn, conn.cursor(name="export_lines", row_factory=tuple_row) as cur:
+            cur.itersize = batch_size
+            cur.execute(_export_lines_sql(_team_filters(params)), params)
+            while rows := cur.fetchmany(batch_size):
+                yield rows
+
+    # ---------- snapshot colonnare ----------
+
+    def get_lines_snapshot(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                           leader_email: str | None = None, site: str | None = None,
+                           company: str | None = None):
+        """
+        Dati del motore riepiloghi in-process per il range YYYYMM: dipendenti che rispettano i filtri
+        (ordine email), loro sheet nel range con i giorni lavorativi del calendario, dizionario commesse
+        e righe ras_lines come record binari (SNAPSHOT_LINE_COLUMNS).
+        Una transazione REPEATABLE READ: tutte le parti dallo stesso snapshot.
+        """
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        employees_sql, sheets_sql, lines_sql = _snapshot_sql(_team_filters(params))
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute(employees_sql, params)
+            employees = cur.fetchall()
+            cur.execute(sheets_sql, params)
+            sheets = cur.fetchall()
+            cur.execute(_SNAPSHOT_COMMESSE_SQL)
+            commesse = cur.fetchall()
+            cur.execute(lines_sql, params, prepare=False, binary=True)
+            lines = cur.fetchall()
+        return _snapshot(params, employees, sheets, commesse, lines)
+
+    # ---------- analisi per commessa ----------
+
+    def get_commessa_summary(self, commessa_cdc: str, from_ym: int, to_ym: int, *,
+                             group_by: tuple[str, ...] = ("employee",), sort: str = "giorni_commessa",
+                             desc: bool = True, limit: int = 100, offset: int = 0):
+        """
+        Giorni pesati, ore extra e spese di una commessa nel range YYYYMM, raggruppati per
+        mese / sede / dipendente (group_by), con totali e numero di gruppi per la paginazione.
+        Legge sempre ras_commessa_month_rollup (anche con use_rollup=False).
+        """
+        sql = _commessa_summary_sql(group_by, sort, desc)
+        params = {"commessa_cdc": commessa_cdc, "from_ym": from_ym, "to_ym": to_ym,
+                  "limit": limit, "offset": offset}
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchone()
+
+    # ---------- anomalie ----------
+
+    def get_anomalies(self, from_ym: int, to_ym: int, *, rules: tuple[str, ...] = ANOMALY_RULES,
+                      team: str | None = None, leader_email: str | None = None, site: str | None = None,
+                      company: str | None = None, limit: int = 100, offset: int = 0):
+        """
+        Anomalie salvate dall'ultimo scan nel range YYYYMM (per mese, email, regola), con totale,
+        sheet coinvolti, conteggi per regola e stato dell'ultimo scan. Nessun calcolo sulle righe.
+        """
+        params = _anomalies_params(from_ym, to_ym, rules, limit, offset, team, leader_email, site, company)
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(_anomalies_sql(_team_filters(params)), params)
+            return cur.fetchone()
+
+    # ---------- rollup ----------
+
+    def get_rollup_mismatches(self, sheet_ids: list[int] | None = None):
+        """
+        Confronta i rollup con gli aggregati ricalcolati da ras_lines.
+        Ritorna le righe (tabella, sheet_id, chiave) che differiscono: lista vuota = rollup coerente.
+        sheet_ids None = tutti gli sheet.
+        """
+        sql = """
+        WITH raw_day AS (
+          SELECT sheet_id, day,
+                 COUNT(*) AS n_lines,
+                 COUNT(*) FILTER (WHERE line_kind = 1)           AS n_ferie,
+                 COUNT(*) FILTER (WHERE line_kind = 2)           AS n_permesso,
+                 COUNT(*) FILTER (WHERE line_kind = 3)           AS n_malattia,
+                 COUNT(*) FILTER (WHERE commessa_id IS NOT NULL) AS n_work,
+                 SUM(ore_extra) AS ore_extra,
+                 SUM(tot_spese) AS tot_spese
+          FROM ras_lines
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR sheet_id = ANY(%(sheet_ids)s)
+          GROUP BY sheet_id, day
+        ),
+        roll_day AS (
+          SELECT sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese
+          FROM ras_day_rollup
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR sheet_id = ANY(%(sheet_ids)s)
+        ),
+        raw_comm AS (
+          SELECT l.sheet_id, c.commessa_cdc, COUNT(*) AS n_lines, SUM(l.rip_percent) AS rip_percent_tot
+          FROM ras_lines l
+          JOIN ras_commesse c ON c.id = l.commessa_id
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR l.sheet_id = ANY(%(sheet_ids)s)
+          GROUP BY l.sheet_id, c.commessa_cdc
+        ),
+        roll_comm AS (
+          SELECT sheet_id, commessa_cdc, n_lines, rip_percent_tot
+          FROM ras_commessa_rollup
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR sheet_id = ANY(%(sheet_ids)s)
+        ),
+        raw_comm_month AS (
+          SELECT l.sheet_id, c.commessa_cdc, l.ym, s.employee_id,
+                 COUNT(*) AS n_lines, SUM(l.rip_percent) AS rip_percent_tot,
+                 SUM(l.ore_extra) AS ore_extra, SUM(l.tot_spese) AS tot_spese
+          FROM ras_lines l
+          JOIN ras_commesse c ON c.id = l.commessa_id
+          JOIN ras_sheets s ON s.id = l.sheet_id
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR l.sheet_id = ANY(%(sheet_ids)s)
+          GROUP BY l.sheet_id, c.commessa_cdc, l.ym, s.employee_id
+        ),
+        roll_comm_month AS (
+          SELECT sheet_id, commessa_cdc, ym, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese
+          FROM ras_commessa_month_rollup
+          WHERE %(sheet_ids)s::bigint[] IS NULL OR sheet_id = ANY(%(sheet_ids)s)
+        )
+        SELECT 'ras_day_rollup' AS rollup,
+               COALESCE(a.sheet_id, b.sheet_id) AS sheet_id,
+               COALESCE(a.day, b.day)::text AS key
+        FROM raw_day a
+        FULL JOIN roll_day b ON b.sheet_id = a.sheet_id AND b.day = a.day
+        WHERE ROW(a.n_lines, a.n_ferie, a.n_permesso, a.n_malattia, a.n_work, a.ore_extra, a.tot_spese)
+              IS DISTINCT FROM
+              ROW(b.n_lines, b.n_ferie, b.n_permesso, b.n_malattia, b.n_work, b.ore_extra, b.tot_spese)
+        UNION ALL
+        SELECT 'ras_commessa_rollup',
+               COALESCE(a.sheet_id, b.sheet_id),
+               COALESCE(a.commessa_cdc, b.commessa_cdc)
+        FROM raw_comm a
+        FULL JOIN roll_comm b ON b.sheet_id = a.sheet_id AND b.commessa_cdc = a.commessa_cdc
+        WHERE ROW(a.n_lines, a.rip_percent_tot) IS DISTINCT FROM ROW(b.n_lines, b.rip_percent_tot)
+        UNION ALL
+        SELECT 'ras_commessa_month_rollup',
+               COALESCE(a.sheet_id, b.sheet_id),
+               COALESCE(a.commessa_cdc, b.commessa_cdc) || '/' || COALESCE(a.ym, b.ym)
+        FROM raw_comm_month a
+        FULL JOIN roll_comm_month b ON b.sheet_id = a.sheet_id AND b.commessa_cdc = a.commessa_cdc
+                                   AND b.ym = a.ym
+        WHERE ROW(a.employee_id, a.n_lines, a.rip_percent_tot, a.ore_extra, a.tot_spese)
+              IS DISTINCT FROM
+              ROW(b.employee_id, b.n_lines, b.rip_percent_tot, b.ore_extra, b.tot_spese)
+        ORDER BY 1, 2, 3;
+        """
+        with get_conn() as conn, conn.cursor() as cur:
+            cur.execute(sql, {"sheet_ids": sheet_ids})
+            return cur.fetchall()
+
     # ---------- absences ----------
+    # query per sheet: "ym = (SELECT ...)" fa leggere solo la partizione del mese dello sheet
 
     def count_absences(self, sheet_id: int):
         """
@@ -52,11 +1143,12 @@ class RASRepo:
         """
         sql = """
         SELECT
-          COUNT(DISTINCT day) FILTER (WHERE activity_desc = 'FERIE')    AS ferie_giorni,
-          COUNT(DISTINCT day) FILTER (WHERE activity_desc = 'PERMESSO') AS permesso_giorni,
-          COUNT(DISTINCT day) FILTER (WHERE activity_desc = 'MALATTIA') AS malattia_giorni
+          COUNT(DISTINCT day) FILTER (WHERE line_kind = 1) AS ferie_giorni,
+          COUNT(DISTINCT day) FILTER (WHERE line_kind = 2) AS permesso_giorni,
+          COUNT(DISTINCT day) FILTER (WHERE line_kind = 3) AS malattia_giorni
         FROM ras_lines
-        WHERE sheet_id = %(sheet_id)s;
+        WHERE sheet_id = %(sheet_id)s
+          AND ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s);
         """
         with get_conn() as conn, conn.cursor() as cur:
             cur.execute(sql, {"sheet_id": sheet_id})
@@ -70,19 +1162,20 @@ class RASRepo:
         WITH x AS (
           SELECT
             make_date(s.year, s.month, l.day) AS work_date,
-            l.activity_desc
+            l.line_kind
           FROM ras_lines l
           JOIN ras_sheets s ON s.id = l.sheet_id
           WHERE l.sheet_id = %(sheet_id)s
-            AND l.activity_desc IN ('FERIE','PERMESSO','MALATTIA')
+            AND l.ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s)
+            AND l.line_kind <> 0
         )
         SELECT
           ARRAY_AGG(DISTINCT work_date ORDER BY work_date)
-            FILTER (WHERE activity_desc = 'FERIE')     AS ferie_giorni,
+            FILTER (WHERE line_kind = 1) AS ferie_giorni,
           ARRAY_AGG(DISTINCT work_date ORDER BY work_date)
-            FILTER (WHERE activity_desc = 'PERMESSO')  AS permesso_giorni,
+            FILTER (WHERE line_kind = 2) AS permesso_giorni,
           ARRAY_AGG(DISTINCT work_date ORDER BY work_date)
-            FILTER (WHERE activity_desc = 'MALATTIA')  AS malattia_giorni
+            FILTER (WHERE line_kind = 3) AS malattia_giorni
         FROM x;
 
         """
@@ -104,13 +1197,18 @@ class RASRepo:
         """
         sql = """
         SELECT
-          commessa_cdc,
-          COALESCE(SUM(rip_percent) / 100.0, 0)::double precision AS giorni_commessa
-        FROM ras_lines
-        WHERE sheet_id = %(sheet_id)s
-          AND commessa_cdc IS NOT NULL
-        GROUP BY commessa_cdc
-        ORDER BY giorni_commessa DESC, commessa_cdc;
+          c.commessa_cdc,
+          COALESCE(l.rip_percent_tot / 100.0, 0)::double precision AS giorni_commessa
+        FROM (
+          SELECT commessa_id, SUM(rip_percent) AS rip_percent_tot
+          FROM ras_lines
+          WHERE sheet_id = %(sheet_id)s
+            AND ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s)
+            AND commessa_id IS NOT NULL
+          GROUP BY commessa_id
+        ) l
+        JOIN ras_commesse c ON c.id = l.commessa_id
+        ORDER BY giorni_commessa DESC, c.commessa_cdc;
         """
         with get_conn() as conn, conn.cursor() as cur:
             cur.execute(sql, {"sheet_id": sheet_id})
@@ -128,7 +1226,8 @@ class RASRepo:
           SELECT DISTINCT day
           FROM ras_lines
           WHERE sheet_id = %(sheet_id)s
-            AND commessa_cdc IS NOT NULL
+            AND ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s)
+            AND commessa_id IS NOT NULL
         ) d;
         """
         with get_conn() as conn, conn.cursor() as cur:
@@ -146,7 +1245,8 @@ class RASRepo:
           COALESCE(SUM(ore_extra), 0)::double precision AS ore_extra_tot,
           COALESCE(SUM(tot_spese), 0)::double precision AS spese_tot
         FROM ras_lines
-        WHERE sheet_id = %(sheet_id)s;
+        WHERE sheet_id = %(sheet_id)s
+          AND ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s);
         """
         with get_conn() as conn, conn.cursor() as cur:
             cur.execute(sql, {"sheet_id": sheet_id})
@@ -165,7 +1265,9 @@ class RASRepo:
         SELECT d.day
         FROM days d
         LEFT JOIN ras_lines rl
-          ON rl.sheet_id = %(sheet_id)s AND rl.day = d.day
+          ON rl.sheet_id = %(sheet_id)s
+         AND rl.ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s)
+         AND rl.day = d.day
         WHERE rl.id IS NULL
         ORDER BY d.day;
         """
@@ -183,10 +1285,11 @@ class RASRepo:
         sql = """
         WITH per_day AS (
           SELECT day,
-                 BOOL_OR(activity_desc IN ('FERIE','PERMESSO','MALATTIA')) AS has_absence,
-                 BOOL_OR(commessa_cdc IS NOT NULL) AS has_work
+                 BOOL_OR(line_kind <> 0) AS has_absence,
+                 BOOL_OR(commessa_id IS NOT NULL) AS has_work
           FROM ras_lines
           WHERE sheet_id = %(sheet_id)s
+            AND ym = (SELECT year * 100 + month FROM ras_sheets WHERE id = %(sheet_id)s)
           GROUP BY day
         )
         SELECT day
@@ -197,3 +1300,168 @@ class RASRepo:
         with get_conn() as conn, conn.cursor() as cur:
             cur.execute(sql, {"sheet_id": sheet_id})
             return [r["day"] for r in cur.fetchall()]
+
+
+@instrument_methods
+class AsyncRASRepo:
+    """
+    Variante async di RASRepo (psycopg AsyncConnection + pool async).
+    Stesse query dei riepiloghi, nessuna duplicazione SQL.
+    """
+
+    stream_itersize = RASRepo.stream_itersize
+
+    def __init__(self, use_rollup: bool | None = None, directory: EmployeeDirectory | None = None):
+        self.use_rollup = settings.ras_use_rollup if use_rollup is None else use_rollup
+        self.directory = directory or employee_directory
+
+    async def get_sheet_versions(self, email: str, from_ym: int, to_ym: int):
+        employee = await self.directory.aget(email)
+        if employee is None:
+            return []
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_SHEET_VERSIONS_SQL, {**_user_params(employee), **_period_params(from_ym, to_ym)})
+            return await cur.fetchall()
+
+    async def get_month_summary(self, email: str, year: int, month: int):
+        employee = await self.directory.aget(email)
+        if employee is None:
+            return None
+        params = {**_user_params(employee), "year": year, "month": month}
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_USER_MONTH_SUMMARY_SQL[self.use_rollup], params)
+            row = await cur.fetchone()
+            return _month_summary_row(row) if row else None
+
+    async def get_month_summaries(self, targets: list[tuple[str, int, int]]):
+        positions, params = _batch_params(targets, await self.directory.aget_many(t[0] for t in targets))
+        result = [None] * len(targets)
+        if not positions:
+            return result
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_BATCH_MONTH_SUMMARY_SQL[self.use_rollup], params)
+            for row in await cur.fetchall():
+                result[positions[row["ord"] - 1]] = _month_summary_row(row)
+        return result
+
+    async def get_month_versions_many(self, targets: list[tuple[str, int, int]]):
+        positions, params = _batch_params(targets, await self.directory.aget_many(t[0] for t in targets))
+        result = [[] for _ in targets]
+        if not positions:
+            return result
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_BATCH_SHEET_VERSIONS_SQL, params)
+            for row in await cur.fetchall():
+                result[positions[row.pop("ord") - 1]] = [row]
+        return result
+
+    async def get_period_summary(self, email: str, from_ym: int, to_ym: int):
+        employee = await self.directory.aget(email)
+        if employee is None:
+            return _period_summary_rows(_EMPTY_PERIOD_ROWS)
+        params = {**_user_params(employee), **_period_params(from_ym, to_ym)}
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_USER_PERIOD_SUMMARY_SQL[self.use_rollup], params)
+            rows = await cur.fetchall()
+        return _period_summary_rows(rows or _EMPTY_PERIOD_ROWS)
+
+    async def warm_up(self, connections: int) -> int:
+        async with AsyncExitStack() as stack:
+            conns = [await stack.enter_async_context(get_async_conn()) for _ in range(connections)]
+            target = await (await conns[0].execute(_WARMUP_TARGET_SQL)).fetchone() if conns else None
+            if target is None:
+                return 0
+            month, period = _warmup_params(target)
+            for conn in conns:
+                await conn.execute(_USER_MONTH_SUMMARY_SQL[self.use_rollup], month)
+                await conn.execute(_USER_PERIOD_SUMMARY_SQL[self.use_rollup], period)
+        return len(conns)
+
+    async def iter_team_month_summaries(self, year: int, month: int, *, team: str | None = None,
+                                        leader_email: str | None = None, site: str | None = None,
+                                        company: str | None = None):
+        params = {"year": year, "month": month, **_team_params(team, leader_email, site, company)}
+        async with get_async_conn() as conn, conn.cursor(name="team_month_summary") as cur:
+            cur.itersize = self.stream_itersize
+            await cur.execute(_team_month_summary_sql(_team_filters(params))[self.use_rollup], params)
+            async for row in cur:
+                yield row["email"], _month_summary_row(row)
+
+    async def iter_team_period_summaries(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                                         leader_email: str | None = None, site: str | None = None,
+                                         company: str | None = None):
+        params = {**_period_params(from_ym, to_ym), **_team_params(team, leader_email, site, company)}
+        async with get_async_conn() as conn, conn.cursor(name="team_period_summary") as cur:
+            cur.itersize = self.stream_itersize
+            await cur.execute(_team_period_summary_sql(_team_filters(params))[self.use_rollup], params)
+            # groupby "a mano": righe consecutive dello stesso dipendente
+            key, rows = None, []
+            async for row in cur:
+                row_key = (row["employee_id"], row["email"])
+                if rows and row_key != key:
+                    yield key[1], _period_summary_rows(rows)
+                    rows = []
+                key = row_key
+                rows.append(row)
+            if rows:
+                yield key[1], _period_summary_rows(rows)
+
+    async def iter_export_csv(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                              leader_email: str | None = None, site: str | None = None,
+                              company: str | None = None):
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        buf = bytearray()
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            async with cur.copy(_export_csv_sql(_team_filters(params)), params) as copy:
+                async for data in copy:
+                    buf += data
+                    if len(buf) >= EXPORT_CHUNK_SIZE:
+                        yield bytes(buf)
+                        buf.clear()
+        if buf:
+            yield bytes(buf)
+
+    async def iter_export_batches(self, from_ym: int, to_ym: int, *, batch_size: int = 10_000,
+                                  team: str | None = None, leader_email: str | None = None,
+                                  site: str | None = None, company: str | None = None):
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        async with get_async_conn() as conn, conn.cursor(name="export_lines", row_factory=tuple_row) as cur:
+            cur.itersize = batch_size
+            await cur.execute(_export_lines_sql(_team_filters(params)), params)
+            while rows := await cur.fetchmany(batch_size):
+                yield rows
+
+    async def get_lines_snapshot(self, from_ym: int, to_ym: int, *, team: str | None = None,
+                                 leader_email: str | None = None, site: str | None = None,
+                                 company: str | None = None):
+        params = _export_params(from_ym, to_ym, team, leader_email, site, company)
+        employees_sql, sheets_sql, lines_sql = _snapshot_sql(_team_filters(params))
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            await cur.execute(employees_sql, params)
+            employees = await cur.fetchall()
+            await cur.execute(sheets_sql, params)
+            sheets = await cur.fetchall()
+            await cur.execute(_SNAPSHOT_COMMESSE_SQL)
+            commesse = await cur.fetchall()
+            await cur.execute(lines_sql, params, prepare=False, binary=True)
+            lines = await cur.fetchall()
+        return _snapshot(params, employees, sheets, commesse, lines)
+
+    async def get_commessa_summary(self, commessa_cdc: str, from_ym: int, to_ym: int, *,
+                                   group_by: tuple[str, ...] = ("employee",), sort: str = "giorni_commessa",
+                                   desc: bool = True, limit: int = 100, offset: int = 0):
+        sql = _commessa_summary_sql(group_by, sort, desc)
+        params = {"commessa_cdc": commessa_cdc, "from_ym": from_ym, "to_ym": to_ym,
+                  "limit": limit, "offset": offset}
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(sql, params)
+            return await cur.fetchone()
+
+    async def get_anomalies(self, from_ym: int, to_ym: int, *, rules: tuple[str, ...] = ANOMALY_RULES,
+                            team: str | None = None, leader_email: str | None = None, site: str | None = None,
+                            company: str | None = None, limit: int = 100, offset: int = 0):
+        params = _anomalies_params(from_ym, to_ym, rules, limit, offset, team, leader_email, site, company)
+        async with get_async_conn() as conn, conn.cursor() as cur:
+            await cur.execute(_anomalies_sql(_team_filters(params)), params)
+            return await cur.fetchone()
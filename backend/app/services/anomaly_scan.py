@@ -0,0 +1,90 @@
+# app/services/anomaly_scan.py
+"""
+Scan anomalie di un periodo (regole in db/migrations/0008): gli sheet da rileggere sono divisi in
+chunk scansionati in parallelo, uno statement per chunk su una connessione propria. Le anomalie
+restano in ras_anomalies per l'elenco di GET /ras/anomalies.
+
+Incrementale per default: solo sheet mai visti, modificati (updated_at) o del mese non ancora
+concluso allo scan precedente; full=True rilegge tutto il range (dopo modifiche al calendario
+lavorativo o alla sede dei dipendenti, che non toccano updated_at degli sheet).
+
+Scrive: usa un DSN con permessi di scrittura, non il pool read-only dell'API.
+Uno scan alla volta per database (advisory lock).
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any
+
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+
+from app.core.config import settings
+from app.repos import anomalies
+
+logger = logging.getLogger("ras.anomalies")
+
+
+class ScanInProgress(RuntimeError):
+    pass
+
+
+class AnomalyScanner:
+    def __init__(self, dsn: str, workers: int | None = None, chunk_size: int | None = None):
+        self.dsn = dsn
+        self.workers = max(1, workers or settings.anomaly_scan_workers)
+        self.chunk_size = max(1, chunk_size or settings.anomaly_scan_chunk_size)
+
+    def scan(self, from_ym: int, to_ym: int, *, full: bool = False, as_of: date | None = None) -> dict[str, Any]:
+        """
+        Riga di ras_anomaly_scans a fine scan + chunks, changed (anomalie scritte), resolved
+        (anomalie sparite), elapsed_s. Errore -> scan 'failed' e eccezione rilanciata.
+        """
+        as_of = as_of or date.today()
+        started = time.perf_counter()
+        # coordinatore: lock, registro scan, elenco sheet, regola draft (autocommit: una
+        # transazione per statement, la riga 'running' è subito visibile)
+        with psycopg.connect(self.dsn, autocommit=True, row_factory=dict_row) as conn:
+            if not anomalies.try_lock(conn):
+                raise ScanInProgress("scan anomalie già in corso su questo database")
+            scan_id = anomalies.start_scan(conn, from_ym, to_ym, as_of, full)
+            totals = {"sheets": 0, "changed": 0, "resolved": 0}
+            try:
+                ids = anomalies.pending_sheets(conn, from_ym, to_ym, full)
+                chunks = [ids[i:i + self.chunk_size] for i in range(0, len(ids), self.chunk_size)]
+                logger.info("scan %s: %s sheet in %s chunk, %s worker", scan_id, len(ids), len(chunks), self.workers)
+                if chunks:
+                    for res in self._scan_chunks(scan_id, chunks, as_of):
+                        for k in totals:
+                            totals[k] += res[k]
+                drafts = anomalies.scan_drafts(conn, scan_id, from_ym, to_ym, as_of,
+                                               settings.payroll_close_day, settings.anomaly_draft_warning_days)
+            except BaseException:
+                anomalies.finish_scan(conn, scan_id, "failed", totals["sheets"])
+                raise
+            result = anomalies.finish_scan(conn, scan_id, "done", totals["sheets"])
+        return {
+            **result,
+            "chunks": len(chunks),
+            "changed": totals["changed"] + drafts["changed"],
+            "resolved": totals["resolved"] + drafts["resolved"],
+            "elapsed_s": round(time.perf_counter() - started, 3),
+        }
+
+    def _scan_chunks(self, scan_id: int, chunks: list[list[int]], as_of: date):
+        workers = min(self.workers, len(chunks))
+        # connessioni scrivibili del job, autocommit: ogni chunk è una transazione a sé
+        # (uno scan interrotto lascia i chunk già fatti, il successivo riparte dal resto)
+        pool = ConnectionPool(self.dsn, min_size=workers, max_size=workers, open=False,
+                              kwargs={"autocommit": True, "row_factory": dict_row})
+
+        def run(chunk: list[int]) -> dict[str, Any]:
+            with pool.connection() as conn:
+                res = anomalies.scan_sheets(conn, scan_id, chunk, as_of)
+            logger.debug("scan %s: chunk di %s sheet, %s anomalie", scan_id, res["sheets"], res["findings"])
+            return res
+
+        with pool, ThreadPoolExecutor(workers, thread_name_prefix="anomaly-scan") as executor:
+            return list(executor.map(run, chunks))
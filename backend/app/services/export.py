@@ -0,0 +1,123 @@
+# app/services/export.py
+from typing import AsyncIterator, Iterable, Iterator
+
+from app.repos.ras_repo import EXPORT_COLUMNS, AsyncRASRepo, RASRepo
+
+# Parquet opzionale: pip install ".[export]"
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# righe per row group Parquet = righe per fetch dal cursore server-side
+PARQUET_BATCH_SIZE = 10_000
+
+
+def parquet_available() -> bool:
+    return pa is not None
+
+
+def _arrow_schema():
+    # stessi tipi delle colonne Postgres: i NUMERIC restano decimali esatti
+    types = {
+        "year": pa.int32(), "month": pa.int32(), "day": pa.int32(),
+        "rip_percent": pa.decimal128(5, 2), "ore_extra": pa.decimal128(6, 2),
+        "tot_spese": pa.decimal128(10, 2), "rip_spesa": pa.decimal128(5, 2),
+    }
+    return pa.schema([(c, types.get(c, pa.string())) for c in EXPORT_COLUMNS])
+
+
+class _ChunkSink:
+    """
+    File di sola scrittura per ParquetWriter: accumula i bytes scritti finché non vengono ritirati.
+    """
+
+    closed = False
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _ParquetStream:
+    """
+    Un row group per blocco di righe: in memoria resta un solo blocco, i bytes escono subito.
+    """
+
+    def __init__(self):
+        if pa is None:
+            raise RuntimeError('parquet export requires pyarrow: pip install ".[export]"')
+        self.schema = _arrow_schema()
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression="zstd")
+
+    def write(self, rows: list[tuple]) -> bytes:
+        columns = list(zip(*rows))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns, self.schema)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        # footer con i metadati dei row group
+        self.writer.close()
+        return self.sink.take()
+
+
+def parquet_chunks(batches: Iterable[list[tuple]]) -> Iterator[bytes]:
+    stream = _ParquetStream()
+    for rows in batches:
+        yield stream.write(rows)
+    yield stream.close()
+
+
+async def parquet_chunks_async(batches: AsyncIterator[list[tuple]]) -> AsyncIterator[bytes]:
+    stream = _ParquetStream()
+    async for rows in batches:
+        yield stream.write(rows)
+    yield stream.close()
+
+
+class ExportService:
+    def __init__(self, repo: RASRepo | None = None):
+        self.repo = repo or RASRepo()
+
+    def iter_export(self, fmt: str, from_ym: int, to_ym: int, **filters: str | None) -> Iterator[bytes]:
+        """
+        Righe RAS del range YYYYMM (filtri: team, leader_email, site, company) in CSV o Parquet,
+        a blocchi di bytes pronti da scrivere su file o in risposta HTTP.
+        """
+        if fmt == "parquet":
+            return parquet_chunks(self.repo.iter_export_batches(
+                from_ym, to_ym, batch_size=PARQUET_BATCH_SIZE, **filters))
+        return self.repo.iter_export_csv(from_ym, to_ym, **filters)
+
+
+class AsyncExportService:
+    def __init__(self, repo: AsyncRASRepo | None = None):
+        self.repo = repo or AsyncRASRepo()
+
+    def iter_export(self, fmt: str, from_ym: int, to_ym: int, **filters: str | None) -> AsyncIterator[bytes]:
+        if fmt == "parquet":
+            return parquet_chunks_async(self.repo.iter_export_batches(
+                from_ym, to_ym, batch_size=PARQUET_BATCH_SIZE, **filters))
+        return self.repo.iter_export_csv(from_ym, to_ym, **filters)
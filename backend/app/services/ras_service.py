@@ -1,124 +1,396 @@
 # app/services/ras_service.py
-import calendar
-from typing import Any
+from typing import Any, AsyncIterator, Iterator
 
-from app.repos.ras_repo import RASRepo
+from app.core.cache import SummaryCache, summary_cache
+from app.repos.ras_repo import ANOMALY_RULES, AsyncRASRepo, RASRepo, sheet_version_key
 
 
-class RASService:
-    def __init__(self, repo: RASRepo | None = None):
-        self.repo = repo or RASRepo()
+def _utilization(work_days: int, expected_work_days: int | None) -> float | None:
+    # giorni lavorati / giorni lavorativi attesi dal calendario della sede
+    return round(work_days / expected_work_days, 4) if expected_work_days else None
 
-    def get_month_summary(self, email: str, year: int, month: int, hours_per_workday: int = 8) -> dict[str, Any]:
-        """
-        Riepilogo mese: status + assenze + giorni lavorati + ore ordinarie stimate + extra/spese + check base.
-        """
-        sheet_id = self.repo.get_sheet_id(email, year, month)
-        if sheet_id is None:
-            return {
-                "email": email,
-                "year": year,
-                "month": month,
-                "exists": False,
-            }
 
-        absences = self.repo.get_absence_days(sheet_id)
-        work_days = self.repo.count_work_days(sheet_id)
-        extra_spese = self.repo.get_extra_and_expenses(sheet_id)
+def _commesse_out(commesse: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # json_build_object scrive i double interi come 5 -> float come nello schema (5.0)
+    return [{"commessa_cdc": c["commessa_cdc"], "giorni_commessa": float(c["giorni_commessa"])}
+            for c in commesse]
 
-        days_in_month = calendar.monthrange(year, month)[1]
-        empty_days = self.repo.get_days_without_lines(sheet_id, days_in_month)
-        mixed_days = self.repo.get_mixed_days(sheet_id)
 
-        commesse_giorni = self.repo.get_giorni_per_commessa(sheet_id)
+# I payload hanno già la forma esatta di MonthSummaryOut / PeriodSummaryOut (tutte le chiavi, float
+# dove lo schema dice float): le route li serializzano senza rivalidarli (app/api/responses.py).
 
+def _month_summary_out(email: str, year: int, month: int, summary: dict[str, Any] | None,
+                       hours_per_workday: int) -> dict[str, Any]:
+    if summary is None:
         return {
             "email": email,
             "year": year,
             "month": month,
-            "exists": True,
-            "sheet_id": sheet_id,
-            "absences": absences,  # dict: ferie_giorni, permesso_giorni, malattia_giorni
-            "work_days": work_days,
-            "commesse" : commesse_giorni,
-            "ordinary_hours_est": work_days * hours_per_workday,
-            "ore_extra_tot": extra_spese["ore_extra_tot"],
-            "spese_tot": extra_spese["spese_tot"],
-            "checks": {
-                "days_without_lines": empty_days,
-                "mixed_days": mixed_days,
-            },
+            "exists": False,
+            "sheet_id": None,
+            "absences": None,
+            "work_days": None,
+            "commesse": [],
+            "ordinary_hours_est": None,
+            "expected_work_days": None,
+            "utilization": None,
+            "ore_extra_tot": None,
+            "spese_tot": None,
+            "checks": None,
+        }
+
+    work_days = summary["work_days"]
+
+    return {
+        "email": email,
+        "year": year,
+        "month": month,
+        "exists": True,
+        "sheet_id": summary["sheet_id"],
+        "absences": summary["absences"],  # dict: ferie_giorni, permesso_giorni, malattia_giorni
+        "work_days": work_days,
+        "commesse" : _commesse_out(summary["commesse"]),
+        "ordinary_hours_est": work_days * hours_per_workday,
+        "expected_work_days": summary["expected_work_days"],
+        "utilization": _utilization(work_days, summary["expected_work_days"]),
+        "ore_extra_tot": float(summary["ore_extra_tot"]),
+        "spese_tot": float(summary["spese_tot"]),
+        "checks": {
+            "days_without_lines": summary["days_without_lines"],
+            "workdays_without_lines": summary["workdays_without_lines"],
+            "mixed_days": summary["mixed_days"],
+        },
+    }
+
+
+def _period_month_out(m: dict[str, Any], hours_per_workday: int) -> dict[str, Any]:
+    return {
+        "year": m["year"],
+        "month": m["month"],
+        "sheet_status": m["sheet_status"],
+        "absences": m["absences"],
+        "work_days": m["work_days"],
+        "commesse": _commesse_out(m["commesse"]),
+        "ordinary_hours_est": m["work_days"] * hours_per_workday,
+        "expected_work_days": m["expected_work_days"],
+        "missing_work_days": m["missing_work_days"],
+        "utilization": _utilization(m["work_days"], m["expected_work_days"]),
+        "ore_extra_tot": float(m["ore_extra_tot"]),
+        "spese_tot": float(m["spese_tot"]),
+    }
+
+
+def _period_summary_out(email: str, from_ym: int, to_ym: int, period: dict[str, Any],
+                        hours_per_workday: int) -> dict[str, Any]:
+    totals = period["totals"]
+
+    return {
+        "email": email,
+        "from_ym": from_ym,
+        "to_ym": to_ym,
+        "months": [_period_month_out(m, hours_per_workday) for m in period["months"]],
+        "totals": {
+            "ferie_giorni": totals["ferie_giorni"],
+            "permesso_giorni": totals["permesso_giorni"],
+            "malattia_giorni": totals["malattia_giorni"],
+            "work_days": totals["work_days"],
+            "commesse": _commesse_out(totals["commesse"]),
+            "ordinary_hours_est": totals["work_days"] * hours_per_workday,
+            "expected_work_days": totals["expected_work_days"],
+            "missing_work_days": totals["missing_work_days"],
+            "utilization": _utilization(totals["work_days"], totals["expected_work_days"]),
+            "ore_extra_tot": float(totals["ore_extra_tot"]),
+            "spese_tot": float(totals["spese_tot"]),
         }
+    }
+
+
+def _commessa_summary_out(commessa_cdc: str, from_ym: int, to_ym: int, group_by: tuple[str, ...],
+                          sort: str, desc: bool, limit: int, offset: int,
+                          row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "commessa_cdc": commessa_cdc,
+        "from_ym": from_ym,
+        "to_ym": to_ym,
+        "group_by": list(group_by),
+        "sort": sort,
+        "order": "desc" if desc else "asc",
+        "limit": limit,
+        "offset": offset,
+        "total_rows": row["total_rows"],
+        "totals": {
+            "giorni_commessa": row["giorni_commessa"],
+            "ore_extra_tot": row["ore_extra_tot"],
+            "spese_tot": row["spese_tot"],
+            "n_employees": row["n_employees"],
+        },
+        "rows": row["rows"],
+    }
+
+
+def _anomalies_out(from_ym: int, to_ym: int, rules: tuple[str, ...], limit: int, offset: int,
+                   row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "from_ym": from_ym,
+        "to_ym": to_ym,
+        "rules": list(rules),
+        "limit": limit,
+        "offset": offset,
+        "total_rows": row["total_rows"],
+        "sheets": row["sheets"],
+        # tutte le regole richieste, anche a zero
+        "counts": {rule: row["counts"].get(rule, 0) for rule in rules},
+        "last_scan": row["last_scan"],
+        "rows": row["rows"],
+    }
+
+
+def _versions_key(versions) -> tuple:
+    # con sede e giorni del calendario: le entry approved non scadono, una chiusura aggiunta in
+    # ras_holidays deve comunque dare una chiave nuova
+    return tuple(sheet_version_key(v) for v in versions)
+
 
-    def get_period_summary(self, email: str, from_ym: int, to_ym: int, hours_per_workday: int = 8) -> dict[str, Any]:
+def _all_approved(versions) -> bool:
+    return bool(versions) and all(v["sheet_status"] == "approved" for v in versions)
+
+
+def _month_cache_key(versions, hours_per_workday: int) -> tuple:
+    return ("month", *_versions_key(versions)[0], hours_per_workday)
+
+
+def _period_cache_key(email: str, from_ym: int, to_ym: int, versions, hours_per_workday: int) -> tuple:
+    return ("period", email, from_ym, to_ym, hours_per_workday, _versions_key(versions))
+
+
+def _batch_from_cache(cache: SummaryCache, targets, versions, hours_per_workday: int):
+    """
+    Riepiloghi batch già noti (sheet mancante o in cache) + (indice, versions) da calcolare.
+    """
+    results: list[dict[str, Any] | None] = []
+    misses = []
+    for i, ((email, year, month), v) in enumerate(zip(targets, versions)):
+        if not v:
+            result = _month_summary_out(email, year, month, None, hours_per_workday)
+        else:
+            result = cache.get(_month_cache_key(v, hours_per_workday))
+        if result is None:
+            misses.append((i, v))
+        results.append(result)
+    return results, misses
+
+
+def _batch_fill(cache: SummaryCache, results, targets, misses, summaries, hours_per_workday: int) -> None:
+    for (i, v), summary in zip(misses, summaries):
+        email, year, month = targets[i]
+        results[i] = _month_summary_out(email, year, month, summary, hours_per_workday)
+        cache.set(_month_cache_key(v, hours_per_workday), results[i], approved=_all_approved(v))
+
+
+class RASService:
+    def __init__(self, repo: RASRepo | None = None, cache: SummaryCache | None = None):
+        self.repo = repo or RASRepo()
+        self.cache = cache or summary_cache
+
+    def get_month_versions(self, email: str, year: int, month: int) -> list[dict[str, Any]]:
+        """
+        Versione (sheet_id, sheet_status, updated_at, sede, giorni del calendario) del RAS del mese:
+        lookup su indice e PK, nessuna aggregazione. Base di ETag / 304 (app/api/responses.py) e della chiave di cache.
+        """
+        ym = year * 100 + month
+        return self.repo.get_sheet_versions(email, ym, ym)
+
+    def get_period_versions(self, email: str, from_ym: int, to_ym: int) -> list[dict[str, Any]]:
+        return self.repo.get_sheet_versions(email, from_ym, to_ym)
+
+    def get_month_summary(self, email: str, year: int, month: int, hours_per_workday: int = 8,
+                          versions: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+        """
+        Riepilogo mese: status + assenze + giorni lavorati + ore ordinarie stimate + extra/spese + check base.
+        Cache per (versione dello sheet, hours_per_workday).
+        versions: get_month_versions già letta dal chiamante (richieste condizionali), non la rilegge.
+        """
+        if not self.cache.enabled:
+            summary = self.repo.get_month_summary(email, year, month)
+            return _month_summary_out(email, year, month, summary, hours_per_workday)
+
+        if versions is None:
+            versions = self.get_month_versions(email, year, month)
+        if not versions:
+            return _month_summary_out(email, year, month, None, hours_per_workday)
+
+        key = _month_cache_key(versions, hours_per_workday)
+        result = self.cache.get(key)
+        if result is None:
+            summary = self.repo.get_month_summary(email, year, month)
+            result = _month_summary_out(email, year, month, summary, hours_per_workday)
+            self.cache.set(key, result, approved=_all_approved(versions))
+        return result
+
+    def get_month_summaries(self, targets: list[tuple[str, int, int]],
+                            hours_per_workday: int = 8) -> list[dict[str, Any]]:
+        """
+        Riepiloghi mese di più (email, anno, mese), nell'ordine di targets (exists False per gli
+        sheet mancanti). Con la cache: versioni di tutti gli sheet in una query, poi una sola query
+        per i riepiloghi non in cache; al più tre query (directory, versioni, riepiloghi) per batch.
+        """
+        if not self.cache.enabled:
+            summaries = self.repo.get_month_summaries(targets)
+            return [_month_summary_out(e, y, m, summary, hours_per_workday)
+                    for (e, y, m), summary in zip(targets, summaries)]
+
+        results, misses = _batch_from_cache(self.cache, targets, self.repo.get_month_versions_many(targets),
+                                            hours_per_workday)
+        if misses:
+            summaries = self.repo.get_month_summaries([targets[i] for i, _ in misses])
+            _batch_fill(self.cache, results, targets, misses, summaries, hours_per_workday)
+        return results
+
+    def get_period_summary(self, email: str, from_ym: int, to_ym: int, hours_per_workday: int = 8,
+                           versions: list[dict[str, Any]] | None = None) -> dict[str, Any]:
         """
         Riepilogo periodo basato sui mesi presenti in ras_sheets.
         from_ym/to_ym in formato YYYYMM (es 202510).
+        Filtro del range, aggregati per mese e totali sono calcolati dal DB in una query.
+        Cache per versione degli sheet di tutti i mesi del range + hours_per_workday.
+        versions: come per get_month_summary.
         """
-        sheets = self.repo.get_sheets_by_user(email)
-
-        # filtra mesi nel range
-        in_range = []
-        for s in sheets:
-            ym = s["year"] * 100 + s["month"]
-            if from_ym <= ym <= to_ym:
-                in_range.append(s)
-
-        months = []
-        tot_ferie = []; tot_perm = []; tot_mal = []
-        tot_work_days = 0
-        tot_ordinary = 0
-        tot_extra = 0.0
-        tot_spese = 0.0
-
-        dizionario_commesse = {}
-
-        for s in in_range:
-            sheet_id = s["id"]
-            absences = self.repo.get_absence_days(sheet_id)
-            work_days = self.repo.count_work_days(sheet_id)
-            extra_spese = self.repo.get_extra_and_expenses(sheet_id)
-            commesse_giorni = self.repo.get_giorni_per_commessa(sheet_id)
-
-            for _row in commesse_giorni:
-                _cdc = _row["commessa_cdc"]
-                _giorni = _row["giorni_commessa"]
-                dizionario_commesse[_cdc] = dizionario_commesse.get(_cdc, 0.0) + _giorni
-
-            tot_ferie.extend(absences["ferie_giorni"])
-            tot_perm.extend(absences["permesso_giorni"])
-            tot_mal.extend(absences["malattia_giorni"])
-            tot_work_days += work_days
-            tot_ordinary += work_days * hours_per_workday
-            tot_extra += float(extra_spese["ore_extra_tot"])
-            tot_spese += float(extra_spese["spese_tot"])
-
-            months.append({
-                "year": s["year"],
-                "month": s["month"],
-                "sheet_status": s["sheet_status"],
-                "absences": absences,
-                "work_days": work_days,
-                "commesse" : commesse_giorni,
-                "ordinary_hours_est": work_days * hours_per_workday,
-                "ore_extra_tot": extra_spese["ore_extra_tot"],
-                "spese_tot": extra_spese["spese_tot"],
-            })
-
-        tot_commesse =  [ {"commessa_cdc": cdc, "giorni_commessa": giorni} for cdc, giorni in dizionario_commesse.items()]
-        return {
-            "email": email,
-            "from_ym": from_ym,
-            "to_ym": to_ym,
-            "months": months,
-            "totals": {
-                "ferie_giorni": tot_ferie,
-                "permesso_giorni": tot_perm,
-                "malattia_giorni": tot_mal,
-                "work_days": tot_work_days,
-                "commesse" : tot_commesse,
-                "ordinary_hours_est": tot_ordinary,
-                "ore_extra_tot": tot_extra,
-                "spese_tot": tot_spese,
-            }
-        }
+        if not self.cache.enabled:
+            period = self.repo.get_period_summary(email, from_ym, to_ym)
+            return _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+
+        if versions is None:
+            versions = self.get_period_versions(email, from_ym, to_ym)
+        key = _period_cache_key(email, from_ym, to_ym, versions, hours_per_workday)
+        result = self.cache.get(key)
+        if result is None:
+            period = self.repo.get_period_summary(email, from_ym, to_ym)
+            result = _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+            self.cache.set(key, result, approved=_all_approved(versions))
+        return result
+
+    def iter_team_month_summaries(self, year: int, month: int, hours_per_workday: int = 8,
+                                  **filters: str | None) -> Iterator[dict[str, Any]]:
+        """
+        Riepilogo mese per ogni dipendente di team / sede / azienda, uno alla volta.
+        filters: team, leader_email, site, company.
+        """
+        for email, summary in self.repo.iter_team_month_summaries(year, month, **filters):
+            yield _month_summary_out(email, year, month, summary, hours_per_workday)
+
+    def iter_team_period_summaries(self, from_ym: int, to_ym: int, hours_per_workday: int = 8,
+                                   **filters: str | None) -> Iterator[dict[str, Any]]:
+        """
+        Riepilogo periodo per ogni dipendente di team / sede / azienda, uno alla volta.
+        filters: team, leader_email, site, company.
+        """
+        for email, period in self.repo.iter_team_period_summaries(from_ym, to_ym, **filters):
+            yield _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+
+    def get_commessa_summary(self, commessa_cdc: str, from_ym: int, to_ym: int, group_by: tuple[str, ...],
+                             sort: str = "giorni_commessa", desc: bool = True,
+                             limit: int = 100, offset: int = 0) -> dict[str, Any]:
+        """
+        Chi ha lavorato su una commessa nel range YYYYMM: giorni pesati, ore extra e spese
+        per mese / sede / dipendente, una pagina di gruppi + totali. Nessuna cache (aggregato già pronto).
+        """
+        row = self.repo.get_commessa_summary(commessa_cdc, from_ym, to_ym, group_by=group_by,
+                                             sort=sort, desc=desc, limit=limit, offset=offset)
+        return _commessa_summary_out(commessa_cdc, from_ym, to_ym, group_by, sort, desc, limit, offset, row)
+
+    def get_anomalies(self, from_ym: int, to_ym: int, rules: tuple[str, ...] = ANOMALY_RULES, *,
+                      limit: int = 100, offset: int = 0, **filters: str | None) -> dict[str, Any]:
+        """
+        Anomalie trovate dallo scan (db/scan_anomalies.py) nel range YYYYMM, filtrabili per regola
+        e team / leader_email / site / company. Nessuna cache: lettura di ras_anomalies per indice.
+        """
+        row = self.repo.get_anomalies(from_ym, to_ym, rules=rules, limit=limit, offset=offset, **filters)
+        return _anomalies_out(from_ym, to_ym, rules, limit, offset, row)
+
+
+class AsyncRASService:
+    """
+    Variante async di RASService: stessi payload, query su AsyncRASRepo.
+    """
+
+    def __init__(self, repo: AsyncRASRepo | None = None, cache: SummaryCache | None = None):
+        self.repo = repo or AsyncRASRepo()
+        self.cache = cache or summary_cache
+
+    async def get_month_versions(self, email: str, year: int, month: int) -> list[dict[str, Any]]:
+        ym = year * 100 + month
+        return await self.repo.get_sheet_versions(email, ym, ym)
+
+    async def get_period_versions(self, email: str, from_ym: int, to_ym: int) -> list[dict[str, Any]]:
+        return await self.repo.get_sheet_versions(email, from_ym, to_ym)
+
+    async def get_month_summary(self, email: str, year: int, month: int, hours_per_workday: int = 8,
+                                versions: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+        if not self.cache.enabled:
+            summary = await self.repo.get_month_summary(email, year, month)
+            return _month_summary_out(email, year, month, summary, hours_per_workday)
+
+        if versions is None:
+            versions = await self.get_month_versions(email, year, month)
+        if not versions:
+            return _month_summary_out(email, year, month, None, hours_per_workday)
+
+        key = _month_cache_key(versions, hours_per_workday)
+        result = self.cache.get(key)
+        if result is None:
+            summary = await self.repo.get_month_summary(email, year, month)
+            result = _month_summary_out(email, year, month, summary, hours_per_workday)
+            self.cache.set(key, result, approved=_all_approved(versions))
+        return result
+
+    async def get_month_summaries(self, targets: list[tuple[str, int, int]],
+                                  hours_per_workday: int = 8) -> list[dict[str, Any]]:
+        if not self.cache.enabled:
+            summaries = await self.repo.get_month_summaries(targets)
+            return [_month_summary_out(e, y, m, summary, hours_per_workday)
+                    for (e, y, m), summary in zip(targets, summaries)]
+
+        versions = await self.repo.get_month_versions_many(targets)
+        results, misses = _batch_from_cache(self.cache, targets, versions, hours_per_workday)
+        if misses:
+            summaries = await self.repo.get_month_summaries([targets[i] for i, _ in misses])
+            _batch_fill(self.cache, results, targets, misses, summaries, hours_per_workday)
+        return results
+
+    async def get_period_summary(self, email: str, from_ym: int, to_ym: int, hours_per_workday: int = 8,
+                                 versions: list[dict[str, Any]] | None = None) -> dict[str, Any]:
+        if not self.cache.enabled:
+            period = await self.repo.get_period_summary(email, from_ym, to_ym)
+            return _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+
+        if versions is None:
+            versions = await self.get_period_versions(email, from_ym, to_ym)
+        key = _period_cache_key(email, from_ym, to_ym, versions, hours_per_workday)
+        result = self.cache.get(key)
+        if result is None:
+            period = await self.repo.get_period_summary(email, from_ym, to_ym)
+            result = _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+            self.cache.set(key, result, approved=_all_approved(versions))
+        return result
+
+    async def iter_team_month_summaries(self, year: int, month: int, hours_per_workday: int = 8,
+                                        **filters: str | None) -> AsyncIterator[dict[str, Any]]:
+        async for email, summary in self.repo.iter_team_month_summaries(year, month, **filters):
+            yield _month_summary_out(email, year, month, summary, hours_per_workday)
+
+    async def iter_team_period_summaries(self, from_ym: int, to_ym: int, hours_per_workday: int = 8,
+                                         **filters: str | None) -> AsyncIterator[dict[str, Any]]:
+        async for email, period in self.repo.iter_team_period_summaries(from_ym, to_ym, **filters):
+            yield _period_summary_out(email, from_ym, to_ym, period, hours_per_workday)
+
+    async def get_commessa_summary(self, commessa_cdc: str, from_ym: int, to_ym: int, group_by: tuple[str, ...],
+                                   sort: str = "giorni_commessa", desc: bool = True,
+                                   limit: int = 100, offset: int = 0) -> dict[str, Any]:
+        row = await self.repo.get_commessa_summary(commessa_cdc, from_ym, to_ym, group_by=group_by,
+                                                   sort=sort, desc=desc, limit=limit, offset=offset)
+        return _commessa_summary_out(commessa_cdc, from_ym, to_ym, group_by, sort, desc, limit, offset, row)
+
+    async def get_anomalies(self, from_ym: int, to_ym: int, rules: tuple[str, ...] = ANOMALY_RULES, *,
+                            limit: int = 100, offset: int = 0, **filters: str | None) -> dict[str, Any]:
+        row = await self.repo.get_anomalies(from_ym, to_ym, rules=rules, limit=limit, offset=offset, **filters)
+        return _anomalies_out(from_ym, to_ym, rules, limit, offset, row)
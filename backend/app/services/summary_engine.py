@@ -0,0 +1,320 @@
+# app/services/summary_engine.py
+"""
+Motore riepiloghi in-process: uno snapshot colonnare di ras_lines per un periodo (record binari
+a larghezza fissa, un blocco per mese) e tutti i riepiloghi mese / periodo calcolati con
+group-by vettoriali numpy.
+
+Stessa interfaccia di RASRepo per i riepiloghi: RASService(repo=SummaryEngine.load(...)) produce
+gli stessi payload del percorso SQL. Utile per i ricalcoli massivi (dashboard, tutti i dipendenti
+per tutti i mesi, più valori di hours_per_workday): una lettura sequenziale del periodo invece di
+una query per riepilogo. Lo snapshot non vede le modifiche successive: per le richieste puntuali
+resta il percorso SQL (con cache).
+
+Importi in centesimi interi: le somme sono esatte e la divisione finale (correttamente arrotondata)
+dà lo stesso double di SUM(numeric)::double precision in Postgres.
+Richiede numpy (pip install ".[engine]").
+"""
+import calendar
+from datetime import date
+from itertools import chain
+from typing import Any, Iterator
+
+from app.repos.ras_repo import ABSENCE_TYPES, SNAPSHOT_LINE_COLUMNS, AsyncRASRepo, RASRepo
+
+# opzionale: pip install ".[engine]"
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_ABSENCE_KEYS = tuple(f"{a.lower()}_giorni" for a in ABSENCE_TYPES)
+
+# record binari dello snapshot (big-endian, come int2send / int4send / int8send)
+_PG_INT_TYPES = {"int2": ">i2", "int4": ">i4", "int8": ">i8"}
+
+# colonne dei giorni per sheet: indice = giorno del mese (0 inutilizzato, day è 1..31)
+_DAYS = 32
+
+
+def engine_available() -> bool:
+    return np is not None
+
+
+def _parse_lines(data: bytes) -> dict[str, Any]:
+    """
+    Record a larghezza fissa -> una colonna numpy (int64 nativo) per campo di SNAPSHOT_LINE_COLUMNS.
+    """
+    dtype = np.dtype([(name, _PG_INT_TYPES[pg_type]) for name, pg_type in SNAPSHOT_LINE_COLUMNS])
+    if len(data) % dtype.itemsize:
+        raise ValueError("snapshot righe: lunghezza non multipla del record")
+    rows = np.frombuffer(data, dtype=dtype)
+    return {name: rows[name].astype(np.int64) for name, _ in SNAPSHOT_LINE_COLUMNS}
+
+
+def _split_rows(rows, values, n: int) -> list[list]:
+    """
+    values raggruppati per rows (già ordinati per riga) -> una lista per riga 0..n-1.
+    """
+    bounds = np.searchsorted(rows, np.arange(n + 1)).tolist()
+    values = values.tolist()
+    return [values[bounds[i]:bounds[i + 1]] for i in range(n)]
+
+
+def _day_lists(mask) -> list[list[int]]:
+    rows, days = np.nonzero(mask)
+    return _split_rows(rows, days, len(mask))
+
+
+def _sorted_commesse(totals: dict[int, int]) -> list[tuple[int, int]]:
+    # giorni DESC, commessa_cdc ASC: il codice segue l'ordine del dizionario (collation del DB)
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+
+class SummaryEngine:
+    """
+    Riepiloghi di tutti gli sheet di uno snapshot (dipendenti filtrati + range YYYYMM).
+    Gli aggregati per sheet sono calcolati una volta alla costruzione; i metodi compongono
+    i dict nello stesso formato di RASRepo.
+    """
+
+    def __init__(self, snapshot: dict[str, Any]):
+        if np is None:
+            raise RuntimeError('summary engine requires numpy: pip install ".[engine]"')
+        self.from_ym = snapshot["from_ym"]
+        self.to_ym = snapshot["to_ym"]
+        self.filters = snapshot["filters"]
+        # dizionario ordinato per commessa_cdc: posizione (da 1) = codice usato nei calcoli
+        self._commesse = [c["commessa_cdc"] for c in snapshot["commesse"]]
+        commessa_ids = np.fromiter((c["id"] for c in snapshot["commesse"]), np.int64, len(self._commesse))
+        commessa_code = np.zeros(int(commessa_ids.max(initial=0)) + 1, np.int64)
+        commessa_code[commessa_ids] = np.arange(1, len(self._commesse) + 1)
+
+        employees = snapshot["employees"]
+        self._emails = [e["email"] for e in employees]
+        self._employee_index = {email: i for i, email in enumerate(self._emails)}
+        employee_pos = {e["id"]: i for i, e in enumerate(employees)}
+
+        # sheet ordinati per id (query snapshot)
+        self._sheets = snapshot["sheets"]
+        n_sheets = len(self._sheets)
+        sheet_ids = np.fromiter((s["sheet_id"] for s in self._sheets), np.int64, n_sheets)
+        sheet_ym = np.fromiter((s["year"] * 100 + s["month"] for s in self._sheets), np.int64, n_sheets)
+        sheet_employee = np.fromiter((employee_pos[s["employee_id"]] for s in self._sheets), np.int64, n_sheets)
+        self._sheet_index = {(s["employee_id"], s["year"], s["month"]): i for i, s in enumerate(self._sheets)}
+        self._employee_ids = [e["id"] for e in employees]
+
+        # sheet di ogni dipendente in ordine (anno, mese)
+        order = np.lexsort((sheet_ym, sheet_employee))
+        self._employee_sheets = _split_rows(sheet_employee[order], order, len(employees))
+
+        lines = _parse_lines(snapshot["lines"])
+        # commessa_id -> posizione nel dizionario (0 resta "nessuna commessa")
+        lines["commessa"] = commessa_code[lines["commessa"]]
+        sheet = np.searchsorted(sheet_ids, lines["sheet_id"])
+        self._compute_days(n_sheets, sheet, lines)
+        self._compute_amounts(n_sheets, sheet, lines)
+        self._compute_commesse(n_sheets, sheet, lines)
+
+    # ---------- calcolo vettoriale (una volta per snapshot) ----------
+
+    def _compute_days(self, n_sheets: int, sheet, lines) -> None:
+        """
+        Conteggi per (sheet, giorno) come per_day della query SQL, in matrici sheet x giorno.
+        """
+        key = sheet * _DAYS + lines["day"]
+        size = n_sheets * _DAYS
+
+        def days_with(mask):
+            return (np.bincount(key[mask], minlength=size) > 0).reshape(n_sheets, _DAYS)
+
+        with_lines = np.bincount(key, minlength=size).reshape(n_sheets, _DAYS) > 0
+        absent = [days_with(lines["activity"] == code) for code, _ in enumerate(ABSENCE_TYPES, 1)]
+        worked = days_with(lines["commessa"] > 0)
+        days_in_month = np.fromiter(
+            (calendar.monthrange(s["year"], s["month"])[1] for s in self._sheets), np.int64, n_sheets)
+        day = np.arange(_DAYS)
+        without_lines = ~with_lines & (day >= 1) & (day <= days_in_month[:, None])
+
+        # giorni lavorativi del calendario (None: mese fuori da ras_work_calendar)
+        calendar_days = [s["calendar_days"] for s in self._sheets]
+        lengths = [len(d) if d is not None else 0 for d in calendar_days]
+        on_calendar = np.zeros((n_sheets, _DAYS), bool)
+        on_calendar[np.repeat(np.arange(n_sheets), lengths),
+                    np.fromiter(chain.from_iterable(d for d in calendar_days if d), np.int64, sum(lengths))] = True
+        gaps = on_calendar & ~with_lines
+
+        self._absences = [_day_lists(mask) for mask in absent]
+        self._work_days = worked.sum(axis=1).tolist()
+        self._days_without_lines = _day_lists(without_lines)
+        self._mixed_days = _day_lists(np.logical_or.reduce(absent) & worked)
+        self._expected_work_days = [len(d) if d is not None else None for d in calendar_days]
+        self._workdays_without_lines = [days if d is not None else None
+                                        for days, d in zip(_day_lists(gaps), calendar_days)]
+        self._missing_work_days = gaps.sum(axis=1).tolist()
+
+    def _compute_amounts(self, n_sheets: int, sheet, lines) -> None:
+        # somme intere in float64: esatte finché < 2**53 centesimi
+        self._ore_extra = np.bincount(sheet, weights=lines["ore_extra"], minlength=n_sheets).astype(np.int64).tolist()
+        self._spese = np.bincount(sheet, weights=lines["tot_spese"], minlength=n_sheets).astype(np.int64).tolist()
+
+    def _compute_commesse(self, n_sheets: int, sheet, lines) -> None:
+        """
+        SUM(rip_percent) per (sheet, commessa): ordinamento per chiave + reduceat, solo le coppie presenti.
+        """
+        work = lines["commessa"] > 0
+        n_codes = len(self._commesse) + 1
+        key = sheet[work] * n_codes + lines["commessa"][work]
+        if not len(key):
+            self._sheet_commesse = [[] for _ in range(n_sheets)]
+            return
+        order = np.argsort(key, kind="stable")
+        key = key[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        rip = np.add.reduceat(lines["rip_percent"][work][order], starts)
+        key = key[starts]
+        owner, code = key // n_codes, key % n_codes
+        ranked = np.lexsort((code, -rip, owner))
+        # per sheet: [codice, centesimi di giorno] in ordine di output
+        pairs = np.stack((code[ranked], rip[ranked]), axis=1)
+        self._sheet_commesse = _split_rows(owner[ranked], pairs, n_sheets)
+
+    # ---------- composizione dei dict (formato RASRepo) ----------
+
+    def _commesse_out(self, pairs) -> list[dict[str, Any]]:
+        return [{"commessa_cdc": self._commesse[code - 1], "giorni_commessa": rip / 10000}
+                for code, rip in pairs]
+
+    def _sheet_absences(self, i: int) -> dict[str, list[date]]:
+        s = self._sheets[i]
+        return {key: [date(s["year"], s["month"], d) for d in days[i]]
+                for key, days in zip(_ABSENCE_KEYS, self._absences)}
+
+    def _month_summary(self, i: int) -> dict[str, Any]:
+        return {
+            "sheet_id": self._sheets[i]["sheet_id"],
+            "absences": self._sheet_absences(i),
+            "work_days": self._work_days[i],
+            "commesse": self._commesse_out(self._sheet_commesse[i]),
+            "ore_extra_tot": self._ore_extra[i] / 100,
+            "spese_tot": self._spese[i] / 100,
+            "days_without_lines": self._days_without_lines[i],
+            "mixed_days": self._mixed_days[i],
+            "expected_work_days": self._expected_work_days[i],
+            "workdays_without_lines": self._workdays_without_lines[i],
+        }
+
+    def _period_summary(self, employee: int | None, from_ym: int, to_ym: int) -> dict[str, Any]:
+        sheets = [] if employee is None else [
+            i for i in self._employee_sheets[employee]
+            if from_ym <= self._sheets[i]["year"] * 100 + self._sheets[i]["month"] <= to_ym
+        ]
+        months = []
+        totals_absences = {key: [] for key in _ABSENCE_KEYS}
+        totals_commesse: dict[int, int] = {}
+        for i in sheets:
+            s = self._sheets[i]
+            absences = self._sheet_absences(i)
+            for key, days in absences.items():
+                totals_absences[key] += days
+            for code, rip in self._sheet_commesse[i]:
+                totals_commesse[code] = totals_commesse.get(code, 0) + rip
+            months.append({
+                "year": s["year"],
+                "month": s["month"],
+                "sheet_status": s["sheet_status"],
+                "absences": absences,
+                "work_days": self._work_days[i],
+                "commesse": self._commesse_out(self._sheet_commesse[i]),
+                "ore_extra_tot": self._ore_extra[i] / 100,
+                "spese_tot": self._spese[i] / 100,
+                "expected_work_days": self._expected_work_days[i],
+                "missing_work_days": (self._missing_work_days[i]
+                                      if self._expected_work_days[i] is not None else None),
+            })
+        return {
+            "months": months,
+            "totals": {
+                **totals_absences,
+                "work_days": sum(self._work_days[i] for i in sheets),
+                "commesse": self._commesse_out(_sorted_commesse(totals_commesse)),
+                "ore_extra_tot": sum(self._ore_extra[i] for i in sheets) / 100,
+                "spese_tot": sum(self._spese[i] for i in sheets) / 100,
+                "expected_work_days": sum(self._expected_work_days[i] or 0 for i in sheets),
+                "missing_work_days": sum(self._missing_work_days[i] for i in sheets),
+            },
+        }
+
+    # ---------- controlli sul perimetro dello snapshot ----------
+
+    def _check_range(self, from_ym: int, to_ym: int) -> None:
+        if from_ym < self.from_ym or to_ym > self.to_ym:
+            raise ValueError(f"range {from_ym}-{to_ym} fuori dallo snapshot {self.from_ym}-{self.to_ym}")
+
+    def _check_filters(self, filters: dict[str, str | None]) -> None:
+        requested = {**dict.fromkeys(self.filters), **filters}
+        if requested != self.filters:
+            raise ValueError(f"filtri {requested} diversi da quelli dello snapshot {self.filters}")
+
+    def _employee(self, email: str) -> int | None:
+        i = self._employee_index.get(email)
+        # con filtri, un'email assente può essere un dipendente fuori dal team: non è "inesistente"
+        if i is None and any(self.filters.values()):
+            raise ValueError(f"{email} non è nello snapshot (filtri {self.filters})")
+        return i
+
+    # ---------- interfaccia RASRepo ----------
+
+    def get_sheet_versions(self, email: str, from_ym: int, to_ym: int) -> list[dict[str, Any]]:
+        self._check_range(from_ym, to_ym)
+        employee = self._employee(email)
+        if employee is None:
+            return []
+        keys = ("sheet_id", "year", "month", "sheet_status", "updated_at", "site")
+        return [{**{k: self._sheets[i][k] for k in keys}, "work_days": self._sheets[i]["calendar_days"]}
+                for i in self._employee_sheets[employee]
+                if from_ym <= self._sheets[i]["year"] * 100 + self._sheets[i]["month"] <= to_ym]
+
+    def get_month_summary(self, email: str, year: int, month: int) -> dict[str, Any] | None:
+        ym = year * 100 + month
+        self._check_range(ym, ym)
+        employee = self._employee(email)
+        if employee is None:
+            return None
+        i = self._sheet_index.get((self._employee_ids[employee], year, month))
+        return None if i is None else self._month_summary(i)
+
+    def get_period_summary(self, email: str, from_ym: int, to_ym: int) -> dict[str, Any]:
+        self._check_range(from_ym, to_ym)
+        return self._period_summary(self._employee(email), from_ym, to_ym)
+
+    def iter_team_month_summaries(self, year: int, month: int,
+                                  **filters: str | None) -> Iterator[tuple[str, dict[str, Any] | None]]:
+        ym = year * 100 + month
+        self._check_range(ym, ym)
+        self._check_filters(filters)
+        for employee, email in enumerate(self._emails):
+            i = self._sheet_index.get((self._employee_ids[employee], year, month))
+            yield email, None if i is None else self._month_summary(i)
+
+    def iter_team_period_summaries(self, from_ym: int, to_ym: int,
+                                   **filters: str | None) -> Iterator[tuple[str, dict[str, Any]]]:
+        self._check_range(from_ym, to_ym)
+        self._check_filters(filters)
+        for employee, email in enumerate(self._emails):
+            yield email, self._period_summary(employee, from_ym, to_ym)
+
+    # ---------- caricamento ----------
+
+    @classmethod
+    def load(cls, from_ym: int, to_ym: int, *, repo: RASRepo | None = None,
+             **filters: str | None) -> "SummaryEngine":
+        """
+        Snapshot del range YYYYMM (filtri: team, leader_email, site, company) + aggregati.
+        """
+        return cls((repo or RASRepo()).get_lines_snapshot(from_ym, to_ym, **filters))
+
+    @classmethod
+    async def load_async(cls, from_ym: int, to_ym: int, *, repo: AsyncRASRepo | None = None,
+                         **filters: str | None) -> "SummaryEngine":
+        # il calcolo è CPU-bound: da un handler async conviene costruirlo in un thread
+        return cls(await (repo or AsyncRASRepo()).get_lines_snapshot(from_ym, to_ym, **filters))
@@ -0,0 +1,199 @@
+"""
+Benchmark HTTP dell'API RAS: throughput e latenze a concorrenza fissa.
+
+Esempi (dalla cartella backend):
+  python -m bench.api_bench --base-url http://localhost:8000 --out run.json
+  python -m bench.api_bench --spawn --workers 1 --env API_ASYNC=false --out sync.json
+  python -m bench.api_bench --seed --employees 2000 --months 12 --sheet-ratio 1 --spawn --out big.json
+  python -m bench.api_bench --spawn --revalidate --endpoints month,period --out polling.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import (
+    BACKEND_DIR, DEFAULT_DSN, DBCounters, latency_stats, run_meta, sample_targets,
+    seed_database, write_results,
+)
+
+ENDPOINTS = ("me", "month", "period")
+
+
+def build_request(endpoint: str, targets: dict, rng: random.Random, period_months: int):
+    if endpoint == "me":
+        return "/me", {"email": rng.choice(targets["emails"])}
+    if endpoint == "month":
+        email, year, month = rng.choice(targets["months"])
+        return "/ras/month-summary", {"email": email, "year": year, "month": month}
+    if endpoint == "period":
+        email, year, month = rng.choice(targets["months"])
+        first_ym = targets["period"][0]
+        # finestra di period_months mesi che termina sul mese campionato
+        end = year * 12 + (month - 1)
+        start = max(end - period_months + 1, (first_ym // 100) * 12 + (first_ym % 100 - 1))
+        from_ym = (start // 12) * 100 + start % 12 + 1
+        return "/ras/period-summary", {"email": email, "from_ym": from_ym, "to_ym": year * 100 + month}
+    raise ValueError(endpoint)
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, concurrency: int, duration: float,
+                    warmup: float, targets: dict, period_months: int, seed: int, revalidate: bool = False) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    body_bytes = 0
+    status_counts: dict[int, int] = {}
+    # --revalidate: ogni URL rimanda l'ultimo ETag ricevuto (dashboard in polling)
+    etags: dict[str, str] = {}
+    t_start = time.perf_counter()
+    t_measure = t_start + warmup
+    t_end = t_measure + duration
+
+    async def worker(worker_id: int):
+        nonlocal errors, body_bytes
+        rng = random.Random(seed * 1000 + worker_id)
+        while True:
+            now = time.perf_counter()
+            if now >= t_end:
+                return
+            path, params = build_request(endpoint, targets, rng, period_months)
+            url = str(httpx.URL(path, params=params))
+            headers = {"If-None-Match": etags[url]} if url in etags else None
+            t0 = time.perf_counter()
+            size = 0
+            try:
+                r = await client.get(path, params=params, headers=headers)
+                status, size = r.status_code, len(r.content)
+                if revalidate and "etag" in r.headers:
+                    etags[url] = r.headers["etag"]
+            except httpx.HTTPError:
+                status = 0
+            elapsed = time.perf_counter() - t0
+            if t0 >= t_measure:
+                latencies.append(elapsed)
+                body_bytes += size
+                status_counts[status] = status_counts.get(status, 0) + 1
+                if status not in (200, 304):
+                    errors += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    n = len(latencies)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": n,
+        "errors": errors,
+        "status": {str(k): v for k, v in sorted(status_counts.items())},
+        "throughput_rps": round(n / duration, 2),
+        "body_bytes_per_request": round(body_bytes / n, 1) if n else 0,
+        **latency_stats(latencies),
+    }
+
+
+async def run_all(args, targets: dict, counters: DBCounters) -> list[dict]:
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                before = counters.snapshot()
+                res = await run_level(client, endpoint, concurrency, args.duration, args.warmup,
+                                      targets, args.period_months, args.rng_seed, args.revalidate)
+                after = counters.snapshot()
+                # le richieste di warmup contano nei contatori DB: si normalizza sul totale inviato
+                sent = res["requests"] + round(res["throughput_rps"] * args.warmup)
+                res.update(DBCounters.per_request(before, after, sent))
+                print(
+                    f"{endpoint:7s} c={concurrency:<4d} rps={res['throughput_rps']:>9.1f} "
+                    f"p50={res.get('p50_ms', 0):>8.2f}ms p95={res.get('p95_ms', 0):>8.2f}ms "
+                    f"p99={res.get('p99_ms', 0):>8.2f}ms q/req={res['queries_per_request'] or res['xacts_per_request']} "
+                    f"B/req={res['body_bytes_per_request']:.0f}"
+                )
+                results.append(res)
+    return results
+
+
+def spawn_server(args) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": args.dsn}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    cmd = [sys.executable, "-m", "uvicorn", "app.api.main:app", "--host", "127.0.0.1",
+           "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{args.base_url}/health", timeout=1).status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("server non avviato entro 30s")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark HTTP /me, /ras/month-summary, /ras/period-summary")
+    p.add_argument("--base-url", default=None, help="default http://127.0.0.1:<port>")
+    p.add_argument("--dsn", default=DEFAULT_DSN, help="DB per seed, campionamento e contatori")
+    p.add_argument("--endpoints", type=lambda v: v.split(","), default=list(ENDPOINTS))
+    p.add_argument("--concurrency", type=lambda v: [int(x) for x in v.split(",")], default=[1, 8, 32])
+    p.add_argument("--duration", type=float, default=10.0, help="secondi misurati per livello")
+    p.add_argument("--warmup", type=float, default=2.0, help="secondi di warmup per livello")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--period-months", type=int, default=12, help="ampiezza delle richieste period-summary")
+    p.add_argument("--rng-seed", type=int, default=1, help="seed per la scelta dei parametri")
+    p.add_argument("--revalidate", action="store_true",
+                   help="If-None-Match con l'ultimo ETag di ogni URL (polling, risposte 304)")
+    p.add_argument("--out", default=None, help="file JSON risultati (default stdout)")
+    p.add_argument("--spawn", action="store_true", help="avvia uvicorn localmente per la durata del benchmark")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--env", action="append", default=[], help="KEY=VALUE per il server avviato con --spawn")
+    p.add_argument("--seed", action="store_true", help="ripopola il DB con db/generate_data.py prima del run")
+    args, generator_args = p.parse_known_args(argv)
+    if generator_args and not args.seed:
+        p.error(f"argomenti non riconosciuti: {' '.join(generator_args)}")
+    args.generator_args = generator_args       # es. --employees 2000 --months 12
+    args.base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed:
+        seed_database(args.dsn, args.generator_args)
+
+    targets = sample_targets(args.dsn)
+    counters = DBCounters(args.dsn)
+    proc = spawn_server(args) if args.spawn else None
+    try:
+        results = asyncio.run(run_all(args, targets, counters))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    write_results(args.out, {
+        "meta": run_meta(
+            kind="api",
+            base_url=args.base_url,
+            duration_s=args.duration,
+            warmup_s=args.warmup,
+            period_months=args.period_months,
+            revalidate=args.revalidate,
+            spawn={"workers": args.workers, "env": args.env} if args.spawn else None,
+            seed_args=args.generator_args if args.seed else None,
+            queries_source="pg_stat_statements" if counters.has_pgss else "pg_stat_database.xacts",
+        ),
+        "results": results,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Confronto tra due file di risultati (api_bench / repo_bench).
+
+  python -m bench.compare before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request", "xacts_per_request")
+
+
+def result_key(res: dict) -> tuple:
+    if "endpoint" in res:
+        return (res["endpoint"], f"c={res['concurrency']}")
+    return (res["method"], res["mode"])
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Differenze tra due run di benchmark")
+    p.add_argument("before")
+    p.add_argument("after")
+    args = p.parse_args(argv)
+
+    with open(args.before) as f:
+        before = {result_key(r): r for r in json.load(f)["results"]}
+    with open(args.after) as f:
+        after = {result_key(r): r for r in json.load(f)["results"]}
+
+    for key in sorted(before.keys() & after.keys()):
+        parts = []
+        for metric in METRICS:
+            a, b = before[key].get(metric), after[key].get(metric)
+            if a is None or b is None:
+                continue
+            delta = (b - a) / a * 100.0 if a else 0.0
+            parts.append(f"{metric}={a:g}->{b:g} ({delta:+.1f}%)")
+        print(" ".join(key), " ".join(parts))
+    for key in sorted(before.keys() ^ after.keys()):
+        print(" ".join(key), "solo in", args.before if key in before else args.after)
+
+
+if __name__ == "__main__":
+    main()
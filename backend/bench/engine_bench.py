@@ -0,0 +1,123 @@
+"""
+Ricalcolo massivo dei riepiloghi: percorso SQL (query set-based per team, raw e rollup) contro il
+motore in-process (app/services/summary_engine.py, snapshot colonnare + numpy).
+
+Carico = per ogni valore di hours_per_workday, il riepilogo mese di tutti i dipendenti filtrati
+per ogni mese del range + il riepilogo periodo dell'intero range, tramite RASService senza cache.
+Con --check confronta i payload dei due percorsi ed esce con codice 1 se differiscono.
+
+Esempi (dalla cartella backend):
+  python -m bench.engine_bench --dsn postgresql://.../ras_gen --check
+  python -m bench.engine_bench --from-ym 202601 --to-ym 202606 --site PI --hours 6,7,8 --out engine.json
+"""
+import argparse
+import os
+import time
+
+from bench.common import DEFAULT_DSN, run_meta, sample_targets, seed_database, write_results
+
+
+def month_range(from_ym: int, to_ym: int) -> list[tuple[int, int]]:
+    months = []
+    year, month = divmod(from_ym, 100)
+    while year * 100 + month <= to_ym:
+        months.append((year, month))
+        year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+    return months
+
+
+def recompute(service, from_ym: int, to_ym: int, hours: list[int], filters: dict) -> list[dict]:
+    payloads = []
+    for h in hours:
+        for year, month in month_range(from_ym, to_ym):
+            payloads += service.iter_team_month_summaries(year, month, h, **filters)
+        payloads += service.iter_team_period_summaries(from_ym, to_ym, h, **filters)
+    return payloads
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark ricalcolo massivo: SQL vs motore in-process")
+    p.add_argument("--dsn", default=DEFAULT_DSN)
+    p.add_argument("--from-ym", type=int, default=None, help="default: primo mese con RAS nel DB")
+    p.add_argument("--to-ym", type=int, default=None, help="default: ultimo mese con RAS nel DB")
+    p.add_argument("--hours", type=lambda v: [int(h) for h in v.split(",")], default=[8],
+                   help="valori di hours_per_workday, es 6,7,8")
+    p.add_argument("--modes", type=lambda v: v.split(","), default=["raw", "rollup"])
+    p.add_argument("--team", default=None)
+    p.add_argument("--leader-email", default=None)
+    p.add_argument("--site", default=None)
+    p.add_argument("--company", default=None)
+    p.add_argument("--check", action="store_true", help="confronta i payload SQL e motore")
+    p.add_argument("--out", default=None)
+    p.add_argument("--seed", action="store_true", help="ripopola il DB con db/generate_data.py prima del run")
+    args, generator_args = p.parse_known_args(argv)
+    if generator_args and not args.seed:
+        p.error(f"argomenti non riconosciuti: {' '.join(generator_args)}")
+    args.generator_args = generator_args
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.seed:
+        seed_database(args.dsn, args.generator_args)
+
+    # il repo legge DATABASE_URL da Settings: import dopo aver fissato il DSN
+    os.environ["DATABASE_URL"] = args.dsn
+    from app.core.cache import SummaryCache
+    from app.core.db import close_pool, open_pool
+    from app.repos.ras_repo import RASRepo
+    from app.services.ras_service import RASService
+    from app.services.summary_engine import SummaryEngine, engine_available
+
+    if not engine_available():
+        print('il motore richiede numpy: pip install ".[engine]"')
+        return 2
+
+    first, last = sample_targets(args.dsn)["period"]
+    from_ym, to_ym = args.from_ym or first, args.to_ym or last
+    filters = {"team": args.team, "leader_email": args.leader_email, "site": args.site, "company": args.company}
+    no_cache = SummaryCache(enabled=False)
+
+    open_pool()
+    results, reference, failures = [], None, 0
+    try:
+        for mode in args.modes:
+            service = RASService(repo=RASRepo(use_rollup=(mode == "rollup")), cache=no_cache)
+            t0 = time.perf_counter()
+            payloads = recompute(service, from_ym, to_ym, args.hours, filters)
+            elapsed = time.perf_counter() - t0
+            reference = reference or payloads
+            print(f"sql    {mode:6s} {len(payloads):>7d} riepiloghi in {elapsed:7.2f}s")
+            results.append({"path": "sql", "mode": mode, "summaries": len(payloads), "seconds": round(elapsed, 3)})
+
+        t0 = time.perf_counter()
+        engine = SummaryEngine.load(from_ym, to_ym, **filters)
+        loaded = time.perf_counter()
+        payloads = recompute(RASService(repo=engine, cache=no_cache), from_ym, to_ym, args.hours, filters)
+        done = time.perf_counter()
+    finally:
+        close_pool()
+
+    elapsed = done - t0
+    print(f"engine load  {loaded - t0:7.2f}s  riepiloghi {done - loaded:7.2f}s  "
+          f"totale {len(payloads):>7d} riepiloghi in {elapsed:7.2f}s")
+    results.append({"path": "engine", "summaries": len(payloads), "seconds": round(elapsed, 3),
+                    "load_seconds": round(loaded - t0, 3), "compute_seconds": round(done - loaded, 3)})
+    for r in results[:-1]:
+        print(f"speedup vs sql {r['mode']}: {r['seconds'] / elapsed:.1f}x")
+
+    if args.check and reference is not None:
+        failures = sum(a != b for a, b in zip(reference, payloads)) + abs(len(reference) - len(payloads))
+        print(f"{failures} riepiloghi diversi" if failures else "payload identici")
+
+    write_results(args.out, {
+        "meta": run_meta(kind="engine", from_ym=from_ym, to_ym=to_ym, hours=args.hours, filters=filters,
+                         seed_args=args.generator_args if args.seed else None),
+        "results": results,
+    })
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,196 @@
+"""
+Regressione dei piani: EXPLAIN ANALYZE di ogni query RASRepo contro un DB popolato (usare la
+scala del generatore, su un DB piccolo il planner preferisce comunque i seq scan).
+Esce con codice 1 se una query fa Seq Scan su una tabella grande, legge più partizioni di
+ras_lines del necessario o supera il budget di blocchi letti.
+
+Budget in blocchi (shared hit + read) e non in costo stimato: con ras_lines partizionata il
+pruning dei join per sheet avviene a runtime, il costo del planner conta comunque tutte le partizioni.
+
+Il DB va controllato dopo VACUUM ANALYZE (lo fanno --seed e db/generate_data.py): senza statistiche
+i rollup sembrano vuoti e senza visibility map gli index-only scan rileggono l'heap, per una
+commessa (un quinto delle righe nel dataset generato) il seq scan diventa il piano migliore.
+
+Esempi (dalla cartella backend):
+  python -m bench.explain_check --dsn postgresql://.../ras_gen
+  python -m bench.explain_check --seed --employees 2000 --months 12 --out plans.json
+"""
+import argparse
+import os
+import random
+import re
+from contextlib import contextmanager
+
+import psycopg
+from psycopg.rows import dict_row, tuple_row
+
+from bench.common import DEFAULT_DSN, run_meta, sample_targets, seed_database, write_results
+from bench.repo_bench import ROLLUP_AWARE, build_cases
+
+# tabelle che crescono con dipendenti x mesi: mai lette per intero da una query del repo
+LARGE_TABLES = {"ras_lines", "ras_sheets", "ras_day_rollup", "ras_commessa_rollup", "ras_commessa_month_rollup"}
+
+# partizioni mensili di ras_lines (db/migrations/0003): contano come ras_lines
+_PARTITION_RE = re.compile(r"^(ras_lines)_(?:y\d{4}m\d{2}|default)$")
+
+# budget di blocchi per metodo; default per le query di un solo sheet / utente.
+# I riepiloghi team leggono un team intero, l'analisi commessa un anno di una commessa: budget proporzionato.
+# Versioni batch: per target lo sheet più due lookup su PK del calendario (sede, '*'), ~10 blocchi
+# ciascuno sui 50 target, qualche heap fetch in più finché autovacuum non passa.
+DEFAULT_BLOCK_BUDGET = 100
+BLOCK_BUDGETS = {
+    "get_period_summary": 1_000,
+    "get_month_versions_many": 600,
+    "get_month_summaries": 2_500,
+    "iter_team_month_summaries": 1_000,
+    "iter_team_period_summaries": 6_000,
+    "get_commessa_summary": 1_000,
+}
+
+# partizioni ras_lines lette: una (il mese dello sheet), il periodo per i riepiloghi di periodo
+# e per i batch di mesi (BATCH_SIZE mesi a caso)
+PERIOD_METHODS = {"get_period_summary", "iter_team_period_summaries", "get_month_summaries"}
+
+
+# piani registrati dalla connessione di controllo, in ordine di esecuzione
+_plans: list[dict] = []
+
+
+class _ExplainingCursor(psycopg.Cursor):
+    """
+    Prima di ogni query ne registra il piano (EXPLAIN ANALYZE in JSON, stessi parametri),
+    poi la esegue normalmente: il metodo del repo riceve i suoi risultati.
+    """
+
+    def execute(self, query, params=None, **kwargs):
+        _explain(self.connection, query, params)
+        return super().execute(query, params, **kwargs)
+
+
+class _ExplainingServerCursor(psycopg.ServerCursor):
+    def execute(self, query, params=None, **kwargs):
+        _explain(self.connection, query, params)
+        return super().execute(query, params, **kwargs)
+
+
+def _explain(conn, query, params) -> None:
+    # cursore base: non ripassa dalla cursor_factory
+    with psycopg.Cursor(conn, row_factory=tuple_row) as cur:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+        _plans.append(cur.fetchone()[0][0])
+
+
+def blocks(node: dict) -> int:
+    return node.get("Shared Hit Blocks", 0) + node.get("Shared Read Blocks", 0)
+
+
+def walk(node: dict):
+    """
+    Nodi eseguiti: salta i sottopiani esclusi dal pruning a runtime (mai eseguiti).
+    """
+    if node.get("Actual Loops") == 0:
+        return
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def base_table(relation: str) -> str:
+    m = _PARTITION_RE.match(relation)
+    return m.group(1) if m else relation
+
+
+def read_relations(plan: dict) -> list[dict]:
+    # scansioni che hanno letto almeno un blocco: una partizione vuota (es. default) non conta
+    return [node for node in walk(plan["Plan"]) if node.get("Relation Name") and blocks(node) > 0]
+
+
+def scanned_partitions(plan: dict) -> set[str]:
+    return {node["Relation Name"] for node in read_relations(plan) if _PARTITION_RE.match(node["Relation Name"])}
+
+
+def check_plan(plan: dict, budget: int, max_partitions: int) -> list[str]:
+    problems = []
+    for node in read_relations(plan):
+        relation = node["Relation Name"]
+        if node["Node Type"] == "Seq Scan" and base_table(relation) in LARGE_TABLES:
+            problems.append(f"Seq Scan su {relation}")
+    partitions = scanned_partitions(plan)
+    if len(partitions) > max_partitions:
+        problems.append(f"{len(partitions)} partizioni ras_lines > {max_partitions} (pruning mancato)")
+    read = blocks(plan["Plan"])
+    if read > budget:
+        problems.append(f"{read} blocchi > budget {budget}")
+    return problems
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Controllo piani EXPLAIN delle query RASRepo")
+    p.add_argument("--dsn", default=DEFAULT_DSN)
+    p.add_argument("--methods", type=lambda v: v.split(","), default=None, help="default: tutti")
+    p.add_argument("--modes", type=lambda v: v.split(","), default=["raw", "rollup"])
+    p.add_argument("--budget-scale", type=float, default=1.0, help="moltiplica tutti i budget di blocchi")
+    p.add_argument("--period-months", type=int, default=12)
+    p.add_argument("--rng-seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="salva i piani in JSON")
+    p.add_argument("--seed", action="store_true", help="ripopola il DB con db/generate_data.py prima del controllo")
+    args, generator_args = p.parse_known_args(argv)
+    if generator_args and not args.seed:
+        p.error(f"argomenti non riconosciuti: {' '.join(generator_args)}")
+    args.generator_args = generator_args
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.seed:
+        seed_database(args.dsn, args.generator_args)
+
+    os.environ["DATABASE_URL"] = args.dsn
+    from app.repos import ras_repo
+
+    targets = sample_targets(args.dsn)
+    with psycopg.connect(args.dsn, row_factory=dict_row) as conn:
+        targets["teams"] = [r["name"] for r in conn.execute("SELECT name FROM teams ORDER BY name")] or [None]
+        conn.cursor_factory = _ExplainingCursor
+        conn.server_cursor_factory = _ExplainingServerCursor
+
+        # tutte le query del repo passano da questa connessione (niente pool)
+        @contextmanager
+        def explaining_conn():
+            yield conn
+
+        ras_repo.get_conn = explaining_conn
+
+        cases = build_cases(targets, args.period_months)
+        methods = args.methods or list(cases)
+        results, failures = [], 0
+        for mode in args.modes:
+            repo = ras_repo.RASRepo(use_rollup=(mode == "rollup"))
+            for method in methods:
+                if mode == "rollup" and method not in ROLLUP_AWARE:
+                    continue
+                budget = int(BLOCK_BUDGETS.get(method, DEFAULT_BLOCK_BUDGET) * args.budget_scale)
+                _plans.clear()
+                cases[method](repo, random.Random(args.rng_seed))
+                conn.rollback()  # chiude la transazione dei cursori server-side
+                # solo l'ultima query: quelle precedenti sono lookup di supporto dei casi (get_sheet_id)
+                plan = _plans[-1]
+                max_partitions = args.period_months if method in PERIOD_METHODS else 1
+                problems = check_plan(plan, budget, max_partitions)
+                failures += bool(problems)
+                status = "FAIL " + "; ".join(problems) if problems else "ok"
+                partitions = len(scanned_partitions(plan))
+                print(f"{method:28s} {mode:6s} blocchi={blocks(plan['Plan']):>6d} "
+                      f"cost={plan['Plan']['Total Cost']:>10.1f} partizioni={partitions:<3d} {status}")
+                results.append({"method": method, "mode": mode, "budget": budget,
+                                "partitions": partitions, "problems": problems, "plan": plan})
+
+    if args.out:
+        write_results(args.out, {"meta": run_meta(kind="explain"), "results": results})
+    print(f"{failures} query fuori budget" if failures else "tutti i piani ok")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
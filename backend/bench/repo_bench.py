@@ -0,0 +1,153 @@
+"""
+Micro-benchmark dei metodi RASRepo eseguiti direttamente contro Postgres (senza HTTP).
+
+Esempi (dalla cartella backend):
+  python -m bench.repo_bench --iterations 200 --out repo.json
+  python -m bench.repo_bench --methods get_month_summary,get_period_summary --modes raw,rollup
+"""
+import argparse
+import calendar
+import os
+import random
+import time
+
+from bench.common import DEFAULT_DSN, latency_stats, run_meta, sample_targets, seed_database, write_results
+
+
+# elementi per chiamata dei metodi batch
+BATCH_SIZE = 50
+
+
+def build_cases(targets: dict, period_months: int):
+    """
+    metodo -> funzione(repo, rng) che esegue una chiamata con parametri campionati.
+    """
+    months = targets["months"]
+    sheet_cache: dict[tuple, int] = {}
+
+    def sheet_id(repo, rng):
+        email, year, month = rng.choice(months)
+        key = (email, year, month)
+        if key not in sheet_cache:
+            sheet_cache[key] = repo.get_sheet_id(email, year, month)
+        return sheet_cache[key], year, month
+
+    def period(rng):
+        email, year, month = rng.choice(months)
+        end = year * 12 + (month - 1) - period_months + 1
+        return email, (end // 12) * 100 + end % 12 + 1, year * 100 + month
+
+    def team_month(repo, rng):
+        _, year, month = rng.choice(months)
+        return sum(1 for _ in repo.iter_team_month_summaries(year, month, team=rng.choice(targets["teams"])))
+
+    def team_period(repo, rng):
+        _, from_ym, to_ym = period(rng)
+        return sum(1 for _ in repo.iter_team_period_summaries(from_ym, to_ym, team=rng.choice(targets["teams"])))
+
+    def batch(rng):
+        # richiesta tipica di POST /ras/month-summaries: mesi diversi di dipendenti diversi
+        return rng.sample(months, min(BATCH_SIZE, len(months)))
+
+    def commessa(repo, rng):
+        _, from_ym, to_ym = period(rng)
+        return repo.get_commessa_summary(rng.choice(targets["commesse"]), from_ym, to_ym)
+
+    return {
+        "get_sheets_by_user": lambda repo, rng: repo.get_sheets_by_user(rng.choice(targets["emails"])),
+        "get_sheet_id": lambda repo, rng: repo.get_sheet_id(*rng.choice(months)),
+        "get_sheet_versions": lambda repo, rng: repo.get_sheet_versions(*period(rng)),
+        "count_absences": lambda repo, rng: repo.count_absences(sheet_id(repo, rng)[0]),
+        "get_absence_days": lambda repo, rng: repo.get_absence_days(sheet_id(repo, rng)[0]),
+        "get_giorni_per_commessa": lambda repo, rng: repo.get_giorni_per_commessa(sheet_id(repo, rng)[0]),
+        "count_work_days": lambda repo, rng: repo.count_work_days(sheet_id(repo, rng)[0]),
+        "get_extra_and_expenses": lambda repo, rng: repo.get_extra_and_expenses(sheet_id(repo, rng)[0]),
+        "get_days_without_lines": lambda repo, rng: (
+            lambda s: repo.get_days_without_lines(s[0], calendar.monthrange(s[1], s[2])[1])
+        )(sheet_id(repo, rng)),
+        "get_mixed_days": lambda repo, rng: repo.get_mixed_days(sheet_id(repo, rng)[0]),
+        "get_month_summary": lambda repo, rng: repo.get_month_summary(*rng.choice(months)),
+        "get_month_versions_many": lambda repo, rng: repo.get_month_versions_many(batch(rng)),
+        "get_month_summaries": lambda repo, rng: repo.get_month_summaries(batch(rng)),
+        "get_period_summary": lambda repo, rng: repo.get_period_summary(*period(rng)),
+        "iter_team_month_summaries": team_month,
+        "iter_team_period_summaries": team_period,
+        "get_commessa_summary": commessa,
+    }
+
+
+# metodi che leggono dai rollup quando use_rollup=True
+ROLLUP_AWARE = {
+    "get_month_summary", "get_month_summaries", "get_period_summary", "iter_team_month_summaries", "iter_team_period_summaries",
+}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Micro-benchmark RASRepo")
+    p.add_argument("--dsn", default=DEFAULT_DSN)
+    p.add_argument("--iterations", type=int, default=100)
+    p.add_argument("--warmup", type=int, default=10)
+    p.add_argument("--methods", type=lambda v: v.split(","), default=None, help="default: tutti")
+    p.add_argument("--modes", type=lambda v: v.split(","), default=["raw", "rollup"])
+    p.add_argument("--period-months", type=int, default=12)
+    p.add_argument("--rng-seed", type=int, default=1)
+    p.add_argument("--out", default=None)
+    p.add_argument("--seed", action="store_true", help="ripopola il DB con db/generate_data.py prima del run")
+    args, generator_args = p.parse_known_args(argv)
+    if generator_args and not args.seed:
+        p.error(f"argomenti non riconosciuti: {' '.join(generator_args)}")
+    args.generator_args = generator_args
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed:
+        seed_database(args.dsn, args.generator_args)
+
+    # il repo legge DATABASE_URL da Settings: import dopo aver fissato il DSN
+    os.environ["DATABASE_URL"] = args.dsn
+    from app.core.db import close_pool, open_pool
+    from app.repos.ras_repo import RASRepo
+
+    import psycopg
+    targets = sample_targets(args.dsn)
+    with psycopg.connect(args.dsn) as conn:
+        targets["teams"] = [r[0] for r in conn.execute("SELECT name FROM teams ORDER BY name")] or [None]
+
+    cases = build_cases(targets, args.period_months)
+    methods = args.methods or list(cases)
+
+    open_pool()
+    results = []
+    try:
+        for mode in args.modes:
+            repo = RASRepo(use_rollup=(mode == "rollup"))
+            for method in methods:
+                if mode == "rollup" and method not in ROLLUP_AWARE:
+                    continue
+                call = cases[method]
+                rng = random.Random(args.rng_seed)
+                for _ in range(args.warmup):
+                    call(repo, rng)
+                latencies = []
+                for _ in range(args.iterations):
+                    t0 = time.perf_counter()
+                    call(repo, rng)
+                    latencies.append(time.perf_counter() - t0)
+                res = {"method": method, "mode": mode, **latency_stats(latencies)}
+                print(f"{method:28s} {mode:6s} p50={res['p50_ms']:>8.3f}ms p95={res['p95_ms']:>8.3f}ms "
+                      f"p99={res['p99_ms']:>8.3f}ms")
+                results.append(res)
+    finally:
+        close_pool()
+
+    write_results(args.out, {
+        "meta": run_meta(kind="repo", iterations=args.iterations, period_months=args.period_months,
+                         seed_args=args.generator_args if args.seed else None),
+        "results": results,
+    })
+
+
+if __name__ == "__main__":
+    main()
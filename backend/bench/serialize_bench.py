@@ -0,0 +1,136 @@
+"""
+Costo CPU per risposta della serializzazione dei riepiloghi: percorso response_model di FastAPI
+(validazione pydantic + dump JSON, o jsonable_encoder + json.dumps delle versioni meno recenti)
+contro il percorso diretto di app/api/responses.py (app.core.serialization.dumps: orjson, o
+pydantic_core.to_json senza orjson).
+
+Payload reali presi da RASService senza cache: riepiloghi mese singoli, periodi sull'intero range
+di mesi del DB e le righe NDJSON di /ras/team-summary per una sede.
+Con --check verifica che ogni encoder produca lo stesso JSON (tipi compresi) del percorso pydantic.
+
+Esempi (dalla cartella backend):
+  python -m bench.serialize_bench --dsn postgresql://.../ras_gen --check
+  python -m bench.serialize_bench --site MI --repeat 20 --out serialize.json
+"""
+import argparse
+import json
+import os
+import time
+
+from bench.common import DEFAULT_DSN, run_meta, sample_targets, write_results
+
+
+def _same(a, b) -> bool:
+    # uguaglianza stretta: 5 e 5.0 sono diversi (lo schema dice float)
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def encoders() -> dict:
+    from fastapi.encoders import jsonable_encoder
+
+    from app.core import serialization
+
+    def pydantic_json(payload, model):
+        return model.model_validate(payload).model_dump_json().encode()
+
+    def jsonable(payload, model):
+        # JSONResponse di Starlette
+        return json.dumps(jsonable_encoder(model.model_validate(payload)), ensure_ascii=False,
+                          allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def fast_pydantic_core(payload, model):
+        saved, serialization.orjson = serialization.orjson, None
+        try:
+            return serialization.dumps(payload)
+        finally:
+            serialization.orjson = saved
+
+    result = {"pydantic": pydantic_json, "jsonable": jsonable, "fast_pydantic_core": fast_pydantic_core}
+    if serialization.orjson_available():
+        result["fast_orjson"] = lambda payload, model: serialization.dumps(payload)
+    return result
+
+
+def build_cases(svc, targets: dict, args) -> dict[str, tuple[list[dict], type]]:
+    from app.models.schemas import MonthSummaryOut, PeriodSummaryOut
+
+    from_ym, to_ym = targets["period"]
+    months = targets["months"][:args.samples]
+    emails = targets["emails"][:args.samples]
+    year, month = months[0][1], months[0][2]
+    return {
+        "month": ([svc.get_month_summary(e, y, m) for e, y, m in months], MonthSummaryOut),
+        "period": ([svc.get_period_summary(e, from_ym, to_ym) for e in emails], PeriodSummaryOut),
+        "team_month": (list(svc.iter_team_month_summaries(year, month, site=args.site)), MonthSummaryOut),
+        "team_period": (list(svc.iter_team_period_summaries(from_ym, to_ym, site=args.site)), PeriodSummaryOut),
+    }
+
+
+def measure(encode, payloads: list[dict], model, repeat: int) -> tuple[float, int]:
+    """
+    CPU (process_time) per risposta in microsecondi, byte medi per risposta.
+    """
+    size = sum(len(encode(p, model)) for p in payloads)
+    t0 = time.process_time()
+    for _ in range(repeat):
+        for p in payloads:
+            encode(p, model)
+    cpu = time.process_time() - t0
+    return cpu / (repeat * len(payloads)) * 1e6, size // len(payloads)
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark serializzazione risposte riepilogo")
+    p.add_argument("--dsn", default=DEFAULT_DSN)
+    p.add_argument("--samples", type=int, default=200, help="riepiloghi mese / periodo campionati")
+    p.add_argument("--site", default="PI", help="sede dei riepiloghi team (righe NDJSON)")
+    p.add_argument("--repeat", type=int, default=10, help="passate su ogni insieme di payload")
+    p.add_argument("--check", action="store_true", help="confronta il JSON di ogni encoder con pydantic")
+    p.add_argument("--out", default=None)
+    return p.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.environ["DATABASE_URL"] = args.dsn
+    os.environ["CACHE_ENABLED"] = "false"
+    from app.services.ras_service import RASService
+
+    targets = sample_targets(args.dsn, limit=args.samples)
+    cases = build_cases(RASService(), targets, args)
+    encs = encoders()
+
+    results, mismatches = [], 0
+    for case, (payloads, model) in cases.items():
+        if not payloads:
+            continue
+        base_us = None
+        for name, encode in encs.items():
+            if args.check and name != "pydantic":
+                mismatches += sum(not _same(json.loads(encode(p, model)), json.loads(encs["pydantic"](p, model)))
+                                  for p in payloads)
+            us, size = measure(encode, payloads, model, args.repeat)
+            base_us = base_us or us
+            res = {"case": case, "encoder": name, "responses": len(payloads), "bytes": size,
+                   "cpu_us": round(us, 2), "speedup": round(base_us / us, 2)}
+            print(f"{case:12s} {name:18s} n={len(payloads):<5d} {size:>7d}B "
+                  f"cpu={us:>9.2f}us/resp x{res['speedup']:.2f}")
+            results.append(res)
+
+    if args.check:
+        print("payload identici" if not mismatches else f"{mismatches} payload diversi")
+    write_results(args.out, {
+        "meta": run_meta(kind="serialize", samples=args.samples, site=args.site, repeat=args.repeat),
+        "results": results,
+    })
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,205 @@
+"""
+Benchmark di avvio e arresto del server di produzione (python -m app.api.server).
+
+Per ogni run: tempo fino a /health/live e /health/ready, latenza delle prime richieste (mesi mai
+richiesti prima) contro le stesse richieste ripetute a caldo; poi SIGTERM sotto carico: quanto
+tarda /health/ready a passare a 503, quante richieste falliscono, quanto impiega il processo a uscire.
+
+Esempi (dalla cartella backend):
+  python -m bench.startup_bench --workers 2 --runs 3 --out startup.json
+  python -m bench.startup_bench --env WARMUP_ENABLED=false --out no_warmup.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.common import BACKEND_DIR, DEFAULT_DSN, latency_stats, run_meta, sample_targets, write_results
+
+POLL_INTERVAL = 0.02
+
+
+def spawn_server(args) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": args.dsn, "SERVER_HOST": "127.0.0.1",
+           "SERVER_PORT": str(args.port), "SERVER_WORKERS": str(args.workers)}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return subprocess.Popen([sys.executable, "-m", "app.api.server"], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_status(client: httpx.Client, path: str, status: int, t0: float, timeout: float) -> float:
+    """
+    Secondi (da t0) al primo `status` su path; SystemExit se non arriva entro timeout.
+    """
+    while time.perf_counter() - t0 < timeout:
+        try:
+            if client.get(path).status_code == status:
+                return time.perf_counter() - t0
+        except httpx.HTTPError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    raise SystemExit(f"{path} non ha risposto {status} entro {timeout}s")
+
+
+def month_requests(targets: dict, n: int, rng: random.Random) -> list[tuple[str, dict]]:
+    months = rng.sample(targets["months"], min(n, len(targets["months"])))
+    return [("/ras/month-summary", {"email": email, "year": year, "month": month})
+            for email, year, month in months]
+
+
+def timed_requests(client: httpx.Client, requests: list[tuple[str, dict]]) -> tuple[list[float], int]:
+    latencies, errors = [], 0
+    for path, params in requests:
+        t0 = time.perf_counter()
+        status = client.get(path, params=params).status_code
+        latencies.append(time.perf_counter() - t0)
+        errors += status != 200
+    return latencies, errors
+
+
+async def drain_under_load(args, proc: subprocess.Popen, requests: list[tuple[str, dict]]) -> dict:
+    """
+    Carico a concorrenza fissa, SIGTERM dopo --term-after secondi, carico avanti finché il processo esce.
+    Una richiesta fallita prima della chiusura del listener (fine del drain) è un errore vero;
+    dopo, le connessioni rifiutate sono attese e contate a parte.
+    """
+    base_url = f"http://127.0.0.1:{args.port}"
+    outcomes: list[tuple[float, int]] = []
+    t_term: float | None = None
+    t_not_ready: float | None = None
+    exited = asyncio.Event()
+
+    async def load(client: httpx.AsyncClient, worker_id: int):
+        rng = random.Random(worker_id)
+        while not exited.is_set():
+            path, params = rng.choice(requests)
+            t0 = time.perf_counter()
+            try:
+                status = (await client.get(path, params=params)).status_code
+            except httpx.HTTPError:
+                status = 0
+                await asyncio.sleep(POLL_INTERVAL)
+            outcomes.append((t0, status))
+
+    async def poll_ready(client: httpx.AsyncClient):
+        nonlocal t_not_ready
+        while t_not_ready is None and not exited.is_set():
+            try:
+                if (await client.get("/health/ready")).status_code == 503:
+                    t_not_ready = time.perf_counter()
+            except httpx.HTTPError:
+                t_not_ready = time.perf_counter()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def terminate():
+        nonlocal t_term
+        await asyncio.sleep(args.term_after)
+        t_term = time.perf_counter()
+        proc.send_signal(signal.SIGTERM)
+        await asyncio.gather(asyncio.to_thread(proc.wait, args.timeout), poll_ready(probe))
+        exited.set()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client, \
+            httpx.AsyncClient(base_url=base_url, timeout=1.0) as probe:
+        await asyncio.gather(terminate(), *(load(client, i) for i in range(args.concurrency)))
+    t_exit = time.perf_counter()
+
+    during_drain = [status for t0, status in outcomes
+                    if t0 >= t_term and (t_not_ready is None or t0 < t_term + args.drain_seconds)]
+    failed_before_term = sum(1 for t0, status in outcomes if t0 < t_term and status != 200)
+    return {
+        "concurrency": args.concurrency,
+        "requests": len(outcomes),
+        "errors_before_term": failed_before_term,
+        "requests_during_drain": len(during_drain),
+        "errors_during_drain": sum(1 for status in during_drain if status != 200),
+        "http_errors_after_term": sum(1 for t0, status in outcomes if t0 >= t_term and status not in (0, 200)),
+        "refused_after_term": sum(1 for t0, status in outcomes if t0 >= t_term and status == 0),
+        "not_ready_s": round(t_not_ready - t_term, 3) if t_not_ready is not None else None,
+        "exit_s": round(t_exit - t_term, 3),
+        "exit_code": proc.returncode,
+    }
+
+
+def run_once(args, targets: dict, run: int) -> dict:
+    rng = random.Random(args.rng_seed + run)
+    cold = month_requests(targets, args.first_requests, rng)
+    proc = spawn_server(args)
+    t0 = time.perf_counter()
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            live_s = wait_status(client, "/health/live", 200, t0, args.timeout)
+            ready_s = wait_status(client, "/health/ready", 200, t0, args.timeout)
+            state = client.get("/health/ready").json()
+            first, first_errors = timed_requests(client, cold)
+            warm, warm_errors = timed_requests(client, cold)
+        drain = asyncio.run(drain_under_load(args, proc, cold)) if args.drain else None
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    res = {
+        "run": run,
+        "live_s": round(live_s, 3),
+        "ready_s": round(ready_s, 3),
+        "app_startup_s": state.get("startup_s"),
+        "first_requests": {"errors": first_errors, **latency_stats(first)},
+        "warm_requests": {"errors": warm_errors, **latency_stats(warm)},
+        "drain": drain,
+    }
+    print(
+        f"run {run}: live={res['live_s']:.3f}s ready={res['ready_s']:.3f}s "
+        f"first p50={res['first_requests'].get('p50_ms', 0):.2f}ms "
+        f"warm p50={res['warm_requests'].get('p50_ms', 0):.2f}ms"
+        + (f" drain: not_ready={drain['not_ready_s']}s errors={drain['errors_during_drain']}"
+           f" exit={drain['exit_s']}s code={drain['exit_code']}" if drain else "")
+    )
+    return res
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark avvio (live/ready, prime richieste) e drain allo SIGTERM")
+    p.add_argument("--dsn", default=DEFAULT_DSN, help="DB del server e per il campionamento")
+    p.add_argument("--port", type=int, default=8766)
+    p.add_argument("--workers", type=int, default=1)
+    p.add_argument("--env", action="append", default=[], help="KEY=VALUE per il server")
+    p.add_argument("--runs", type=int, default=3)
+    p.add_argument("--first-requests", type=int, default=20, help="richieste month-summary distinte per run")
+    p.add_argument("--no-drain", dest="drain", action="store_false", help="solo avvio, arresto con kill")
+    p.add_argument("--concurrency", type=int, default=8, help="concorrenza del carico durante il drain")
+    p.add_argument("--term-after", type=float, default=1.0, help="secondi di carico prima del SIGTERM")
+    p.add_argument("--drain-seconds", type=float, default=5.0,
+                   help="finestra di drain attesa (SERVER_DRAIN_SECONDS del server)")
+    p.add_argument("--timeout", type=float, default=60.0)
+    p.add_argument("--rng-seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="file JSON risultati (default stdout)")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    targets = sample_targets(args.dsn)
+    results = [run_once(args, targets, run) for run in range(args.runs)]
+    write_results(args.out, {
+        "meta": run_meta(
+            kind="startup",
+            workers=args.workers,
+            env=args.env,
+            first_requests=args.first_requests,
+            drain_seconds=args.drain_seconds,
+        ),
+        "results": results,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-BEGIN;
+-- 0000: schema iniziale (ex db/schema.sql), eseguito in una transazione dal runner.
+-- Su DB creati con il vecchio schema.sql: python db/migrate.py baseline 0000
 
 -- ====== anagrafiche ======
 
@@ -86,5 +87,3 @@ CREATE INDEX IF NOT EXISTS idx_ras_lines_sheet_day ON ras_lines(sheet_id, day);
 CREATE INDEX IF NOT EXISTS idx_ras_lines_commessa ON ras_lines(commessa_cdc);
 CREATE INDEX IF NOT EXISTS idx_ras_sheets_emp_period ON ras_sheets(employee_id, year, month);
 CREATE INDEX IF NOT EXISTS idx_team_members_employee ON team_members(employee_id);
-
-COMMIT;
@@ -0,0 +1,37 @@
+-- 0001: indici per i percorsi di accesso reali di RASRepo
+--
+-- CONCURRENTLY: db/migrate.py la esegue statement per statement fuori transazione.
+-- Idempotente: rieseguibile senza errori dopo un'interruzione.
+
+-- ras_lines per sheet: tutte le query leggono le righe di uno o più sheet.
+-- Covering sulle colonne dei riepiloghi -> index-only scan (CTE "l", extra/spese, assenze per giorno).
+-- Sostituisce idx_ras_lines_sheet_day (stesso prefisso).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ras_lines_sheet_day_cov
+  ON ras_lines (sheet_id, day)
+  INCLUDE (activity_desc, commessa_cdc, rip_percent, ore_extra, tot_spese);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_ras_lines_sheet_day;
+
+-- righe di assenza (get_absence_days): pochi giorni per sheet, predicato identico alla query
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ras_lines_absence
+  ON ras_lines (sheet_id, day)
+  INCLUDE (activity_desc)
+  WHERE activity_desc IN ('FERIE', 'PERMESSO', 'MALATTIA');
+
+-- righe con commessa (get_giorni_per_commessa, count_work_days): già ordinate per GROUP BY commessa
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ras_lines_sheet_commessa
+  ON ras_lines (sheet_id, commessa_cdc)
+  INCLUDE (rip_percent, day)
+  WHERE commessa_cdc IS NOT NULL;
+
+-- ras_sheets per dipendente + mese: idx_ras_sheets_emp_period duplicava il vincolo UNIQUE.
+-- La versione covering serve anche id / sheet_status senza heap fetch
+-- (updated_at escluso di proposito: cambia a ogni modifica delle righe e annullerebbe gli update HOT).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_ras_sheets_emp_period_cov
+  ON ras_sheets (employee_id, year, month)
+  INCLUDE (id, sheet_status);
+
+DROP INDEX CONCURRENTLY IF EXISTS idx_ras_sheets_emp_period;
+
+ANALYZE ras_lines;
+ANALYZE ras_sheets;
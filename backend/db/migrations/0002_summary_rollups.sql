@@ -0,0 +1,194 @@
+-- 0002: rollup per (sheet, giorno) e (sheet, commessa) e versione degli sheet (updated_at segue
+-- le modifiche alle righe), prima del partizionamento di ras_lines (0003 ne ricrea i trigger).
+-- Su un DB con dati (vecchio schema.sql + baseline 0000) i rollup sono ricostruiti alla fine.
+
+-- ====== rollup per (sheet, giorno) e (sheet, commessa) ======
+-- Pre-aggregati di ras_lines per i riepiloghi: mantenuti dai trigger sotto,
+-- letti da RASRepo con use_rollup=True.
+
+CREATE TABLE IF NOT EXISTS ras_day_rollup (
+  sheet_id    BIGINT  NOT NULL REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  day         INTEGER NOT NULL,
+  n_lines     INTEGER NOT NULL,
+  n_ferie     INTEGER NOT NULL,
+  n_permesso  INTEGER NOT NULL,
+  n_malattia  INTEGER NOT NULL,
+  n_work      INTEGER NOT NULL,          -- righe con commessa valorizzata
+  ore_extra   NUMERIC(12,2) NOT NULL,
+  tot_spese   NUMERIC(14,2) NOT NULL,
+  PRIMARY KEY (sheet_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS ras_commessa_rollup (
+  sheet_id        BIGINT NOT NULL REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  commessa_cdc    TEXT   NOT NULL,
+  n_lines         INTEGER NOT NULL,
+  rip_percent_tot NUMERIC(12,2) NOT NULL,
+  PRIMARY KEY (sheet_id, commessa_cdc)
+);
+
+-- applica le righe inserite (+) / cancellate (-) con tabelle di transizione:
+-- un solo passaggio per statement, anche per COPY / insert massivi
+CREATE OR REPLACE FUNCTION ras_rollup_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    -- UPDATE ... FROM: se lo sheet è già stato cancellato (cascade) non c'è nulla da sottrarre
+    UPDATE ras_day_rollup r
+    SET n_lines    = r.n_lines    - d.n_lines,
+        n_ferie    = r.n_ferie    - d.n_ferie,
+        n_permesso = r.n_permesso - d.n_permesso,
+        n_malattia = r.n_malattia - d.n_malattia,
+        n_work     = r.n_work     - d.n_work,
+        ore_extra  = r.ore_extra  - d.ore_extra,
+        tot_spese  = r.tot_spese  - d.tot_spese
+    FROM (
+      SELECT sheet_id, day,
+             COUNT(*) AS n_lines,
+             COUNT(*) FILTER (WHERE activity_desc = 'FERIE')    AS n_ferie,
+             COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO') AS n_permesso,
+             COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA') AS n_malattia,
+             COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL)   AS n_work,
+             SUM(ore_extra) AS ore_extra,
+             SUM(tot_spese) AS tot_spese
+      FROM old_rows
+      GROUP BY sheet_id, day
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.day = d.day;
+
+    UPDATE ras_commessa_rollup r
+    SET n_lines         = r.n_lines - d.n_lines,
+        rip_percent_tot = r.rip_percent_tot - d.rip_percent_tot
+    FROM (
+      SELECT sheet_id, commessa_cdc, COUNT(*) AS n_lines, SUM(rip_percent) AS rip_percent_tot
+      FROM old_rows
+      WHERE commessa_cdc IS NOT NULL
+      GROUP BY sheet_id, commessa_cdc
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.commessa_cdc = d.commessa_cdc;
+
+    DELETE FROM ras_day_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+    DELETE FROM ras_commessa_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO ras_day_rollup AS r
+      (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+    SELECT sheet_id, day,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE activity_desc = 'FERIE'),
+           COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO'),
+           COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA'),
+           COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL),
+           SUM(ore_extra),
+           SUM(tot_spese)
+    FROM new_rows
+    GROUP BY sheet_id, day
+    ON CONFLICT (sheet_id, day) DO UPDATE
+    SET n_lines    = r.n_lines    + EXCLUDED.n_lines,
+        n_ferie    = r.n_ferie    + EXCLUDED.n_ferie,
+        n_permesso = r.n_permesso + EXCLUDED.n_permesso,
+        n_malattia = r.n_malattia + EXCLUDED.n_malattia,
+        n_work     = r.n_work     + EXCLUDED.n_work,
+        ore_extra  = r.ore_extra  + EXCLUDED.ore_extra,
+        tot_spese  = r.tot_spese  + EXCLUDED.tot_spese;
+
+    INSERT INTO ras_commessa_rollup AS r (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+    SELECT sheet_id, commessa_cdc, COUNT(*), SUM(rip_percent)
+    FROM new_rows
+    WHERE commessa_cdc IS NOT NULL
+    GROUP BY sheet_id, commessa_cdc
+    ON CONFLICT (sheet_id, commessa_cdc) DO UPDATE
+    SET n_lines         = r.n_lines + EXCLUDED.n_lines,
+        rip_percent_tot = r.rip_percent_tot + EXCLUDED.rip_percent_tot;
+  END IF;
+
+  RETURN NULL;
+END $$;
+
+-- le tabelle di transizione richiedono un trigger per evento
+CREATE OR REPLACE TRIGGER trg_ras_lines_rollup_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE OR REPLACE TRIGGER trg_ras_lines_rollup_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE OR REPLACE TRIGGER trg_ras_lines_rollup_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+-- ricostruzione completa (backfill su dati esistenti o dopo un mismatch)
+CREATE OR REPLACE FUNCTION ras_rollup_rebuild() RETURNS void
+LANGUAGE sql AS $$
+  TRUNCATE ras_day_rollup, ras_commessa_rollup;
+
+  INSERT INTO ras_day_rollup
+    (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+  SELECT sheet_id, day,
+         COUNT(*),
+         COUNT(*) FILTER (WHERE activity_desc = 'FERIE'),
+         COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO'),
+         COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA'),
+         COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL),
+         SUM(ore_extra),
+         SUM(tot_spese)
+  FROM ras_lines
+  GROUP BY sheet_id, day;
+
+  INSERT INTO ras_commessa_rollup (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+  SELECT sheet_id, commessa_cdc, COUNT(*), SUM(rip_percent)
+  FROM ras_lines
+  WHERE commessa_cdc IS NOT NULL
+  GROUP BY sheet_id, commessa_cdc;
+$$;
+
+-- ====== versione sheet: updated_at segue anche le modifiche alle righe ======
+-- (sheet_id, updated_at) è la chiave della cache riepiloghi lato API
+
+CREATE OR REPLACE FUNCTION ras_sheets_set_updated_at() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.updated_at := now();
+  RETURN NEW;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_ras_sheets_updated_at
+  BEFORE UPDATE ON ras_sheets
+  FOR EACH ROW EXECUTE FUNCTION ras_sheets_set_updated_at();
+
+CREATE OR REPLACE FUNCTION ras_sheets_touch() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    UPDATE ras_sheets SET updated_at = now()
+    WHERE id IN (SELECT DISTINCT sheet_id FROM old_rows);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    UPDATE ras_sheets SET updated_at = now()
+    WHERE id IN (SELECT DISTINCT sheet_id FROM new_rows);
+  END IF;
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE TRIGGER trg_ras_lines_touch_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE OR REPLACE TRIGGER trg_ras_lines_touch_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE OR REPLACE TRIGGER trg_ras_lines_touch_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+-- backfill: vuoto su un DB nuovo
+SELECT ras_rollup_rebuild();
@@ -0,0 +1,281 @@
+"""
+0003: ras_lines partizionata per mese dello sheet (RANGE su ym = year * 100 + month).
+
+Online, come le altre migrazioni:
+  1. ras_lines_p partizionata + indici, vuota (nessun lock su ras_lines)
+  2. copia a batch per id, un commit per batch (le scritture continuano sulla tabella vecchia)
+  3. risincronizzazione degli sheet modificati durante la copia (updated_at, mantenuto dai trigger)
+  4. swap in una transazione breve: ultima risincronizzazione sotto lock, rename, trigger
+
+Rieseguibile dopo un'interruzione: riprende dall'ultimo id copiato; l'istante di inizio copia
+è salvato nel commento di ras_lines_p. La tabella vecchia, se non vuota, resta come
+ras_lines_unpartitioned: da cancellare a mano dopo la verifica.
+
+ras_sheets non è partizionata: la PK di una tabella partizionata deve includere la chiave di
+partizione, e ras_lines / i rollup referenziano ras_sheets(id).
+"""
+
+FUNCTIONS_SQL = """
+-- partizione mensile, es. ras_lines_y2025m10 per ym = 202510. NULL se esiste già.
+-- Le righe del mese finite nel default vengono spostate prima dell'attach.
+CREATE OR REPLACE FUNCTION ras_lines_create_partition(p_ym integer, p_parent text DEFAULT 'ras_lines')
+RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+  part    text    := format('ras_lines_y%sm%s', p_ym / 100, lpad((p_ym % 100)::text, 2, '0'));
+  next_ym integer := CASE WHEN p_ym % 100 = 12 THEN p_ym + 89 ELSE p_ym + 1 END;
+BEGIN
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN NULL;
+  END IF;
+  EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, p_parent);
+  -- DML diretto sulla partizione: i trigger di rollup (sul padre) non scattano, i totali non cambiano
+  IF to_regclass('ras_lines_default') IS NOT NULL THEN
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM ras_lines_default WHERE ym = %s RETURNING *) INSERT INTO %I SELECT * FROM moved',
+      p_ym, part);
+  END IF;
+  EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)', p_parent, part, p_ym, next_ym);
+  RETURN part;
+END $$;
+
+-- partizioni per ogni mese con sheet + i prossimi p_months_ahead mesi; ritorna quelle create
+CREATE OR REPLACE FUNCTION ras_lines_ensure_partitions(p_months_ahead integer DEFAULT 3,
+                                                       p_parent text DEFAULT 'ras_lines')
+RETURNS SETOF text
+LANGUAGE plpgsql AS $$
+DECLARE
+  m    integer;
+  part text;
+BEGIN
+  FOR m IN
+    SELECT year * 100 + month FROM ras_sheets
+    UNION
+    SELECT (extract(year FROM d) * 100 + extract(month FROM d))::integer
+    FROM generate_series(date_trunc('month', now()),
+                         date_trunc('month', now()) + make_interval(months => p_months_ahead),
+                         interval '1 month') d
+    ORDER BY 1
+  LOOP
+    part := ras_lines_create_partition(m, p_parent);
+    IF part IS NOT NULL THEN
+      RETURN NEXT part;
+    END IF;
+  END LOOP;
+END $$;
+
+-- ym è ridondante con il periodo dello sheet (che non cambia): lo verifica una volta per statement
+CREATE OR REPLACE FUNCTION ras_lines_check_ym() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM new_rows n JOIN ras_sheets s ON s.id = n.sheet_id
+    WHERE n.ym <> s.year * 100 + s.month
+  ) THEN
+    RAISE EXCEPTION 'ras_lines.ym diverso dal periodo dello sheet (year * 100 + month)'
+      USING ERRCODE = 'check_violation';
+  END IF;
+  RETURN NULL;
+END $$;
+"""
+
+# stesse colonne / vincoli di ras_lines (0000) + ym; indici di 0001 con nomi provvisori
+TABLE_SQL = """
+CREATE TABLE ras_lines_p (
+  id            BIGINT NOT NULL DEFAULT nextval('ras_lines_id_seq'),
+  sheet_id      BIGINT NOT NULL,
+  ym            INTEGER NOT NULL,          -- year * 100 + month dello sheet: chiave di partizione
+
+  day           INTEGER NOT NULL CONSTRAINT ras_lines_day_check CHECK (day BETWEEN 1 AND 31),
+
+  stato         TEXT,
+  loc           TEXT,
+
+  activity_desc TEXT,
+  commessa_cdc  TEXT,
+  ss            TEXT,
+  fase          TEXT,
+
+  rip_percent   NUMERIC(5,2) NOT NULL DEFAULT 100.00
+                CONSTRAINT ras_lines_rip_percent_check CHECK (rip_percent >= 0 AND rip_percent <= 100),
+
+  ore_extra     NUMERIC(6,2) NOT NULL DEFAULT 0.00 CONSTRAINT ras_lines_ore_extra_check CHECK (ore_extra >= 0),
+
+  pranzo_flag   TEXT,
+  cena_flag     TEXT,
+
+  tot_spese     NUMERIC(10,2) NOT NULL DEFAULT 0.00 CONSTRAINT ras_lines_tot_spese_check CHECK (tot_spese >= 0),
+  rip_spesa     NUMERIC(5,2),
+  rip_extra     TEXT,
+
+  note          TEXT,
+
+  created_at    TIMESTAMP NOT NULL DEFAULT now(),
+
+  CONSTRAINT ras_lines_p_pkey PRIMARY KEY (id, ym),
+  CONSTRAINT ras_lines_sheet_id_fkey FOREIGN KEY (sheet_id) REFERENCES ras_sheets(id) ON DELETE CASCADE
+) PARTITION BY RANGE (ym);
+
+-- mesi senza partizione (sheet futuri prima di "db/partitions.py ensure"): spostati da ensure
+CREATE TABLE ras_lines_default PARTITION OF ras_lines_p DEFAULT;
+
+CREATE INDEX idx_ras_lines_p_sheet_day_cov
+  ON ras_lines_p (sheet_id, day)
+  INCLUDE (activity_desc, commessa_cdc, rip_percent, ore_extra, tot_spese);
+
+CREATE INDEX idx_ras_lines_p_absence
+  ON ras_lines_p (sheet_id, day)
+  INCLUDE (activity_desc)
+  WHERE activity_desc IN ('FERIE', 'PERMESSO', 'MALATTIA');
+
+CREATE INDEX idx_ras_lines_p_sheet_commessa
+  ON ras_lines_p (sheet_id, commessa_cdc)
+  INCLUDE (rip_percent, day)
+  WHERE commessa_cdc IS NOT NULL;
+
+CREATE INDEX idx_ras_lines_p_commessa ON ras_lines_p (commessa_cdc);
+"""
+
+INDEXES = ("sheet_day_cov", "absence", "sheet_commessa", "commessa")
+
+COLUMNS = ("id, sheet_id, day, stato, loc, activity_desc, commessa_cdc, ss, fase, rip_percent, ore_extra, "
+           "pranzo_flag, cena_flag, tot_spese, rip_spesa, rip_extra, note, created_at")
+
+COPY_SELECT = f"""
+INSERT INTO ras_lines_p ({COLUMNS}, ym)
+SELECT {', '.join('l.' + c for c in COLUMNS.split(', '))}, s.year * 100 + s.month
+FROM ras_lines l
+JOIN ras_sheets s ON s.id = l.sheet_id
+"""
+
+# keyset sull'id: riprende da dove si è fermato, le righe nuove (id più alti) arrivano nei batch finali
+BACKFILL_SQL = COPY_SELECT + """
+WHERE l.id > (SELECT COALESCE(max(id), 0) FROM ras_lines_p)
+ORDER BY l.id
+LIMIT %(batch_size)s
+"""
+
+# inizio della transazione più vecchia ancora aperta: le sue modifiche avranno updated_at >= di questo
+# (ras_sheets_touch usa now(), cioè l'inizio della transazione che scrive)
+WATERMARK_SQL = """
+SELECT LEAST(now(), min(xact_start))::timestamp FROM pg_stat_activity WHERE xact_start IS NOT NULL
+"""
+
+TRIGGERS_SQL = """
+CREATE TRIGGER trg_ras_lines_rollup_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_rollup_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_rollup_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_touch_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_touch_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_touch_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_ym_check_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_lines_check_ym();
+
+CREATE TRIGGER trg_ras_lines_ym_check_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_lines_check_ym();
+"""
+
+
+def _is_partitioned(ctx) -> bool:
+    row = ctx.conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('ras_lines')").fetchone()
+    return row is not None and row[0] == "p"
+
+
+def _sync_changed(ctx, since) -> int:
+    """
+    Ricopia per intero gli sheet modificati da since e le righe con id oltre l'ultimo copiato.
+    Da chiamare in una transazione.
+    """
+    last_id = ctx.conn.execute("SELECT COALESCE(max(id), 0) FROM ras_lines_p").fetchone()[0]
+    ctx.execute(
+        "DELETE FROM ras_lines_p WHERE sheet_id IN (SELECT id FROM ras_sheets WHERE updated_at >= %(since)s)",
+        {"since": since},
+    )
+    return ctx.execute(COPY_SELECT + "WHERE s.updated_at >= %(since)s OR l.id > %(last_id)s",
+                       {"since": since, "last_id": last_id})
+
+
+def _swap(ctx, since) -> None:
+    with ctx.conn.transaction():
+        # blocca le scritture (non le letture) fino al commit: l'ultima risincronizzazione è esatta
+        ctx.execute("LOCK TABLE ras_lines IN EXCLUSIVE MODE")
+        print(f"    risincronizzate {_sync_changed(ctx, since)} righe sotto lock")
+
+        old_indexes = [r[0] for r in ctx.conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'ras_lines' AND indexname <> 'ras_lines_pkey'"
+        )]
+        for trigger in ("rollup_ins", "rollup_upd", "rollup_del", "touch_ins", "touch_upd", "touch_del"):
+            ctx.execute(f"DROP TRIGGER trg_ras_lines_{trigger} ON ras_lines")
+        for name in old_indexes:
+            ctx.execute(f'DROP INDEX "{name}"')
+        # la copia vecchia non segue più le cancellazioni degli sheet
+        ctx.execute("ALTER TABLE ras_lines DROP CONSTRAINT ras_lines_sheet_id_fkey")
+        ctx.execute("ALTER TABLE ras_lines RENAME CONSTRAINT ras_lines_pkey TO ras_lines_unpartitioned_pkey")
+        ctx.execute("ALTER TABLE ras_lines RENAME TO ras_lines_unpartitioned")
+
+        ctx.execute("ALTER TABLE ras_lines_p RENAME TO ras_lines")
+        ctx.execute("ALTER TABLE ras_lines RENAME CONSTRAINT ras_lines_p_pkey TO ras_lines_pkey")
+        for name in INDEXES:
+            ctx.execute(f"ALTER INDEX idx_ras_lines_p_{name} RENAME TO idx_ras_lines_{name}")
+        ctx.execute("COMMENT ON TABLE ras_lines IS NULL")
+        ctx.execute("ALTER SEQUENCE ras_lines_id_seq OWNED BY ras_lines.id")
+        ctx.execute(TRIGGERS_SQL)
+
+
+def migrate(ctx) -> None:
+    if _is_partitioned(ctx):
+        print("    ras_lines è già partizionata")
+        return
+    ctx.execute(FUNCTIONS_SQL)
+
+    if ctx.conn.execute("SELECT to_regclass('ras_lines_p')").fetchone()[0] is None:
+        with ctx.conn.transaction():
+            started = ctx.conn.execute(WATERMARK_SQL).fetchone()[0]
+            ctx.execute(TABLE_SQL)
+            ctx.execute(f"COMMENT ON TABLE ras_lines_p IS '{started.isoformat()}'")
+    started = ctx.conn.execute("SELECT obj_description('ras_lines_p'::regclass, 'pg_class')::timestamp").fetchone()[0]
+    print(f"    copia da {started}")
+
+    created = ctx.conn.execute("SELECT ras_lines_ensure_partitions(3, 'ras_lines_p')").fetchall()
+    print(f"    {len(created)} partizioni create")
+    ctx.backfill(BACKFILL_SQL, batch_size=20_000, pause=0.05)
+
+    # passata senza lock: lo swap risincronizza solo quanto cambiato nel frattempo
+    since = ctx.conn.execute(WATERMARK_SQL).fetchone()[0]
+    with ctx.conn.transaction():
+        print(f"    risincronizzate {_sync_changed(ctx, started)} righe")
+    ctx.with_retries(lambda: _swap(ctx, since))
+
+    ctx.execute("ANALYZE ras_lines")
+    if ctx.conn.execute("SELECT EXISTS (SELECT 1 FROM ras_lines_unpartitioned)").fetchone()[0]:
+        print("    tabella precedente: ras_lines_unpartitioned (DROP TABLE dopo la verifica)")
+    else:
+        ctx.execute("DROP TABLE ras_lines_unpartitioned")  # DB nuovo: niente da conservare
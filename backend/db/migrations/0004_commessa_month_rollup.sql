@@ -0,0 +1,178 @@
+-- 0004: aggregato per commessa x mese x sheet, per le analisi per commessa (RASRepo.get_commessa_summary).
+--
+-- Stesso meccanismo di ras_day_rollup / ras_commessa_rollup: mantenuto da ras_rollup_apply()
+-- (ridefinita qui con il blocco in più), ricostruibile con ras_rollup_rebuild().
+-- Il backfill gira sotto LOCK SHARE su ras_lines: le scritture aspettano la fine della
+-- transazione (nessuna riga persa tra backfill e trigger), le letture no.
+
+CREATE TABLE IF NOT EXISTS ras_commessa_month_rollup (
+  commessa_cdc    TEXT    NOT NULL,
+  ym              INTEGER NOT NULL,      -- year * 100 + month dello sheet
+  sheet_id        BIGINT  NOT NULL REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  employee_id     BIGINT  NOT NULL,      -- dello sheet, per raggruppare senza leggere ras_sheets
+  n_lines         INTEGER NOT NULL,
+  rip_percent_tot NUMERIC(12,2) NOT NULL,
+  ore_extra       NUMERIC(12,2) NOT NULL,
+  tot_spese       NUMERIC(14,2) NOT NULL,
+  -- una commessa su un intervallo di mesi: index-only scan sul range
+  PRIMARY KEY (commessa_cdc, ym, sheet_id) INCLUDE (employee_id, rip_percent_tot, ore_extra, tot_spese)
+);
+
+-- cancellazione a cascata degli sheet
+CREATE INDEX IF NOT EXISTS idx_ras_commessa_month_rollup_sheet ON ras_commessa_month_rollup (sheet_id);
+
+LOCK TABLE ras_lines IN SHARE MODE;
+
+CREATE OR REPLACE FUNCTION ras_rollup_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    -- UPDATE ... FROM: se lo sheet è già stato cancellato (cascade) non c'è nulla da sottrarre
+    UPDATE ras_day_rollup r
+    SET n_lines    = r.n_lines    - d.n_lines,
+        n_ferie    = r.n_ferie    - d.n_ferie,
+        n_permesso = r.n_permesso - d.n_permesso,
+        n_malattia = r.n_malattia - d.n_malattia,
+        n_work     = r.n_work     - d.n_work,
+        ore_extra  = r.ore_extra  - d.ore_extra,
+        tot_spese  = r.tot_spese  - d.tot_spese
+    FROM (
+      SELECT sheet_id, day,
+             COUNT(*) AS n_lines,
+             COUNT(*) FILTER (WHERE activity_desc = 'FERIE')    AS n_ferie,
+             COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO') AS n_permesso,
+             COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA') AS n_malattia,
+             COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL)   AS n_work,
+             SUM(ore_extra) AS ore_extra,
+             SUM(tot_spese) AS tot_spese
+      FROM old_rows
+      GROUP BY sheet_id, day
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.day = d.day;
+
+    UPDATE ras_commessa_rollup r
+    SET n_lines         = r.n_lines - d.n_lines,
+        rip_percent_tot = r.rip_percent_tot - d.rip_percent_tot
+    FROM (
+      SELECT sheet_id, commessa_cdc, COUNT(*) AS n_lines, SUM(rip_percent) AS rip_percent_tot
+      FROM old_rows
+      WHERE commessa_cdc IS NOT NULL
+      GROUP BY sheet_id, commessa_cdc
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.commessa_cdc = d.commessa_cdc;
+
+    UPDATE ras_commessa_month_rollup r
+    SET n_lines         = r.n_lines - d.n_lines,
+        rip_percent_tot = r.rip_percent_tot - d.rip_percent_tot,
+        ore_extra       = r.ore_extra - d.ore_extra,
+        tot_spese       = r.tot_spese - d.tot_spese
+    FROM (
+      SELECT commessa_cdc, ym, sheet_id,
+             COUNT(*) AS n_lines, SUM(rip_percent) AS rip_percent_tot,
+             SUM(ore_extra) AS ore_extra, SUM(tot_spese) AS tot_spese
+      FROM old_rows
+      WHERE commessa_cdc IS NOT NULL
+      GROUP BY commessa_cdc, ym, sheet_id
+    ) d
+    WHERE r.commessa_cdc = d.commessa_cdc AND r.ym = d.ym AND r.sheet_id = d.sheet_id;
+
+    DELETE FROM ras_day_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+    DELETE FROM ras_commessa_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+    DELETE FROM ras_commessa_month_rollup
+    WHERE n_lines <= 0
+      AND (commessa_cdc, ym, sheet_id) IN (SELECT commessa_cdc, ym, sheet_id FROM old_rows);
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO ras_day_rollup AS r
+      (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+    SELECT sheet_id, day,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE activity_desc = 'FERIE'),
+           COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO'),
+           COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA'),
+           COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL),
+           SUM(ore_extra),
+           SUM(tot_spese)
+    FROM new_rows
+    GROUP BY sheet_id, day
+    ON CONFLICT (sheet_id, day) DO UPDATE
+    SET n_lines    = r.n_lines    + EXCLUDED.n_lines,
+        n_ferie    = r.n_ferie    + EXCLUDED.n_ferie,
+        n_permesso = r.n_permesso + EXCLUDED.n_permesso,
+        n_malattia = r.n_malattia + EXCLUDED.n_malattia,
+        n_work     = r.n_work     + EXCLUDED.n_work,
+        ore_extra  = r.ore_extra  + EXCLUDED.ore_extra,
+        tot_spese  = r.tot_spese  + EXCLUDED.tot_spese;
+
+    INSERT INTO ras_commessa_rollup AS r (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+    SELECT sheet_id, commessa_cdc, COUNT(*), SUM(rip_percent)
+    FROM new_rows
+    WHERE commessa_cdc IS NOT NULL
+    GROUP BY sheet_id, commessa_cdc
+    ON CONFLICT (sheet_id, commessa_cdc) DO UPDATE
+    SET n_lines         = r.n_lines + EXCLUDED.n_lines,
+        rip_percent_tot = r.rip_percent_tot + EXCLUDED.rip_percent_tot;
+
+    INSERT INTO ras_commessa_month_rollup AS r
+      (commessa_cdc, ym, sheet_id, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese)
+    SELECT n.commessa_cdc, n.ym, n.sheet_id, s.employee_id,
+           COUNT(*), SUM(n.rip_percent), SUM(n.ore_extra), SUM(n.tot_spese)
+    FROM new_rows n
+    JOIN ras_sheets s ON s.id = n.sheet_id
+    WHERE n.commessa_cdc IS NOT NULL
+    GROUP BY n.commessa_cdc, n.ym, n.sheet_id, s.employee_id
+    ON CONFLICT (commessa_cdc, ym, sheet_id) DO UPDATE
+    SET n_lines         = r.n_lines + EXCLUDED.n_lines,
+        rip_percent_tot = r.rip_percent_tot + EXCLUDED.rip_percent_tot,
+        ore_extra       = r.ore_extra + EXCLUDED.ore_extra,
+        tot_spese       = r.tot_spese + EXCLUDED.tot_spese;
+  END IF;
+
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION ras_rollup_rebuild() RETURNS void
+LANGUAGE sql AS $$
+  TRUNCATE ras_day_rollup, ras_commessa_rollup, ras_commessa_month_rollup;
+
+  INSERT INTO ras_day_rollup
+    (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+  SELECT sheet_id, day,
+         COUNT(*),
+         COUNT(*) FILTER (WHERE activity_desc = 'FERIE'),
+         COUNT(*) FILTER (WHERE activity_desc = 'PERMESSO'),
+         COUNT(*) FILTER (WHERE activity_desc = 'MALATTIA'),
+         COUNT(*) FILTER (WHERE commessa_cdc IS NOT NULL),
+         SUM(ore_extra),
+         SUM(tot_spese)
+  FROM ras_lines
+  GROUP BY sheet_id, day;
+
+  INSERT INTO ras_commessa_rollup (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+  SELECT sheet_id, commessa_cdc, COUNT(*), SUM(rip_percent)
+  FROM ras_lines
+  WHERE commessa_cdc IS NOT NULL
+  GROUP BY sheet_id, commessa_cdc;
+
+  INSERT INTO ras_commessa_month_rollup
+    (commessa_cdc, ym, sheet_id, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese)
+  SELECT l.commessa_cdc, l.ym, l.sheet_id, s.employee_id,
+         COUNT(*), SUM(l.rip_percent), SUM(l.ore_extra), SUM(l.tot_spese)
+  FROM ras_lines l
+  JOIN ras_sheets s ON s.id = l.sheet_id
+  WHERE l.commessa_cdc IS NOT NULL
+  GROUP BY l.commessa_cdc, l.ym, l.sheet_id, s.employee_id;
+$$;
+
+-- backfill (tabella vuota: rieseguibile solo insieme al resto della transazione)
+INSERT INTO ras_commessa_month_rollup
+  (commessa_cdc, ym, sheet_id, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese)
+SELECT l.commessa_cdc, l.ym, l.sheet_id, s.employee_id,
+       COUNT(*), SUM(l.rip_percent), SUM(l.ore_extra), SUM(l.tot_spese)
+FROM ras_lines l
+JOIN ras_sheets s ON s.id = l.sheet_id
+WHERE l.commessa_cdc IS NOT NULL
+GROUP BY l.commessa_cdc, l.ym, l.sheet_id, s.employee_id;
+
+ANALYZE ras_commessa_month_rollup;
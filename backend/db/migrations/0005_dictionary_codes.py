@@ -0,0 +1,489 @@
+"""
+0005: codici a dizionario per attività e commessa su ras_lines.
+
+activity_desc / commessa_cdc (testo ripetuto su ogni riga, nei record e in tre indici) diventano:
+  - ras_commesse(id, commessa_cdc)                     commessa_id INTEGER
+  - ras_activities(id, activity_desc, line_kind)       activity_id INTEGER
+  - ras_line_kinds(id, code): 0 WORK, 1 FERIE, 2 PERMESSO, 3 MALATTIA
+                                                       line_kind SMALLINT NOT NULL
+line_kind è ridondante con l'attività (FK composta su ras_activities(id, line_kind)) e tiene i
+controlli per giorno (assenze, giorni misti) su un confronto tra interi, senza join.
+Le colonne a larghezza fissa stanno in testa al record: niente padding tra i varlena.
+I rollup restano per commessa_cdc (una riga per sheet x commessa, non per riga).
+
+Chi scrive risolve i codici con ras_commessa_id(text) / ras_activity_id(text) /
+ras_activity_kind(text), che inseriscono il valore nel dizionario se manca.
+
+Online come 0003: ras_lines_p con il nuovo tracciato, copia a batch per id (i dizionari si
+popolano durante la copia), risincronizzazione degli sheet modificati, swap sotto lock breve.
+Le partizioni della copia nascono come ras_lines_p_yYYYYmMM e prendono il nome definitivo
+allo swap. La tabella vecchia, se non vuota, resta come ras_lines_text (con le partizioni
+ras_lines_text_*): da cancellare a mano dopo la verifica.
+"""
+
+DICTIONARY_SQL = """
+CREATE TABLE IF NOT EXISTS ras_line_kinds (
+  id    SMALLINT PRIMARY KEY,
+  code  TEXT NOT NULL UNIQUE
+);
+
+INSERT INTO ras_line_kinds (id, code)
+VALUES (0, 'WORK'), (1, 'FERIE'), (2, 'PERMESSO'), (3, 'MALATTIA')
+ON CONFLICT (id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS ras_activities (
+  id            INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  activity_desc TEXT NOT NULL UNIQUE,
+  line_kind     SMALLINT NOT NULL DEFAULT 0 REFERENCES ras_line_kinds(id),
+  -- destinazione della FK composta di ras_lines: attività e line_kind sempre coerenti
+  UNIQUE (id, line_kind)
+);
+
+CREATE TABLE IF NOT EXISTS ras_commesse (
+  id            INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  commessa_cdc  TEXT NOT NULL UNIQUE
+);
+
+-- id della commessa, inserita se manca. NULL -> NULL.
+CREATE OR REPLACE FUNCTION ras_commessa_id(p_cdc text) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+  r integer;
+BEGIN
+  IF p_cdc IS NULL THEN
+    RETURN NULL;
+  END IF;
+  SELECT id INTO r FROM ras_commesse WHERE commessa_cdc = p_cdc;
+  IF r IS NULL THEN
+    -- scritture concorrenti dello stesso valore: la seconda aspetta la prima e rilegge
+    INSERT INTO ras_commesse (commessa_cdc) VALUES (p_cdc) ON CONFLICT (commessa_cdc) DO NOTHING;
+    SELECT id INTO r FROM ras_commesse WHERE commessa_cdc = p_cdc;
+  END IF;
+  RETURN r;
+END $$;
+
+-- id dell'attività, inserita se manca: line_kind dal codice di assenza, altrimenti 0 (WORK)
+CREATE OR REPLACE FUNCTION ras_activity_id(p_desc text) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+  r integer;
+BEGIN
+  IF p_desc IS NULL THEN
+    RETURN NULL;
+  END IF;
+  SELECT id INTO r FROM ras_activities WHERE activity_desc = p_desc;
+  IF r IS NULL THEN
+    INSERT INTO ras_activities (activity_desc, line_kind)
+    VALUES (p_desc, COALESCE((SELECT k.id FROM ras_line_kinds k WHERE k.code = p_desc AND k.id > 0), 0))
+    ON CONFLICT (activity_desc) DO NOTHING;
+    SELECT id INTO r FROM ras_activities WHERE activity_desc = p_desc;
+  END IF;
+  RETURN r;
+END $$;
+
+-- line_kind dell'attività (inserita se manca), 0 per attività NULL
+CREATE OR REPLACE FUNCTION ras_activity_kind(p_desc text) RETURNS smallint
+LANGUAGE plpgsql AS $$
+DECLARE
+  k smallint;
+BEGIN
+  SELECT line_kind INTO k FROM ras_activities WHERE id = ras_activity_id(p_desc);
+  RETURN COALESCE(k, 0);
+END $$;
+
+-- partizioni nominate dal padre (ras_lines_yYYYYmMM, ras_lines_p_yYYYYmMM per la copia);
+-- le righe del mese vengono spostate dal default dello stesso padre
+CREATE OR REPLACE FUNCTION ras_lines_create_partition(p_ym integer, p_parent text DEFAULT 'ras_lines')
+RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+  part    text    := format('%s_y%sm%s', p_parent, p_ym / 100, lpad((p_ym % 100)::text, 2, '0'));
+  dflt    text    := p_parent || '_default';
+  next_ym integer := CASE WHEN p_ym % 100 = 12 THEN p_ym + 89 ELSE p_ym + 1 END;
+BEGIN
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN NULL;
+  END IF;
+  EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part, p_parent);
+  -- DML diretto sulla partizione: i trigger di rollup (sul padre) non scattano, i totali non cambiano
+  IF to_regclass(dflt) IS NOT NULL THEN
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM %I WHERE ym = %s RETURNING *) INSERT INTO %I SELECT * FROM moved',
+      dflt, p_ym, part);
+  END IF;
+  EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%s) TO (%s)', p_parent, part, p_ym, next_ym);
+  RETURN part;
+END $$;
+"""
+
+# tracciato di 0003 con i codici al posto del testo; indici di 0001 sulle colonne intere
+TABLE_SQL = """
+CREATE TABLE ras_lines_p (
+  id            BIGINT NOT NULL DEFAULT nextval('ras_lines_id_seq'),
+  sheet_id      BIGINT NOT NULL,
+  ym            INTEGER NOT NULL,          -- year * 100 + month dello sheet: chiave di partizione
+
+  day           INTEGER NOT NULL CONSTRAINT ras_lines_day_check CHECK (day BETWEEN 1 AND 31),
+
+  activity_id   INTEGER,
+  commessa_id   INTEGER CONSTRAINT ras_lines_commessa_id_fkey REFERENCES ras_commesse(id),
+  line_kind     SMALLINT NOT NULL DEFAULT 0,   -- ras_line_kinds: 0 lavoro, 1..3 assenze
+                CONSTRAINT ras_lines_line_kind_check CHECK (activity_id IS NOT NULL OR line_kind = 0),
+
+  stato         TEXT,
+  loc           TEXT,
+  ss            TEXT,
+  fase          TEXT,
+
+  rip_percent   NUMERIC(5,2) NOT NULL DEFAULT 100.00
+                CONSTRAINT ras_lines_rip_percent_check CHECK (rip_percent >= 0 AND rip_percent <= 100),
+
+  ore_extra     NUMERIC(6,2) NOT NULL DEFAULT 0.00 CONSTRAINT ras_lines_ore_extra_check CHECK (ore_extra >= 0),
+
+  pranzo_flag   TEXT,
+  cena_flag     TEXT,
+
+  tot_spese     NUMERIC(10,2) NOT NULL DEFAULT 0.00 CONSTRAINT ras_lines_tot_spese_check CHECK (tot_spese >= 0),
+  rip_spesa     NUMERIC(5,2),
+  rip_extra     TEXT,
+
+  note          TEXT,
+
+  created_at    TIMESTAMP NOT NULL DEFAULT now(),
+
+  CONSTRAINT ras_lines_p_pkey PRIMARY KEY (id, ym),
+  CONSTRAINT ras_lines_sheet_id_fkey FOREIGN KEY (sheet_id) REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  CONSTRAINT ras_lines_activity_fkey FOREIGN KEY (activity_id, line_kind)
+    REFERENCES ras_activities(id, line_kind)
+) PARTITION BY RANGE (ym);
+
+CREATE TABLE ras_lines_p_default PARTITION OF ras_lines_p DEFAULT;
+
+CREATE INDEX idx_ras_lines_p_sheet_day_cov
+  ON ras_lines_p (sheet_id, day)
+  INCLUDE (line_kind, commessa_id, rip_percent, ore_extra, tot_spese);
+
+CREATE INDEX idx_ras_lines_p_absence
+  ON ras_lines_p (sheet_id, day)
+  INCLUDE (line_kind)
+  WHERE line_kind <> 0;
+
+CREATE INDEX idx_ras_lines_p_sheet_commessa
+  ON ras_lines_p (sheet_id, commessa_id)
+  INCLUDE (rip_percent, day)
+  WHERE commessa_id IS NOT NULL;
+
+CREATE INDEX idx_ras_lines_p_commessa ON ras_lines_p (commessa_id);
+"""
+
+INDEXES = ("sheet_day_cov", "absence", "sheet_commessa", "commessa")
+
+COLUMNS = ("id, sheet_id, ym, day, stato, loc, ss, fase, rip_percent, ore_extra, "
+           "pranzo_flag, cena_flag, tot_spese, rip_spesa, rip_extra, note, created_at")
+
+# join sui dizionari; i valori non ancora presenti (comparsi dopo l'inizio dello statement)
+# passano dalle funzioni, che li inseriscono
+COPY_SELECT = f"""
+INSERT INTO ras_lines_p ({COLUMNS}, activity_id, line_kind, commessa_id)
+SELECT {', '.join('l.' + c for c in COLUMNS.split(', '))},
+       COALESCE(a.id, ras_activity_id(l.activity_desc)),
+       COALESCE(a.line_kind, ras_activity_kind(l.activity_desc)),
+       COALESCE(c.id, ras_commessa_id(l.commessa_cdc))
+FROM ras_lines l
+JOIN ras_sheets s ON s.id = l.sheet_id
+LEFT JOIN ras_activities a ON a.activity_desc = l.activity_desc
+LEFT JOIN ras_commesse c ON c.commessa_cdc = l.commessa_cdc
+"""
+
+BACKFILL_SQL = COPY_SELECT + """
+WHERE l.id > (SELECT COALESCE(max(id), 0) FROM ras_lines_p)
+ORDER BY l.id
+LIMIT %(batch_size)s
+"""
+
+WATERMARK_SQL = """
+SELECT LEAST(now(), min(xact_start))::timestamp FROM pg_stat_activity WHERE xact_start IS NOT NULL
+"""
+
+# ras_rollup_apply / ras_rollup_rebuild di 0004 sulle colonne codificate: assenze da line_kind,
+# lavoro = commessa_id valorizzato, commessa_cdc dei rollup da ras_commesse
+ROLLUP_FUNCTIONS_SQL = """
+CREATE OR REPLACE FUNCTION ras_rollup_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP IN ('DELETE', 'UPDATE') THEN
+    -- UPDATE ... FROM: se lo sheet è già stato cancellato (cascade) non c'è nulla da sottrarre
+    UPDATE ras_day_rollup r
+    SET n_lines    = r.n_lines    - d.n_lines,
+        n_ferie    = r.n_ferie    - d.n_ferie,
+        n_permesso = r.n_permesso - d.n_permesso,
+        n_malattia = r.n_malattia - d.n_malattia,
+        n_work     = r.n_work     - d.n_work,
+        ore_extra  = r.ore_extra  - d.ore_extra,
+        tot_spese  = r.tot_spese  - d.tot_spese
+    FROM (
+      SELECT sheet_id, day,
+             COUNT(*) AS n_lines,
+             COUNT(*) FILTER (WHERE line_kind = 1)          AS n_ferie,
+             COUNT(*) FILTER (WHERE line_kind = 2)          AS n_permesso,
+             COUNT(*) FILTER (WHERE line_kind = 3)          AS n_malattia,
+             COUNT(*) FILTER (WHERE commessa_id IS NOT NULL) AS n_work,
+             SUM(ore_extra) AS ore_extra,
+             SUM(tot_spese) AS tot_spese
+      FROM old_rows
+      GROUP BY sheet_id, day
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.day = d.day;
+
+    UPDATE ras_commessa_rollup r
+    SET n_lines         = r.n_lines - d.n_lines,
+        rip_percent_tot = r.rip_percent_tot - d.rip_percent_tot
+    FROM (
+      SELECT o.sheet_id, c.commessa_cdc, COUNT(*) AS n_lines, SUM(o.rip_percent) AS rip_percent_tot
+      FROM old_rows o
+      JOIN ras_commesse c ON c.id = o.commessa_id
+      GROUP BY o.sheet_id, c.commessa_cdc
+    ) d
+    WHERE r.sheet_id = d.sheet_id AND r.commessa_cdc = d.commessa_cdc;
+
+    UPDATE ras_commessa_month_rollup r
+    SET n_lines         = r.n_lines - d.n_lines,
+        rip_percent_tot = r.rip_percent_tot - d.rip_percent_tot,
+        ore_extra       = r.ore_extra - d.ore_extra,
+        tot_spese       = r.tot_spese - d.tot_spese
+    FROM (
+      SELECT c.commessa_cdc, o.ym, o.sheet_id,
+             COUNT(*) AS n_lines, SUM(o.rip_percent) AS rip_percent_tot,
+             SUM(o.ore_extra) AS ore_extra, SUM(o.tot_spese) AS tot_spese
+      FROM old_rows o
+      JOIN ras_commesse c ON c.id = o.commessa_id
+      GROUP BY c.commessa_cdc, o.ym, o.sheet_id
+    ) d
+    WHERE r.commessa_cdc = d.commessa_cdc AND r.ym = d.ym AND r.sheet_id = d.sheet_id;
+
+    DELETE FROM ras_day_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+    DELETE FROM ras_commessa_rollup WHERE n_lines <= 0 AND sheet_id IN (SELECT sheet_id FROM old_rows);
+    DELETE FROM ras_commessa_month_rollup
+    WHERE n_lines <= 0
+      AND (commessa_cdc, ym, sheet_id) IN (
+        SELECT c.commessa_cdc, o.ym, o.sheet_id FROM old_rows o JOIN ras_commesse c ON c.id = o.commessa_id
+      );
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    INSERT INTO ras_day_rollup AS r
+      (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+    SELECT sheet_id, day,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE line_kind = 1),
+           COUNT(*) FILTER (WHERE line_kind = 2),
+           COUNT(*) FILTER (WHERE line_kind = 3),
+           COUNT(*) FILTER (WHERE commessa_id IS NOT NULL),
+           SUM(ore_extra),
+           SUM(tot_spese)
+    FROM new_rows
+    GROUP BY sheet_id, day
+    ON CONFLICT (sheet_id, day) DO UPDATE
+    SET n_lines    = r.n_lines    + EXCLUDED.n_lines,
+        n_ferie    = r.n_ferie    + EXCLUDED.n_ferie,
+        n_permesso = r.n_permesso + EXCLUDED.n_permesso,
+        n_malattia = r.n_malattia + EXCLUDED.n_malattia,
+        n_work     = r.n_work     + EXCLUDED.n_work,
+        ore_extra  = r.ore_extra  + EXCLUDED.ore_extra,
+        tot_spese  = r.tot_spese  + EXCLUDED.tot_spese;
+
+    INSERT INTO ras_commessa_rollup AS r (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+    SELECT n.sheet_id, c.commessa_cdc, COUNT(*), SUM(n.rip_percent)
+    FROM new_rows n
+    JOIN ras_commesse c ON c.id = n.commessa_id
+    GROUP BY n.sheet_id, c.commessa_cdc
+    ON CONFLICT (sheet_id, commessa_cdc) DO UPDATE
+    SET n_lines         = r.n_lines + EXCLUDED.n_lines,
+        rip_percent_tot = r.rip_percent_tot + EXCLUDED.rip_percent_tot;
+
+    INSERT INTO ras_commessa_month_rollup AS r
+      (commessa_cdc, ym, sheet_id, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese)
+    SELECT c.commessa_cdc, n.ym, n.sheet_id, s.employee_id,
+           COUNT(*), SUM(n.rip_percent), SUM(n.ore_extra), SUM(n.tot_spese)
+    FROM new_rows n
+    JOIN ras_commesse c ON c.id = n.commessa_id
+    JOIN ras_sheets s ON s.id = n.sheet_id
+    GROUP BY c.commessa_cdc, n.ym, n.sheet_id, s.employee_id
+    ON CONFLICT (commessa_cdc, ym, sheet_id) DO UPDATE
+    SET n_lines         = r.n_lines + EXCLUDED.n_lines,
+        rip_percent_tot = r.rip_percent_tot + EXCLUDED.rip_percent_tot,
+        ore_extra       = r.ore_extra + EXCLUDED.ore_extra,
+        tot_spese       = r.tot_spese + EXCLUDED.tot_spese;
+  END IF;
+
+  RETURN NULL;
+END $$;
+
+CREATE OR REPLACE FUNCTION ras_rollup_rebuild() RETURNS void
+LANGUAGE sql AS $$
+  TRUNCATE ras_day_rollup, ras_commessa_rollup, ras_commessa_month_rollup;
+
+  INSERT INTO ras_day_rollup
+    (sheet_id, day, n_lines, n_ferie, n_permesso, n_malattia, n_work, ore_extra, tot_spese)
+  SELECT sheet_id, day,
+         COUNT(*),
+         COUNT(*) FILTER (WHERE line_kind = 1),
+         COUNT(*) FILTER (WHERE line_kind = 2),
+         COUNT(*) FILTER (WHERE line_kind = 3),
+         COUNT(*) FILTER (WHERE commessa_id IS NOT NULL),
+         SUM(ore_extra),
+         SUM(tot_spese)
+  FROM ras_lines
+  GROUP BY sheet_id, day;
+
+  INSERT INTO ras_commessa_rollup (sheet_id, commessa_cdc, n_lines, rip_percent_tot)
+  SELECT l.sheet_id, c.commessa_cdc, COUNT(*), SUM(l.rip_percent)
+  FROM ras_lines l
+  JOIN ras_commesse c ON c.id = l.commessa_id
+  GROUP BY l.sheet_id, c.commessa_cdc;
+
+  INSERT INTO ras_commessa_month_rollup
+    (commessa_cdc, ym, sheet_id, employee_id, n_lines, rip_percent_tot, ore_extra, tot_spese)
+  SELECT c.commessa_cdc, l.ym, l.sheet_id, s.employee_id,
+         COUNT(*), SUM(l.rip_percent), SUM(l.ore_extra), SUM(l.tot_spese)
+  FROM ras_lines l
+  JOIN ras_commesse c ON c.id = l.commessa_id
+  JOIN ras_sheets s ON s.id = l.sheet_id
+  GROUP BY c.commessa_cdc, l.ym, l.sheet_id, s.employee_id;
+$$;
+"""
+
+TRIGGER_NAMES = ("rollup_ins", "rollup_upd", "rollup_del", "touch_ins", "touch_upd", "touch_del",
+                 "ym_check_ins", "ym_check_upd")
+
+TRIGGERS_SQL = """
+CREATE TRIGGER trg_ras_lines_rollup_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_rollup_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_rollup_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_rollup_apply();
+
+CREATE TRIGGER trg_ras_lines_touch_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_touch_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_touch_del
+  AFTER DELETE ON ras_lines
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_sheets_touch();
+
+CREATE TRIGGER trg_ras_lines_ym_check_ins
+  AFTER INSERT ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_lines_check_ym();
+
+CREATE TRIGGER trg_ras_lines_ym_check_upd
+  AFTER UPDATE ON ras_lines
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_lines_check_ym();
+"""
+
+
+def _is_encoded(ctx) -> bool:
+    return ctx.conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'ras_lines' AND column_name = 'commessa_id')"
+    ).fetchone()[0]
+
+
+def _partitions(ctx, parent: str) -> list[str]:
+    return [r[0] for r in ctx.conn.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass ORDER BY 1", (parent,)
+    )]
+
+
+def _sync_changed(ctx, since) -> int:
+    """
+    Ricopia per intero gli sheet modificati da since e le righe con id oltre l'ultimo copiato.
+    Da chiamare in una transazione.
+    """
+    last_id = ctx.conn.execute("SELECT COALESCE(max(id), 0) FROM ras_lines_p").fetchone()[0]
+    ctx.execute(
+        "DELETE FROM ras_lines_p WHERE sheet_id IN (SELECT id FROM ras_sheets WHERE updated_at >= %(since)s)",
+        {"since": since},
+    )
+    return ctx.execute(COPY_SELECT + "WHERE s.updated_at >= %(since)s OR l.id > %(last_id)s",
+                       {"since": since, "last_id": last_id})
+
+
+def _swap(ctx, since) -> None:
+    with ctx.conn.transaction():
+        ctx.execute("LOCK TABLE ras_lines IN EXCLUSIVE MODE")
+        print(f"    risincronizzate {_sync_changed(ctx, since)} righe sotto lock")
+
+        old_indexes = [r[0] for r in ctx.conn.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'ras_lines' AND indexname <> 'ras_lines_pkey'"
+        )]
+        for trigger in TRIGGER_NAMES:
+            ctx.execute(f"DROP TRIGGER trg_ras_lines_{trigger} ON ras_lines")
+        for name in old_indexes:
+            ctx.execute(f'DROP INDEX "{name}"')
+        ctx.execute("ALTER TABLE ras_lines DROP CONSTRAINT ras_lines_sheet_id_fkey")
+        ctx.execute("ALTER TABLE ras_lines RENAME CONSTRAINT ras_lines_pkey TO ras_lines_text_pkey")
+        for part in _partitions(ctx, "ras_lines"):
+            ctx.execute(f'ALTER TABLE "{part}" RENAME TO "ras_lines_text{part[len("ras_lines"):]}"')
+        ctx.execute("ALTER TABLE ras_lines RENAME TO ras_lines_text")
+
+        for part in _partitions(ctx, "ras_lines_p"):
+            ctx.execute(f'ALTER TABLE "{part}" RENAME TO "ras_lines{part[len("ras_lines_p"):]}"')
+        ctx.execute("ALTER TABLE ras_lines_p RENAME TO ras_lines")
+        ctx.execute("ALTER TABLE ras_lines RENAME CONSTRAINT ras_lines_p_pkey TO ras_lines_pkey")
+        for name in INDEXES:
+            ctx.execute(f"ALTER INDEX idx_ras_lines_p_{name} RENAME TO idx_ras_lines_{name}")
+        ctx.execute("COMMENT ON TABLE ras_lines IS NULL")
+        ctx.execute("ALTER SEQUENCE ras_lines_id_seq OWNED BY ras_lines.id")
+
+        ctx.execute(ROLLUP_FUNCTIONS_SQL)
+        ctx.execute(TRIGGERS_SQL)
+
+
+def migrate(ctx) -> None:
+    if _is_encoded(ctx):
+        print("    ras_lines usa già i codici a dizionario")
+        return
+    with ctx.conn.transaction():
+        ctx.execute(DICTIONARY_SQL)
+
+    if ctx.conn.execute("SELECT to_regclass('ras_lines_p')").fetchone()[0] is None:
+        with ctx.conn.transaction():
+            started = ctx.conn.execute(WATERMARK_SQL).fetchone()[0]
+            ctx.execute(TABLE_SQL)
+            ctx.execute(f"COMMENT ON TABLE ras_lines_p IS '{started.isoformat()}'")
+    started = ctx.conn.execute("SELECT obj_description('ras_lines_p'::regclass, 'pg_class')::timestamp").fetchone()[0]
+    print(f"    copia da {started}")
+
+    created = ctx.conn.execute("SELECT ras_lines_ensure_partitions(3, 'ras_lines_p')").fetchall()
+    print(f"    {len(created)} partizioni create")
+    ctx.backfill(BACKFILL_SQL, batch_size=20_000, pause=0.05)
+
+    since = ctx.conn.execute(WATERMARK_SQL).fetchone()[0]
+    with ctx.conn.transaction():
+        print(f"    risincronizzate {_sync_changed(ctx, started)} righe")
+    ctx.with_retries(lambda: _swap(ctx, since))
+
+    ctx.execute("ANALYZE ras_line_kinds, ras_activities, ras_commesse, ras_lines")
+    if ctx.conn.execute("SELECT EXISTS (SELECT 1 FROM ras_lines_text)").fetchone()[0]:
+        print("    tabella precedente: ras_lines_text (DROP TABLE dopo la verifica)")
+    else:
+        ctx.execute("DROP TABLE ras_lines_text")
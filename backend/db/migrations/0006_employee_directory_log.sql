@@ -0,0 +1,89 @@
+-- 0006: registro delle modifiche all'anagrafica, per la directory dipendenti in-process
+-- (app/repos/employees.py, EmployeeDirectory).
+--
+-- Ogni modifica a employees / team_members / teams (rinomina) registra gli employee_id coinvolti
+-- con il txid della transazione. La directory ricarica solo quegli id: legge il registro da
+-- txid >= xmin dello snapshot del giro precedente (tutte le transazioni con txid più basso erano
+-- già concluse e visibili allora), nello stesso snapshot in cui legge i dipendenti.
+-- employee_id NULL (TRUNCATE) = ricaricare tutto. Le voci più vecchie di un giorno vengono
+-- cancellate dal trigger: una directory ferma da più tempo ricarica tutto.
+
+CREATE TABLE IF NOT EXISTS ras_directory_log (
+  seq         BIGSERIAL PRIMARY KEY,
+  txid        XID8      NOT NULL DEFAULT pg_current_xact_id(),
+  employee_id BIGINT,                 -- NULL: tutti i dipendenti
+  changed_at  TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ras_directory_log_txid ON ras_directory_log (txid);
+
+CREATE OR REPLACE FUNCTION ras_directory_log_changes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'TRUNCATE' THEN
+    INSERT INTO ras_directory_log (employee_id) VALUES (NULL);
+  ELSIF TG_TABLE_NAME = 'employees' THEN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+      INSERT INTO ras_directory_log (employee_id) SELECT id FROM new_rows;
+    ELSE
+      INSERT INTO ras_directory_log (employee_id) SELECT id FROM old_rows;
+    END IF;
+  ELSIF TG_TABLE_NAME = 'team_members' THEN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+      INSERT INTO ras_directory_log (employee_id) SELECT DISTINCT employee_id FROM new_rows;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+      INSERT INTO ras_directory_log (employee_id) SELECT DISTINCT employee_id FROM old_rows;
+    END IF;
+  ELSE
+    -- teams: rinomina; la cancellazione passa da team_members (ON DELETE CASCADE)
+    INSERT INTO ras_directory_log (employee_id)
+    SELECT DISTINCT tm.employee_id FROM new_rows n JOIN team_members tm ON tm.team_id = n.id;
+  END IF;
+
+  DELETE FROM ras_directory_log WHERE changed_at < now() - interval '1 day';
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER trg_employees_directory_ins
+  AFTER INSERT ON employees
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_employees_directory_upd
+  AFTER UPDATE ON employees
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_employees_directory_del
+  AFTER DELETE ON employees
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_team_members_directory_ins
+  AFTER INSERT ON team_members
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_team_members_directory_upd
+  AFTER UPDATE ON team_members
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_team_members_directory_del
+  AFTER DELETE ON team_members
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_teams_directory_upd
+  AFTER UPDATE ON teams
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_employees_directory_truncate
+  AFTER TRUNCATE ON employees
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
+
+CREATE TRIGGER trg_team_members_directory_truncate
+  AFTER TRUNCATE ON team_members
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_directory_log_changes();
@@ -0,0 +1,155 @@
+-- 0007: calendario lavorativo per sede, per i riepiloghi (giorni lavorativi attesi, giorni
+-- lavorativi senza righe, utilizzo).
+--
+-- ras_holidays: giorni non lavorativi oltre ai weekend. site '*' = tutte le sedi (festività
+-- nazionali), altrimenti la sede (santo patrono, chiusure aziendali). Le chiusure si inseriscono
+-- a mano con kind 'closure'; festività nazionali e patroni (ras_site_patrons) sono generati
+-- per anno da ras_holidays_fill(da, a).
+--
+-- ras_work_calendar: giorni lavorativi precalcolati per (sede, mese), un array per riga.
+-- Righe per '*' e per ogni sede con giorni propri in ras_holidays: le altre sedi usano '*'.
+-- Mantenuta dal trigger su ras_holidays: i riepiloghi la leggono con un lookup su PK per sheet.
+
+CREATE TABLE IF NOT EXISTS ras_holidays (
+  site        TEXT NOT NULL DEFAULT '*',
+  day         DATE NOT NULL,
+  kind        TEXT NOT NULL CHECK (kind IN ('national', 'patron', 'closure')),
+  description TEXT,
+  PRIMARY KEY (site, day)
+);
+
+CREATE TABLE IF NOT EXISTS ras_site_patrons (
+  site  TEXT PRIMARY KEY,
+  month SMALLINT NOT NULL CHECK (month BETWEEN 1 AND 12),
+  day   SMALLINT NOT NULL CHECK (day BETWEEN 1 AND 31),
+  saint TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ras_work_calendar (
+  site      TEXT NOT NULL,
+  ym        INT  NOT NULL,
+  work_days SMALLINT[] NOT NULL,      -- giorni del mese lavorativi, in ordine
+  PRIMARY KEY (site, ym)
+);
+
+-- domenica di Pasqua (algoritmo gregoriano anonimo / Meeus)
+CREATE OR REPLACE FUNCTION ras_easter(p_year INT) RETURNS DATE
+LANGUAGE plpgsql IMMUTABLE AS $$
+DECLARE
+  a INT := p_year % 19;
+  b INT := p_year / 100;
+  c INT := p_year % 100;
+  d INT := b / 4;
+  e INT := b % 4;
+  f INT := (b + 8) / 25;
+  g INT := (b - f + 1) / 3;
+  h INT := (19 * a + b - d - g + 15) % 30;
+  i INT := c / 4;
+  k INT := c % 4;
+  l INT := (32 + 2 * e + 2 * i - h - k) % 7;
+  m INT := (a + 11 * h + 22 * l) / 451;
+BEGIN
+  RETURN make_date(p_year, (h + l - 7 * m + 114) / 31, (h + l - 7 * m + 114) % 31 + 1);
+END $$;
+
+-- festività nazionali e patroni degli anni indicati (idempotente: non tocca i giorni già presenti)
+CREATE OR REPLACE FUNCTION ras_holidays_fill(p_from_year INT, p_to_year INT) RETURNS void
+LANGUAGE sql AS $$
+  INSERT INTO ras_holidays (site, day, kind, description)
+  SELECT '*', make_date(y, f.month, f.day), 'national', f.description
+  FROM generate_series(p_from_year, p_to_year) y
+  CROSS JOIN (VALUES
+    (1, 1, 'Capodanno'),
+    (1, 6, 'Epifania'),
+    (4, 25, 'Festa della Liberazione'),
+    (5, 1, 'Festa del Lavoro'),
+    (6, 2, 'Festa della Repubblica'),
+    (8, 15, 'Ferragosto'),
+    (11, 1, 'Ognissanti'),
+    (12, 8, 'Immacolata Concezione'),
+    (12, 25, 'Natale'),
+    (12, 26, 'Santo Stefano')
+  ) f(month, day, description)
+  UNION ALL
+  SELECT '*', ras_easter(y) + 1, 'national', 'Lunedì dell''Angelo'
+  FROM generate_series(p_from_year, p_to_year) y
+  UNION ALL
+  -- festa nazionale dal 2026 (L. 151/2025)
+  SELECT '*', make_date(y, 10, 4), 'national', 'San Francesco d''Assisi'
+  FROM generate_series(GREATEST(p_from_year, 2026), p_to_year) y
+  UNION ALL
+  SELECT p.site, make_date(y, p.month, p.day), 'patron', p.saint
+  FROM generate_series(p_from_year, p_to_year) y
+  CROSS JOIN ras_site_patrons p
+  ON CONFLICT (site, day) DO NOTHING;
+$$;
+
+-- ricalcola ras_work_calendar per i mesi del range YYYYMM.
+-- Le sedi rimaste senza giorni propri perdono tutte le righe (ricadono su '*').
+CREATE OR REPLACE FUNCTION ras_work_calendar_rebuild(p_from_ym INT, p_to_ym INT) RETURNS void
+LANGUAGE sql AS $$
+  DELETE FROM ras_work_calendar
+  WHERE ym BETWEEN p_from_ym AND p_to_ym
+     OR site NOT IN (SELECT site FROM ras_holidays UNION ALL SELECT '*');
+
+  INSERT INTO ras_work_calendar (site, ym, work_days)
+  SELECT s.site, m.ym,
+         ARRAY(
+           SELECT extract(day FROM d)::smallint
+           FROM generate_series(m.first_day, m.first_day + interval '1 month - 1 day', interval '1 day') d
+           WHERE extract(isodow FROM d) < 6
+             AND NOT EXISTS (
+               SELECT 1 FROM ras_holidays h
+               WHERE h.site IN ('*', s.site) AND h.day = d::date)
+           ORDER BY d)
+  FROM (SELECT '*' AS site UNION SELECT site FROM ras_holidays) s
+  CROSS JOIN (
+    SELECT (extract(year FROM f) * 100 + extract(month FROM f))::int AS ym, f::date AS first_day
+    FROM generate_series(make_date(p_from_ym / 100, p_from_ym % 100, 1),
+                         make_date(p_to_ym / 100, p_to_ym % 100, 1), interval '1 month') f
+  ) m;
+$$;
+
+CREATE OR REPLACE FUNCTION ras_holidays_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  lo DATE;
+  hi DATE;
+BEGIN
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    SELECT min(day), max(day) INTO lo, hi FROM new_rows;
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    SELECT LEAST(lo, min(day)), GREATEST(hi, max(day)) INTO lo, hi FROM old_rows;
+  END IF;
+  IF lo IS NOT NULL THEN
+    PERFORM ras_work_calendar_rebuild(
+      (extract(year FROM lo) * 100 + extract(month FROM lo))::int,
+      (extract(year FROM hi) * 100 + extract(month FROM hi))::int);
+  END IF;
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER trg_ras_holidays_ins
+  AFTER INSERT ON ras_holidays
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_holidays_changed();
+
+CREATE TRIGGER trg_ras_holidays_upd
+  AFTER UPDATE ON ras_holidays
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_holidays_changed();
+
+CREATE TRIGGER trg_ras_holidays_del
+  AFTER DELETE ON ras_holidays
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION ras_holidays_changed();
+
+INSERT INTO ras_site_patrons (site, month, day, saint) VALUES
+  ('MI', 12, 7, 'Sant''Ambrogio'),
+  ('PI', 6, 17, 'San Ranieri'),
+  ('RM', 6, 29, 'Santi Pietro e Paolo')
+ON CONFLICT (site) DO NOTHING;
+
+-- calendario 2000-2099: il trigger di insert costruisce ras_work_calendar per lo stesso range
+SELECT ras_holidays_fill(2000, 2099);
@@ -0,0 +1,49 @@
+-- 0008: anomalie degli sheet per la chiusura paghe, calcolate in batch da db/scan_anomalies.py
+-- (app/services/anomaly_scan.py) e lette da GET /ras/anomalies.
+--
+-- Regole (ras_anomalies.rule):
+--   empty_workdays       giorni lavorativi (ras_work_calendar della sede) già passati senza righe
+--   mixed_days           giorni con assenza e lavoro insieme
+--   over_allocated_days  giorni con rip_percent delle righe di lavoro oltre 100
+--   draft_near_close     sheet ancora 'draft' a ridosso (o oltre) della chiusura paghe del mese
+--
+-- ras_anomaly_sheets: versione (updated_at) di ogni sheet all'ultimo scan. Uno scan incrementale
+-- rilegge solo gli sheet con updated_at diverso, mai scansionati, o del mese non ancora concluso
+-- allo scan precedente (i giorni vuoti crescono col passare dei giorni). draft_near_close dipende
+-- dalla data: ricalcolata a ogni scan su tutto il range (solo ras_sheets).
+
+CREATE TABLE IF NOT EXISTS ras_anomaly_scans (
+  id             BIGSERIAL PRIMARY KEY,
+  from_ym        INT       NOT NULL,
+  to_ym          INT       NOT NULL,
+  as_of          DATE      NOT NULL,      -- data di riferimento (giorni passati, chiusura)
+  full_scan      BOOLEAN   NOT NULL,
+  status         TEXT      NOT NULL DEFAULT 'running' CHECK (status IN ('running', 'done', 'failed')),
+  started_at     TIMESTAMP NOT NULL DEFAULT now(),
+  finished_at    TIMESTAMP,
+  sheets_scanned INT,
+  findings       INT                       -- anomalie nel range a fine scan
+);
+
+CREATE TABLE IF NOT EXISTS ras_anomaly_sheets (
+  sheet_id   BIGINT    PRIMARY KEY REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  version    TIMESTAMP NOT NULL,          -- ras_sheets.updated_at letto dallo scan
+  complete   BOOLEAN   NOT NULL,          -- mese concluso ad as_of: giorni vuoti definitivi
+  scan_id    BIGINT    NOT NULL,
+  scanned_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS ras_anomalies (
+  sheet_id    BIGINT NOT NULL REFERENCES ras_sheets(id) ON DELETE CASCADE,
+  rule        TEXT   NOT NULL
+    CHECK (rule IN ('empty_workdays', 'mixed_days', 'over_allocated_days', 'draft_near_close')),
+  ym          INT    NOT NULL,
+  employee_id BIGINT NOT NULL,
+  days        SMALLINT[],                 -- giorni coinvolti (NULL per draft_near_close)
+  detail      JSONB,                      -- es. max_rip_percent, close_date
+  scan_id     BIGINT NOT NULL,
+  PRIMARY KEY (sheet_id, rule)
+);
+
+-- elenco per periodo (e regola)
+CREATE INDEX IF NOT EXISTS idx_ras_anomalies_ym_rule ON ras_anomalies (ym, rule);
@@ -0,0 +1,9 @@
+-- 0009: ras_anomaly_sheets registra anche sede e giorni lavorativi (ras_work_calendar della sede
+-- o '*') usati dallo scan. empty_workdays dipende dal calendario e dalla sede del dipendente, non
+-- solo dalle righe: una chiusura in ras_holidays o un cambio di sede non toccano updated_at, lo
+-- scan incrementale rilegge gli sheet con sede o giorni lavorativi diversi da quelli registrati.
+-- Le righe esistenti restano NULL: il primo scan incrementale dopo la migrazione le rilegge tutte.
+
+ALTER TABLE ras_anomaly_sheets
+  ADD COLUMN IF NOT EXISTS site      TEXT,          -- employees.site letto dallo scan
+  ADD COLUMN IF NOT EXISTS work_days SMALLINT[];    -- giorni lavorativi del mese per quella sede
@@ -0,0 +1,114 @@
+"""
+Manutenzione delle partizioni mensili di ras_lines (db/migrations/0003).
+
+  python db/partitions.py list                      # partizioni, righe stimate, dimensione
+  python db/partitions.py ensure [--ahead 3]        # mesi con sheet + i prossimi N (job mensile)
+  python db/partitions.py detach --before 202401 [--archive-schema archive | --drop]
+
+ensure sposta anche nella partizione nuova le righe finite in ras_lines_default, e rifà ANALYZE
+del padre: autovacuum analizza le partizioni ma mai la tabella partizionata.
+
+detach: i mesi staccati spariscono dai riepiloghi raw (use_rollup=False); i rollup restano.
+Non CONCURRENTLY (non ammesso con la partizione default): lock breve sul padre, con
+lock_timeout e tentativi come db/migrate.py.
+"""
+import argparse
+import re
+import sys
+
+from migrate import DSN, _with_retries, connect
+
+_PARTITION_RE = re.compile(r"^ras_lines_y(\d{4})m(\d{2})$")
+
+_LIST_SQL = """
+SELECT c.relname,
+       pg_get_expr(c.relpartbound, c.oid) AS bound,
+       GREATEST(c.reltuples, 0)::bigint AS rows_estimate,
+       pg_size_pretty(pg_total_relation_size(c.oid)) AS size
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = 'ras_lines'::regclass
+ORDER BY c.relname
+"""
+
+
+def partitions(conn) -> list[str]:
+    return [r[0] for r in conn.execute(_LIST_SQL)]
+
+
+def cmd_list(conn, args) -> int:
+    for name, bound, rows, size in conn.execute(_LIST_SQL):
+        print(f"{name:22s} {bound:45s} {rows:>10d} righe  {size}")
+    return 0
+
+
+def cmd_ensure(conn, args) -> int:
+    created = _with_retries(
+        lambda: conn.execute("SELECT ras_lines_ensure_partitions(%s)", (args.ahead,)).fetchall(),
+        args.retries, args.retry_backoff,
+    )
+    for (name,) in created:
+        print(f"creata {name}")
+    conn.execute("ANALYZE ras_lines")
+    default_rows = conn.execute("SELECT count(*) FROM ras_lines_default").fetchone()[0]
+    if default_rows:
+        # ym fuori da qualunque mese con sheet: dati incoerenti, non spostati
+        print(f"ATTENZIONE {default_rows} righe in ras_lines_default")
+    print(f"{len(created)} partizioni create")
+    return 0
+
+
+def cmd_detach(conn, args) -> int:
+    old = []
+    for name in partitions(conn):
+        m = _PARTITION_RE.match(name)
+        if m and int(m.group(1)) * 100 + int(m.group(2)) < args.before:
+            old.append(name)
+    if not old:
+        print(f"nessuna partizione prima di {args.before}")
+        return 0
+    if args.archive_schema:
+        conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{args.archive_schema}"')
+    for name in old:
+        _with_retries(lambda: conn.execute(f'ALTER TABLE ras_lines DETACH PARTITION "{name}"'),
+                      args.retries, args.retry_backoff)
+        if args.drop:
+            conn.execute(f'DROP TABLE "{name}"')
+            print(f"{name}: staccata e cancellata")
+        elif args.archive_schema:
+            conn.execute(f'ALTER TABLE "{name}" SET SCHEMA "{args.archive_schema}"')
+            print(f"{name}: staccata in {args.archive_schema}.{name}")
+        else:
+            print(f"{name}: staccata")
+    return 0
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Partizioni mensili di ras_lines.")
+    p.add_argument("--dsn", default=DSN)
+    p.add_argument("--lock-timeout", default="5s", help="lock_timeout per sessione (default 5s)")
+    p.add_argument("--retries", type=int, default=5, help="tentativi dopo un lock timeout")
+    p.add_argument("--retry-backoff", type=float, default=2.0, help="secondi, raddoppiati a ogni tentativo")
+    sub = p.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="partizioni esistenti")
+    ensure = sub.add_parser("ensure", help="crea le partizioni mancanti")
+    ensure.add_argument("--ahead", type=int, default=3, help="mesi futuri oltre il corrente (default 3)")
+    detach = sub.add_parser("detach", help="stacca le partizioni dei mesi precedenti a --before")
+    detach.add_argument("--before", type=int, required=True, help="primo mese da tenere, YYYYMM")
+    target = detach.add_mutually_exclusive_group()
+    target.add_argument("--archive-schema", default=None, help="sposta le partizioni staccate in questo schema")
+    target.add_argument("--drop", action="store_true", help="cancella le partizioni staccate")
+    return p.parse_args(argv)
+
+
+COMMANDS = {"list": cmd_list, "ensure": cmd_ensure, "detach": cmd_detach}
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with connect(args.dsn, args.lock_timeout) as conn:
+        return COMMANDS[args.command](conn, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+#!/bin/bash
+# Init del container db (docker-compose, solo al primo avvio del volume): accetta le connessioni
+# di replica per il servizio db-replica (profilo "replica"). ras_user è superuser nell'immagine.
+set -e
+echo "host replication ras_user all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -1,4 +1,5 @@
--- reset.sql
+-- reset.sql (solo sviluppo: cancella anche schema_migrations)
+-- poi: python db/migrate.py apply
 DO $$
 DECLARE r record;
 BEGIN
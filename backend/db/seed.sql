@@ -24,14 +24,20 @@ INSERT INTO ras_sheets (employee_id, year, month, sheet_status)
 VALUES ((SELECT id FROM employees WHERE email='mario.rossi@azienda.it'), 2025, 12, 'draft')
 ON CONFLICT (employee_id, year, month) DO NOTHING;
 
+-- partizione di ras_lines per il mese dello sheet
+SELECT ras_lines_ensure_partitions();
+
 WITH s AS (
-  SELECT rs.id AS sheet_id
+  SELECT rs.id AS sheet_id, rs.year * 100 + rs.month AS ym
   FROM ras_sheets rs
   JOIN employees e ON e.id = rs.employee_id
   WHERE e.email='mario.rossi@azienda.it' AND rs.year=2025 AND rs.month=12
 )
-INSERT INTO ras_lines (sheet_id, day, stato, loc, activity_desc, commessa_cdc, fase, ore_extra, tot_spese, pranzo_flag)
-SELECT sheet_id, 2, 'ITA', 'PI', 'Analisi requisiti', 'EMO-1877', 'F1',  0,   0,    'R' FROM s
-UNION ALL
-SELECT sheet_id, 3, 'ITA', 'PI', 'Sviluppo',         'EMO-1877', NULL, 1.5, 12.30, 'R' FROM s;
+INSERT INTO ras_lines (sheet_id, ym, day, stato, loc, activity_id, line_kind, commessa_id, fase, ore_extra, tot_spese, pranzo_flag)
+SELECT sheet_id, ym, day, 'ITA', 'PI', ras_activity_id(activity), ras_activity_kind(activity), ras_commessa_id(commessa),
+       fase, ore_extra, tot_spese, 'R'
+FROM s, (VALUES
+  (2, 'Analisi requisiti', 'EMO-1877', 'F1',  0,   0),
+  (3, 'Sviluppo',          'EMO-1877', NULL, 1.5, 12.30)
+) v(day, activity, commessa, fase, ore_extra, tot_spese);
 COMMIT